@@ -1,4 +1,6 @@
 import asyncio
+import json
+import signal
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 import sys
@@ -7,7 +9,52 @@ import os
 # Ensure we point to the server.py file in the current directory
 SERVER_SCRIPT = os.path.join(os.getcwd(), "server.py")
 
-async def run_pipeline_step(dry_run: bool = True):
+# Stages run as server-side jobs; the agent polls job_status this often and
+# prints one PROGRESS line per poll (parsed by the dashboard, see agent_runs.py)
+POLL_SECONDS = 1.0
+PROGRESS_PREFIX = "PROGRESS: "
+FINISHED = ("done", "failed", "cancelled")
+
+
+async def run_tool(session, tool, args, stop=None):
+    """
+    Run a pipeline tool via start_job and wait for it, printing progress.
+    Once `stop` (an asyncio.Event) is set the job is cancelled, which stops it
+    after the current lead, and its final state is still awaited.
+    """
+    async def call(name, arguments):
+        result = await session.call_tool(name, arguments=arguments)
+        if result.isError:
+            raise RuntimeError(result.content[0].text)
+        return json.loads(result.content[0].text)
+
+    job = await call("start_job", {"tool": tool, "args": args})
+    cancelled = False
+    while job["status"] not in FINISHED:
+        if stop is not None and stop.is_set() and not cancelled:
+            print(f"Stopping {tool} after the current lead...", flush=True)
+            await call("cancel_job", {"job_id": job["job_id"]})
+            cancelled = True
+        if stop is None or cancelled:
+            await asyncio.sleep(POLL_SECONDS)
+        else:
+            # Wakes early on stop so the cancel goes out straight away
+            try:
+                await asyncio.wait_for(stop.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        job = await call("job_status", {"job_id": job["job_id"]})
+        progress = {key: job[key] for key in ("tool", "status", "progress", "total", "message")}
+        print(PROGRESS_PREFIX + json.dumps(progress), flush=True)
+
+    if job["status"] == "failed":
+        raise RuntimeError(f"{tool} failed: {job['error']}")
+    return job
+
+
+async def run_pipeline_step(dry_run: bool = True, campaign: str | None = None, stop: asyncio.Event | None = None):
+    # Every tool call is routed to the campaign's shard
+    scope = {"campaign": campaign} if campaign else {}
 
     # Connect to the MCP Server
     server_params = StdioServerParameters(
@@ -22,7 +69,7 @@ async def run_pipeline_step(dry_run: bool = True):
             
             # Step 1: Check Status
             # We call the 'get_pipeline_status' tool from our server
-            status_result = await session.call_tool("get_pipeline_status")
+            status_result = await session.call_tool("get_pipeline_status", arguments=scope)
             stats = status_result.content[0].text
             print(f"Current Pipeline Status: {stats}")
             
@@ -33,28 +80,44 @@ async def run_pipeline_step(dry_run: bool = True):
             # AGENT LOGIC: Decide what to do based on state hierarchy
             if stats_dict.get("NEW", 0) > 0:
                 print("DECISION: Found NEW leads. Running enrichment...")
-                await session.call_tool("enrich_leads", arguments={"mode": "offline"})
+                await run_tool(session, "enrich_leads", {"mode": "offline", **scope}, stop)
                 return "Enrichment Triggered"
                 
             elif stats_dict.get("ENRICHED", 0) > 0:
                 print("DECISION: Found ENRICHED leads. Generating messages...")
-                await session.call_tool("generate_messages")
+                await run_tool(session, "generate_messages", scope, stop)
                 return "Message Generation Triggered"
                 
-            elif stats_dict.get("MESSAGED", 0) > 0:
-                print("DECISION: Found MESSAGED leads. Sending outreach...")
-                await session.call_tool("send_outreach", arguments={"dry_run": dry_run})
+            elif (stats_dict.get("MESSAGED", 0) > 0 or stats_dict.get("SENDING", 0) > 0
+                  or stats_dict.get("RETRY_DUE", 0) > 0):
+                # Due retries are only ever drained by a send batch
+                print("DECISION: Found MESSAGED leads or due retries. Sending outreach...")
+                await run_tool(session, "send_outreach", {"dry_run": dry_run, **scope}, stop)
                 return "Outreach Triggered"
             
             else:
-                # If pipeline is empty or all sent/failed, generate more
+                # If pipeline is empty or all sent/failed (or waiting to retry), generate more
                 print("DECISION: Pipeline empty/finished. Generating new leads...")
-                await session.call_tool("generate_leads", arguments={"amount": 10})
+                await run_tool(session, "generate_leads", {"amount": 10, **scope}, stop)
                 return "New Leads Generated"
+
+
+async def main(dry_run=True, campaign=None):
+    # SIGTERM (the dashboard's Cancel) stops the running stage cleanly instead of killing it mid-batch
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, AttributeError):
+        pass  # Windows: terminate() kills the process outright
+    return await run_pipeline_step(dry_run=dry_run, campaign=campaign, stop=stop)
+
+
 if __name__ == "__main__":
     # Default is dry-run. Use --live to actually send (SMTP if configured).
     dry_run = True
     if "--live" in sys.argv:
         dry_run = False
+    # Optional: --campaign NAME targets one campaign shard
+    campaign = sys.argv[sys.argv.index("--campaign") + 1] if "--campaign" in sys.argv else None
 
-    asyncio.run(run_pipeline_step(dry_run=dry_run))
+    asyncio.run(main(dry_run=dry_run, campaign=campaign))
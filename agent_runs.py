@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from jobs import JobCancelled, JobManager
+
+# Background agent runs for the dashboard. Each run is one agent.py step in a
+# subprocess, executed as a job on a single-worker JobManager: runs queue
+# behind each other, report progress while they go, and can be cancelled
+# (queued runs never start; a running one stops after the current lead).
+AGENT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.py")
+# Must match agent.PROGRESS_PREFIX (not imported: agent pulls in the mcp client)
+PROGRESS_PREFIX = "PROGRESS: "
+POLL_SECONDS = 0.5
+# How long a cancelled run may take to stop its stage before it is killed
+CANCEL_GRACE_SECONDS = 30
+# Output lines kept per run for the dashboard's log view
+LOG_LINES = 200
+
+
+def new_run_manager():
+    """One worker, so queued runs execute in order against the latest pipeline state."""
+    return JobManager(max_workers=1)
+
+
+def run_agent_step(dry_run=True, campaign=None, progress=None, cancel=None):
+    """
+    Run one agent step and return {"decision", "returncode", "log"} (log is the
+    tail of the agent's stdout; stderr is only reported on failure). The
+    agent's PROGRESS lines are forwarded to progress(done, total, message).
+    Setting `cancel` sends SIGTERM; the agent then cancels its stage job and
+    exits once the stage has stopped, and JobCancelled is raised with the same
+    dict. Raises RuntimeError if the step fails.
+    """
+    cmd = [sys.executable, "-u", AGENT_SCRIPT]
+    if not dry_run:
+        cmd.append("--live")
+    if campaign:
+        cmd += ["--campaign", campaign]
+    proc = subprocess.Popen(
+        cmd, cwd=os.path.dirname(AGENT_SCRIPT), text=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1,
+    )
+    log, errors = deque(maxlen=LOG_LINES), deque(maxlen=LOG_LINES)
+    decision = []
+
+    def read_output():
+        for line in proc.stdout:
+            line = line.rstrip("\n")
+            if line.startswith(PROGRESS_PREFIX):
+                job = json.loads(line[len(PROGRESS_PREFIX):])
+                if progress:
+                    progress(job["progress"], job["total"], f"{job['tool']}: {job['message'] or job['status']}")
+                continue
+            log.append(line)
+            if line.startswith("DECISION:"):
+                decision.append(line[len("DECISION:"):].strip())
+                if progress:
+                    progress(0, None, decision[-1])
+
+    # Both pipes are drained so a chatty child can never block on a full pipe
+    readers = [
+        threading.Thread(target=read_output, daemon=True),
+        threading.Thread(target=errors.extend, args=(proc.stderr,), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    kill_at = None
+    while True:
+        try:
+            proc.wait(timeout=POLL_SECONDS)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        if cancel is not None and cancel.is_set():
+            if kill_at is None:
+                proc.terminate()
+                kill_at = time.monotonic() + CANCEL_GRACE_SECONDS
+            elif time.monotonic() > kill_at:
+                proc.kill()
+    for reader in readers:
+        reader.join()
+
+    result = {"decision": decision[-1] if decision else None, "returncode": proc.returncode, "log": list(log)}
+    if kill_at is not None:
+        raise JobCancelled(result)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Agent step exited with code {proc.returncode}: " + "".join(list(errors)[-5:]).strip())
+    return result
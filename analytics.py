@@ -0,0 +1,223 @@
+import json
+import os
+import sys
+import threading
+import time
+import duckdb
+import pandas as pd
+import database
+
+# Columnar copy of the leads table used by the dashboard and reporting,
+# so aggregations never scan (or lock) the pipeline's leads.db. DuckDB lets
+# one process at a time open the file for writing, so the dashboard owns it
+# and refreshes it itself; there is no separate refresher process.
+ANALYTICS_DB = "analytics.duckdb"
+
+# Minimum seconds between incremental refreshes triggered by readers
+SNAPSHOT_TTL = 60
+EXPORT_PAGE_SIZE = 5000
+# last_updated is stamped before the writer commits, so a row can become visible
+# with a timestamp below the watermark. Each refresh re-reads this far back.
+LATE_COMMIT_SECONDS = 300
+
+SNAPSHOT_COLUMNS = [
+    "id", "company_name", "role", "industry", "country", "status",
+    "company_size", "confidence_score", "enrichment_source", "persona", "last_updated",
+]
+
+# Columns reports may group by
+DIMENSIONS = ("industry", "role", "country", "status", "company_size", "enrichment_source", "persona")
+
+
+def snapshot_path(campaign=None):
+    """Each campaign shard gets its own snapshot file next to it."""
+    if campaign in (None, database.DEFAULT_CAMPAIGN):
+        return ANALYTICS_DB
+    return os.path.join(database.CAMPAIGNS_DIR, f"{campaign}.duckdb")
+
+
+def connect(path=None, campaign=None):
+    """Open the snapshot store, creating its tables on first use."""
+    con = duckdb.connect(path or snapshot_path(campaign))
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS leads_snapshot (
+            id BIGINT PRIMARY KEY,
+            company_name VARCHAR,
+            role VARCHAR,
+            industry VARCHAR,
+            country VARCHAR,
+            status VARCHAR,
+            company_size VARCHAR,
+            confidence_score INTEGER,
+            enrichment_source VARCHAR,
+            persona VARCHAR,
+            last_updated VARCHAR
+        )
+    ''')
+    con.execute("CREATE TABLE IF NOT EXISTS snapshot_meta (key VARCHAR PRIMARY KEY, value VARCHAR)")
+    return con
+
+
+# snapshot path -> thread running refresh_in_background for it
+_refreshing = {}
+_refreshing_lock = threading.Lock()
+
+
+def _get_meta(con, key, default=None):
+    row = con.execute("SELECT value FROM snapshot_meta WHERE key = ?", [key]).fetchone()
+    return row[0] if row else default
+
+
+def _set_meta(con, key, value):
+    con.execute("INSERT OR REPLACE INTO snapshot_meta VALUES (?, ?)", [key, str(value)])
+
+
+def _flatten(row):
+    lead_id, company, role, industry, country, status, enrichment_data, last_updated = row
+    enrichment = json.loads(enrichment_data) if enrichment_data else {}
+    return (
+        lead_id, company, role, industry, country, status,
+        enrichment.get("company_size"), enrichment.get("confidence_score"),
+        enrichment.get("source"), enrichment.get("persona"), last_updated,
+    )
+
+
+def refresh_snapshot(con=None, force=False, campaign=None):
+    """
+    Copy leads changed since the last refresh into the snapshot (upsert by id)
+    and drop leads that have left the table (archived or deleted).
+
+    Rows are read from SQLite in (last_updated, id) keyset pages, so each read is
+    short and the pipeline writers are never blocked for the whole export. The
+    export starts LATE_COMMIT_SECONDS below the watermark on purpose: upserts
+    make that idempotent, and rows updated within the same second or committed
+    late are not lost.
+    Returns the number of rows exported, or None if the snapshot was still fresh.
+    """
+    own_con = con is None
+    if own_con:
+        con = connect(campaign=campaign)
+    try:
+        last_refresh = float(_get_meta(con, "refreshed_at", 0))
+        if not force and time.time() - last_refresh < SNAPSHOT_TTL:
+            return None
+
+        watermark = _get_meta(con, "watermark", "")
+        exported = 0
+
+        src = database.connect(campaign)
+        try:
+            if watermark:
+                start = src.execute("SELECT datetime(?, ?)", (watermark, f"-{LATE_COMMIT_SECONDS} seconds")).fetchone()[0]
+                key = (start or watermark, -1)
+            else:
+                key = ("", -1)
+            while True:
+                page = src.execute('''
+                    SELECT id, company_name, role, industry, country, status, enrichment_data, last_updated
+                    FROM leads
+                    WHERE (last_updated, id) > (?, ?)
+                    ORDER BY last_updated, id
+                    LIMIT ?
+                ''', (key[0], key[1], EXPORT_PAGE_SIZE)).fetchall()
+                if not page:
+                    break
+
+                frame = pd.DataFrame([_flatten(row) for row in page], columns=SNAPSHOT_COLUMNS)
+                con.register("snapshot_page", frame)
+                con.execute("INSERT OR REPLACE INTO leads_snapshot SELECT * FROM snapshot_page")
+                con.unregister("snapshot_page")
+
+                exported += len(page)
+                key = (page[-1][7] or "", page[-1][0])
+                if len(page) < EXPORT_PAGE_SIZE:
+                    break
+
+            # Every lead in the table is in the snapshot now, so any surplus is
+            # leads that were removed; only then are all ids compared
+            live = src.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+            if con.execute("SELECT COUNT(*) FROM leads_snapshot").fetchone()[0] > live:
+                ids = pd.DataFrame({"id": [row[0] for row in src.execute("SELECT id FROM leads")]}, dtype="int64")
+                con.register("live_ids", ids)
+                con.execute("DELETE FROM leads_snapshot WHERE id NOT IN (SELECT id FROM live_ids)")
+                con.unregister("live_ids")
+        finally:
+            src.close()
+
+        if exported and key[0] > watermark:
+            _set_meta(con, "watermark", key[0])
+        _set_meta(con, "refreshed_at", time.time())
+        return exported
+    finally:
+        if own_con:
+            con.close()
+
+
+def refresh_in_background(campaign=None):
+    """
+    Start refresh_snapshot (TTL-limited as usual) on a daemon thread unless one
+    is already running for this snapshot, and return at once. The dashboard
+    calls this on every render so a page never waits for an export.
+    Returns True if a refresh was started.
+    """
+    path = snapshot_path(campaign)
+    with _refreshing_lock:
+        running = _refreshing.get(path)
+        if running is not None and running.is_alive():
+            return False
+        thread = threading.Thread(
+            target=refresh_snapshot, kwargs={"campaign": campaign}, name=f"snapshot-refresh:{path}", daemon=True
+        )
+        _refreshing[path] = thread
+        thread.start()
+    return True
+
+
+def status_counts(con=None, campaign=None):
+    """Lead count per pipeline status, from the snapshot."""
+    own_con = con is None
+    if own_con:
+        con = connect(campaign=campaign)
+    try:
+        return dict(con.execute("SELECT status, COUNT(*) FROM leads_snapshot GROUP BY status").fetchall())
+    finally:
+        if own_con:
+            con.close()
+
+
+def breakdown(dimension, status=None, con=None, campaign=None):
+    """
+    Aggregate the snapshot by one dimension (see DIMENSIONS).
+    Returns a DataFrame with count and average confidence per value.
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {dimension}")
+    own_con = con is None
+    if own_con:
+        con = connect(campaign=campaign)
+    try:
+        where, params = ("WHERE status = ?", [status]) if status else ("", [])
+        return con.execute(f'''
+            SELECT COALESCE({dimension}, 'unknown') AS {dimension},
+                   COUNT(*) AS leads,
+                   ROUND(AVG(confidence_score), 1) AS avg_confidence
+            FROM leads_snapshot
+            {where}
+            GROUP BY 1
+            ORDER BY leads DESC
+        ''', params).df()
+    finally:
+        if own_con:
+            con.close()
+
+
+if __name__ == "__main__":
+    # One-shot refresh for reporting while the dashboard is not running:
+    # `python analytics.py [--campaign NAME]`
+    campaign = sys.argv[sys.argv.index("--campaign") + 1] if "--campaign" in sys.argv else None
+    try:
+        count = refresh_snapshot(force=True, campaign=campaign)
+    except duckdb.IOException as e:
+        print(f"{snapshot_path(campaign)} is in use by another process (the dashboard refreshes it itself): {e}")
+        sys.exit(1)
+    print(f"Analytics snapshot refreshed: {count} changed leads exported to {snapshot_path(campaign)}.")
@@ -1,35 +1,69 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-import subprocess
-import time
+import io
 import json
 import os
+import tempfile
 import plotly.express as px
-from database import DB_NAME
+from database import SEARCH_PAGE_SIZE, connect, export_leads_csv, get_status_counts, list_campaigns, search_leads
+import analytics
+from agent_runs import new_run_manager, run_agent_step
 
 st.set_page_config(page_title="MCP Lead Gen Dashboard", layout="wide")
 
-def get_data():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT * FROM leads", conn)
+TABLE_ROWS = 500
+# While agent runs are active the runs panel re-polls this often (status counts only)
+RUN_POLL_SECONDS = 2
+RECENT_RUNS = 8
+MAX_QUEUED_STEPS = 20
+
+@st.cache_resource
+def get_run_manager():
+    # Shared by every browser session of this dashboard process
+    return new_run_manager()
+
+runs = get_run_manager()
+
+def get_data(limit=TABLE_ROWS, campaign=None):
+    # Most recently touched leads only; aggregates come from the analytics snapshot
+    conn = connect(campaign)
+    df = pd.read_sql_query(
+        "SELECT full_name, company_name, role, status, last_updated, email FROM leads ORDER BY last_updated DESC LIMIT ?",
+        conn,
+        params=(limit,),
+    )
     conn.close()
     return df
 
-def get_stats(df):
+def export_file(campaign=None):
+    """
+    Write the campaign's CSV to a temp file and return it open for reading.
+    Passed to download_button as a callable, so it only runs when clicked;
+    the file is deleted once Streamlit closes it.
+    """
+    f = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    export_leads_csv(text, campaign=campaign)
+    text.detach()  # flushes; keeps f open
+    f.seek(0)
+    return f
+
+def get_stats(counts):
     stats = {
-        "Total": len(df),
-        "New": len(df[df['status'] == 'NEW']),
-        "Enriched": len(df[df['status'] == 'ENRICHED']),
-        "Messaged": len(df[df['status'] == 'MESSAGED']),
-        "Sent": len(df[df['status'] == 'SENT']),
-        "Failed": len(df[df['status'] == 'FAILED'])
+        "Total": sum(counts.values()),
+        "New": counts.get('NEW', 0),
+        "Enriched": counts.get('ENRICHED', 0),
+        "Messaged": counts.get('MESSAGED', 0),
+        "Sent": counts.get('SENT', 0),
+        "Failed": counts.get('FAILED', 0)
     }
     return stats
 
 # Sidebar (actions / export)
 st.sidebar.header("Actions")
 
+campaign = st.sidebar.selectbox("Campaign", list_campaigns(), index=0, key="campaign")
+
 run_mode = st.sidebar.radio(
     "Run Mode",
     ["Dry Run", "Live Run"],
@@ -38,24 +72,12 @@ run_mode = st.sidebar.radio(
 )
 st.sidebar.caption("Dry Run = logs only; Live Run = updates DB to SENT/FAILED (SMTP if configured).")
 
+steps = st.sidebar.number_input("Steps", min_value=1, max_value=MAX_QUEUED_STEPS, value=1, key="agent_steps")
 if st.sidebar.button("▶️ Run Agent Step"):
-    with st.spinner("Agent is reasoning and executing..."):
-        cmd = ["python", "agent.py"]
-        if run_mode == "Live Run":
-            cmd.append("--live")
-
-        result = subprocess.run(cmd, capture_output=True, text=True)
-
-        if result.returncode == 0:
-            st.sidebar.success("Agent Step Complete!")
-            with st.sidebar.expander("See Agent Logs"):
-                st.code(result.stdout)
-        else:
-            st.sidebar.error("Agent Failed")
-            st.sidebar.error(result.stderr)
-
-    time.sleep(1)
-    st.rerun()
+    # Runs in the background; queued steps run one after another
+    for _ in range(int(steps)):
+        runs.submit("agent_step", run_agent_step, dry_run=run_mode == "Dry Run", campaign=campaign)
+    st.sidebar.success(f"Queued {int(steps)} agent step(s). Progress is shown on the dashboard.")
 
 if st.sidebar.button("🔄 Refresh Data"):
     st.rerun()
@@ -63,16 +85,13 @@ if st.sidebar.button("🔄 Refresh Data"):
 st.sidebar.markdown("---")
 st.sidebar.header("Export")
 
-try:
-    csv_data = get_data().to_csv(index=False).encode('utf-8')
-    st.sidebar.download_button(
-        label="📥 Download CSV",
-        data=csv_data,
-        file_name="leads_export.csv",
-        mime="text/csv"
-    )
-except Exception:
-    st.sidebar.warning("No data to export yet.")
+# Streamed from SQLite to a temp file when the button is clicked, never during a render
+st.sidebar.download_button(
+    label="📥 Download CSV",
+    data=lambda: export_file(campaign),
+    file_name=f"leads_export_{campaign}.csv",
+    mime="text/csv"
+)
 
 # --- Tabs for Navigation ---
 tab_dashboard, tab_settings = st.tabs(["📊 Dashboard", "⚙️ Settings & Targeting"])
@@ -80,13 +99,55 @@ tab_dashboard, tab_settings = st.tabs(["📊 Dashboard", "⚙️ Settings & Targ
 # ==========================
 # TAB 1: DASHBOARD
 # ==========================
+def agent_runs_panel():
+    # Re-run on its own timer while runs are active; only cheap status counts are read
+    recent = runs.list()[-RECENT_RUNS:]
+    finished = {run["job_id"] for run in recent if run["status"] in ("done", "failed", "cancelled")}
+    if st.session_state.setdefault("finished_runs", finished) != finished:
+        # A run just finished: refresh the whole page (snapshot metrics, table)
+        st.session_state.finished_runs = finished
+        st.rerun()
+    if not recent:
+        return
+
+    st.write("### 🏃 Agent Runs")
+    live_counts = get_status_counts(campaign)
+    stages = st.columns(6)
+    for col, status in zip(stages, ["NEW", "ENRICHED", "MESSAGED", "SENDING", "SENT", "FAILED"]):
+        col.metric(status, live_counts.get(status, 0))
+
+    for run in reversed(recent):
+        args = run["args"]
+        label = f"{'Dry' if args['dry_run'] else 'Live'} run · {args['campaign']}"
+        r1, r2, r3 = st.columns([2, 4, 1])
+        r1.write(f"**{run['status']}** · {label}")
+        if run["status"] == "running" and run["total"]:
+            r2.progress(min(run["progress"] / run["total"], 1.0), text=run["message"])
+        elif run["status"] == "failed":
+            r2.error(run["error"])
+        else:
+            r2.write(run["message"] or (run["result"] or {}).get("decision") or "")
+        if run["status"] in ("queued", "running") and r3.button("Cancel", key=f"cancel_{run['job_id']}"):
+            runs.cancel(run["job_id"])
+        if run["result"] and run["result"]["log"]:
+            with r2.expander("Agent log"):
+                st.code("\n".join(run["result"]["log"]))
+    st.markdown("---")
+
+
 with tab_dashboard:
     st.title("🚀 MCP-Powered Lead Gen Pipeline")
 
-    # Metrics & Visuals
-    df = get_data()
-    if not df.empty:
-        stats = get_stats(df)
+    active = any(run["status"] in ("queued", "running") for run in runs.list())
+    st.fragment(agent_runs_panel, run_every=RUN_POLL_SECONDS if active else None)()
+
+    # Counts are read live (index-only GROUP BY), so they agree with the runs panel.
+    # Only the breakdown reads the columnar snapshot, refreshed in the background
+    # at most every SNAPSHOT_TTL s.
+    analytics.refresh_in_background(campaign)
+    counts = get_status_counts(campaign)
+    if counts:
+        stats = get_stats(counts)
         col1, col2, col3, col4, col5 = st.columns(5)
         col1.metric("Total Leads", stats["Total"])
         col2.metric("Enriched", stats["Enriched"])
@@ -109,10 +170,49 @@ with tab_dashboard:
 
         st.markdown("---")
         
+        st.write("### 🔍 Search Leads")
+        s1, s2 = st.columns([3, 1])
+        search_text = s1.text_input("Names, companies, roles, industries or message text", key="search_text")
+        search_status = s2.selectbox("Status", ["All"] + sorted(counts.keys()), index=0, key="search_status")
+        # Back to the first page whenever the query, filter or campaign changes
+        search_key = (search_text, search_status, campaign)
+        if st.session_state.get("search_key") != search_key:
+            st.session_state.search_key = search_key
+            st.session_state.search_offset = 0
+        if search_text.strip():
+            offset = st.session_state.search_offset
+            page = search_leads(
+                search_text,
+                status=None if search_status == "All" else search_status,
+                offset=offset,
+                campaign=campaign,
+            )
+            if page["results"]:
+                results_df = pd.DataFrame(page["results"])
+                st.dataframe(
+                    results_df[["full_name", "company_name", "role", "industry", "status", "snippet", "score"]],
+                    use_container_width=True,
+                )
+            else:
+                st.info("No matching leads.")
+            p1, p2, p3 = st.columns([1, 1, 4])
+            if p1.button("◀ Previous", disabled=offset == 0):
+                st.session_state.search_offset = max(0, offset - SEARCH_PAGE_SIZE)
+                st.rerun()
+            if p2.button("Next ▶", disabled=page["next_offset"] is None):
+                st.session_state.search_offset = page["next_offset"]
+                st.rerun()
+            if page["results"]:
+                note = "best match first" if page["ranked"] else "too many matches to rank, newest first"
+                p3.caption(f"Results {offset + 1}–{offset + len(page['results'])} ({note})")
+
+        st.markdown("---")
+
         col_table, col_graph = st.columns([2, 1])
         
         with col_table:
-            st.write("### 📋 Lead Database")
+            st.write(f"### 📋 Lead Database (latest {TABLE_ROWS})")
+            df = get_data(campaign=campaign)
             # Show "Last Action" safely (works even if DB column is missing)
             if "last_updated" in df.columns:
                 df["last_updated"] = pd.to_datetime(df["last_updated"], errors="coerce")
@@ -142,8 +242,7 @@ with tab_dashboard:
 
         with col_graph:
             st.write("### Status Distribution")
-            status_counts = df['status'].value_counts().reset_index()
-            status_counts.columns = ['Status', 'Count']
+            status_counts = pd.DataFrame(list(counts.items()), columns=['Status', 'Count'])
             
             fig = px.pie(
                 status_counts, 
@@ -155,12 +254,26 @@ with tab_dashboard:
                     "NEW": "#3498db",
                     "ENRICHED": "#f1c40f",
                     "MESSAGED": "#e67e22",
+                    "SENDING": "#9b59b6",
+                    "RETRY": "#95a5a6",
                     "SENT": "#2ecc71",
                     "FAILED": "#e74c3c"
                 }
             )
             fig.update_layout(margin=dict(l=0, r=0, t=0, b=0))
             st.plotly_chart(fig, use_container_width=True)
+
+        st.markdown("---")
+        st.write("### 🔎 Breakdown")
+        b1, b2 = st.columns(2)
+        dimension = b1.selectbox("Group by", analytics.DIMENSIONS, index=0)
+        status_filter = b2.selectbox("Status", ["All"] + sorted(counts.keys()), index=0)
+        breakdown_df = analytics.breakdown(dimension, None if status_filter == "All" else status_filter, campaign=campaign)
+        if breakdown_df.empty:
+            st.info("The analytics snapshot is still being built; breakdowns appear on the next refresh.")
+        else:
+            st.plotly_chart(px.bar(breakdown_df, x=dimension, y="leads", hover_data=["avg_confidence"]), use_container_width=True)
+            st.caption(f"From the analytics snapshot (refreshed every {analytics.SNAPSHOT_TTL}s).")
     else:
         st.info("Database is empty. Run the Agent to generate leads.")
 
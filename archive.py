@@ -0,0 +1,152 @@
+import json
+import sys
+import time
+from database import LEAD_COLUMNS, MESSAGE_COLUMNS, connect
+from jobs import JobCancelled
+
+# Hot/cold split: finished leads that have been idle for a while are moved out
+# of the leads table (which every stage scan, dashboard load and export reads)
+# into leads_archive in the same database file, messages compressed. Freed
+# pages go back to the filesystem with incremental vacuum, a batch at a time,
+# so the file tracks the active pipeline. Archived leads stay readable through
+# the all_leads view and still count as duplicates in add_leads.
+#
+#   python archive.py [--days 30] [--campaign NAME]
+#   python archive.py --convert [--campaign NAME]   (one-off, pipeline stopped)
+ARCHIVE_STATUSES = ("SENT", "FAILED")
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_BATCH_SIZE = 1000
+# FTS5 only drops a deleted lead's terms when its segments merge. After a run
+# leads_fts is merged this many pages per transaction until nothing is left.
+FTS_MERGE_PAGES = 2000
+
+
+def db_bytes(conn):
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def incremental_vacuum_enabled(conn):
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def enable_incremental_vacuum(campaign=None):
+    """
+    Switch a database created before auto_vacuum=INCREMENTAL to it: a one-off
+    full VACUUM that rewrites the file and holds its write lock throughout, so
+    run it (`python archive.py --convert`) while no stage jobs or dashboard
+    runs are writing. Never called by archive_leads. Returns True if it ran.
+    """
+    conn = connect(campaign)
+    try:
+        if incremental_vacuum_enabled(conn):
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+def merge_search_index(conn):
+    """
+    Merge leads_fts segments in FTS_MERGE_PAGES steps, each its own short
+    transaction, until a step does no work (total_changes moves by < 2).
+    """
+    steps = 0
+    while True:
+        before = conn.total_changes
+        conn.execute("INSERT INTO leads_fts (leads_fts, rank) VALUES ('merge', ?)", (-FTS_MERGE_PAGES,))
+        conn.commit()
+        steps += 1
+        if conn.total_changes - before < 2:
+            return steps
+
+
+def archive_leads(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, campaign=None,
+                  progress=None, cancel=None):
+    """
+    Move SENT/FAILED leads not updated for `older_than_days` into leads_archive,
+    `batch_size` leads per transaction, then release the freed pages (on a
+    database without incremental vacuum they stay free inside the file until
+    enable_incremental_vacuum has been run). Their
+    send_retries rows go too (nothing requeues an archived lead); lead_events
+    history stays. progress(archived, None, message) is called per batch;
+    setting `cancel` stops after the current one and raises JobCancelled with
+    the summary so far. Returns a summary dict.
+    """
+    conn = connect(campaign)
+    summary = {"archived": 0, "batches": 0, "bytes_before": db_bytes(conn)}
+    incremental = incremental_vacuum_enabled(conn)
+
+    statuses = ", ".join("?" for _ in ARCHIVE_STATUSES)
+    select = ", ".join(f"compress_message({c})" if c in MESSAGE_COLUMNS else c for c in LEAD_COLUMNS)
+    last_id = 0
+    cancelled = False
+    while True:
+        # Keyset walk over the rowid: one pass over leads per run. The unary +
+        # keeps the planner off the status index, which would re-read (and sort)
+        # every recent SENT lead on each batch.
+        ids = [row[0] for row in conn.execute(f'''
+            SELECT id FROM leads
+            WHERE id > ? AND +status IN ({statuses}) AND last_updated < datetime('now', ?)
+            ORDER BY id LIMIT ?
+        ''', (last_id, *ARCHIVE_STATUSES, f"-{int(older_than_days)} days", batch_size))]
+        if not ids:
+            break
+        if cancel is not None and cancel.is_set():
+            cancelled = True
+            break
+        last_id = ids[-1]
+        batch = json.dumps(ids)
+        # Copy, then delete, in one transaction: a lead is always in exactly one table
+        conn.execute(f'''
+            INSERT INTO leads_archive ({", ".join(LEAD_COLUMNS)}, archived_at)
+            SELECT {select}, datetime('now') FROM leads
+            WHERE id IN (SELECT value FROM json_each(?))
+        ''', (batch,))
+        conn.execute("DELETE FROM send_retries WHERE lead_id IN (SELECT value FROM json_each(?))", (batch,))
+        conn.execute("DELETE FROM leads WHERE id IN (SELECT value FROM json_each(?))", (batch,))
+        conn.commit()
+        # Hand the freed pages back. executescript steps the pragma to completion;
+        # execute() would stop after the first page.
+        conn.executescript("PRAGMA incremental_vacuum")
+
+        summary["archived"] += len(ids)
+        summary["batches"] += 1
+        if progress:
+            progress(summary["archived"], None, f"{summary['archived']} leads archived")
+
+    if summary["archived"]:
+        merge_search_index(conn)
+        conn.executescript("PRAGMA incremental_vacuum")
+    summary["bytes_after"] = db_bytes(conn)
+    conn.close()
+    print(
+        f"Archived {summary['archived']} leads in {summary['batches']} batches"
+        + f"; database {summary['bytes_before'] / 1e6:.1f}MB -> {summary['bytes_after'] / 1e6:.1f}MB."
+    )
+    if summary["archived"] and not incremental:
+        print("Freed pages stay in the file: run `python archive.py --convert` once, with the pipeline stopped.")
+    if cancelled:
+        raise JobCancelled(summary)
+    return summary
+
+
+def archived_status_counts(campaign=None):
+    """Archived lead count per status."""
+    conn = connect(campaign)
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM leads_archive GROUP BY status").fetchall())
+    conn.close()
+    return counts
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[sys.argv.index("--days") + 1]) if "--days" in sys.argv else ARCHIVE_AFTER_DAYS
+    campaign = sys.argv[sys.argv.index("--campaign") + 1] if "--campaign" in sys.argv else None
+    start = time.perf_counter()
+    if "--convert" in sys.argv:
+        converted = enable_incremental_vacuum(campaign)
+        print("Converted to incremental vacuum." if converted else "Incremental vacuum already enabled.")
+    else:
+        archive_leads(days, campaign=campaign)
+    print(f"Done in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Startup benchmark for the MCP server. The agent restarts the server for every
+# step, so import time is paid on each call. Exits non-zero when over budget.
+#
+#   python bench_startup.py            # measure, record, check budgets
+#   python bench_startup.py --runs 10
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+BENCH_FILE = "startup_bench.jsonl"
+RUNS = 5
+
+# Budgets (median over RUNS, milliseconds). Most of the import cost is the mcp
+# SDK itself; the budget is there to catch our own modules creeping back in.
+IMPORT_BUDGET_MS = 1500
+FIRST_RESPONSE_BUDGET_MS = 3000
+
+# Must not be imported until a tool actually needs them
+LAZY_MODULES = ["faker", "lead_gen", "enrichment", "message_gen", "sender", "shards", "importer", "archive", "duckdb", "pandas"]
+
+
+def import_time(module="server"):
+    """
+    Cumulative import time (ms) of `module` from `python -X importtime`, plus the
+    LAZY_MODULES that were loaded anyway.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(SERVER_SCRIPT),
+    )
+    total_us, loaded = None, set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header row
+        name = name.strip()
+        loaded.add(name.split(".")[0])
+        if name == module:
+            total_us = int(cumulative)
+    return total_us / 1000.0, sorted(loaded & set(LAZY_MODULES))
+
+
+async def first_response_time():
+    """Milliseconds from spawning server.py to the first get_pipeline_status reply."""
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    params = StdioServerParameters(command=sys.executable, args=[SERVER_SCRIPT])
+    start = time.perf_counter()
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            await session.call_tool("get_pipeline_status", arguments={})
+            return (time.perf_counter() - start) * 1000.0
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+def run(runs=RUNS):
+    imports, responses, eager = [], [], set()
+    for _ in range(runs):
+        ms, loaded = import_time()
+        imports.append(ms)
+        eager.update(loaded)
+        responses.append(asyncio.run(first_response_time()))
+
+    result = {
+        "ts": datetime.utcnow().isoformat() + "Z",
+        "runs": runs,
+        "import_ms": round(median(imports), 1),
+        "first_response_ms": round(median(responses), 1),
+        "eager_modules": sorted(eager),
+    }
+    with open(BENCH_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+    print(json.dumps(result, indent=2))
+
+    failures = []
+    if result["import_ms"] > IMPORT_BUDGET_MS:
+        failures.append(f"import {result['import_ms']}ms > {IMPORT_BUDGET_MS}ms")
+    if result["first_response_ms"] > FIRST_RESPONSE_BUDGET_MS:
+        failures.append(f"first response {result['first_response_ms']}ms > {FIRST_RESPONSE_BUDGET_MS}ms")
+    if eager:
+        failures.append(f"imported at startup: {', '.join(sorted(eager))}")
+    return failures
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[sys.argv.index("--runs") + 1]) if "--runs" in sys.argv else RUNS
+    failures = run(runs)
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    sys.exit(1 if failures else 0)
@@ -1,10 +1,15 @@
+import inspect
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import Any, Dict, Optional
 
 # Import your MCP tools directly (same functions the MCP server uses)
 # Adjust these imports if your tool functions live elsewhere
-from server import generate_leads, enrich_leads, generate_messages, send_outreach, get_pipeline_status
+from server import (
+    generate_leads, enrich_leads, generate_messages, send_outreach, get_pipeline_status, get_stage_metrics,
+    get_campaigns_status, manage_campaign, start_job, job_status, cancel_job, import_leads,
+    search_leads, archive_leads,
+)
 
 app = FastAPI(title="MCP HTTP Bridge", version="0.1")
 
@@ -16,23 +21,57 @@ class ToolCall(BaseModel):
 def health():
     return {"ok": True}
 
+@app.get("/search")
+def search(q: str, status: Optional[str] = None, limit: int = 20, offset: int = 0, campaign: Optional[str] = None):
+    try:
+        return search_leads(q, status=status, limit=limit, offset=offset, campaign=campaign)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/tool")
-def call_tool(payload: ToolCall):
+async def call_tool(payload: ToolCall):
     args = payload.args or {}
     try:
-        if payload.tool == "generate_leads":
-            return generate_leads(**args)
-        if payload.tool == "enrich_leads":
-            return enrich_leads(**args)
-        if payload.tool == "generate_messages":
-            return generate_messages(**args)
-        if payload.tool == "send_outreach":
-            return send_outreach(**args)
-        if payload.tool in ("get_status", "get_metrics", "get_pipeline_status"):
-            return get_pipeline_status(**args)
-
-        raise HTTPException(status_code=400, detail=f"Unknown tool: {payload.tool}")
+        result = _dispatch(payload.tool, args)
+        # Pipeline stages are coroutines that wait on the job executor
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    except HTTPException:
+        raise
     except TypeError as e:
         raise HTTPException(status_code=400, detail=f"Bad args for {payload.tool}: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+def _dispatch(tool, args):
+    if tool == "generate_leads":
+        return generate_leads(**args)
+    if tool == "enrich_leads":
+        return enrich_leads(**args)
+    if tool == "generate_messages":
+        return generate_messages(**args)
+    if tool == "send_outreach":
+        return send_outreach(**args)
+    if tool in ("get_status", "get_metrics", "get_pipeline_status"):
+        return get_pipeline_status(**args)
+    if tool == "get_stage_metrics":
+        return get_stage_metrics(**args)
+    if tool == "get_campaigns_status":
+        return get_campaigns_status(**args)
+    if tool == "manage_campaign":
+        return manage_campaign(**args)
+    if tool == "search_leads":
+        return search_leads(**args)
+    if tool == "import_leads":
+        return import_leads(**args)
+    if tool == "archive_leads":
+        return archive_leads(**args)
+    if tool == "start_job":
+        return start_job(**args)
+    if tool == "job_status":
+        return job_status(**args)
+    if tool == "cancel_job":
+        return cancel_job(**args)
+
+    raise HTTPException(status_code=400, detail=f"Unknown tool: {tool}")
@@ -1,12 +1,298 @@
 import sqlite3
+import csv
 import json
+import os
+import re
+import socket
+import sys
+import threading
+import uuid
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime
 
-DB_NAME = "leads.db"
+# The default campaign's database. Override with LEADGEN_DB (e.g. per test
+# worker); "memory:NAME" keeps the database in RAM for the life of the process.
+DB_NAME = os.environ.get("LEADGEN_DB", "leads.db")
+MEMORY_PREFIX = "memory:"
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
+# Campaign shards: each campaign has its own SQLite file (and write lock).
+# The "default" campaign is DB_NAME; others are listed in the registry file.
+DEFAULT_CAMPAIGN = "default"
+CAMPAIGNS_FILE = "campaigns.json"
+CAMPAIGNS_DIR = "campaigns"
+CAMPAIGN_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+LEAD_COLUMNS = (
+    "id", "full_name", "company_name", "role", "industry", "website", "email",
+    "linkedin_url", "country", "status", "enrichment_data",
+    "message_email_a", "message_email_b", "message_linkedin_a", "message_linkedin_b",
+    "last_updated", "send_key", "priority_score",
+)
+_LEAD_SLOTS = frozenset(LEAD_COLUMNS)
+# Low-cardinality fields, interned on the way into a Lead so every lead with
+# the same role/industry/country/status shares one string object
+CATEGORICAL_COLUMNS = frozenset(("role", "industry", "country", "status"))
+
+
+class Lead:
+    """
+    Compact in-memory lead: one slot per LEAD_COLUMNS entry instead of a
+    per-row dict, with categorical values interned. It reads like a dict
+    (lead["role"], lead.get(...), keys(), dict(lead)), so stage code accepts
+    either; columns that were not loaded are absent, as in a projected row.
+    """
+    __slots__ = LEAD_COLUMNS
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def row_factory(cls, columns):
+        """Function turning DB rows projected as `columns` into Leads."""
+        fields = [(name, name in CATEGORICAL_COLUMNS) for name in columns]
+        unknown = set(columns) - _LEAD_SLOTS
+        if unknown:
+            raise ValueError(f"Unknown lead columns: {sorted(unknown)}")
+        new, intern = cls.__new__, sys.intern
+
+        def make(row):
+            lead = new(cls)
+            for (name, categorical), value in zip(fields, row):
+                setattr(lead, name, intern(value) if categorical and value.__class__ is str else value)
+            return lead
+        return make
+
+    def __getitem__(self, key):
+        if key not in _LEAD_SLOTS:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in _LEAD_SLOTS:
+            raise KeyError(key)
+        if key in CATEGORICAL_COLUMNS and value.__class__ is str:
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in _LEAD_SLOTS else default
+
+    def keys(self):
+        return [name for name in LEAD_COLUMNS if hasattr(self, name)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in _LEAD_SLOTS and hasattr(self, key)
+
+    def __len__(self):
+        return len(self.keys())
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.keys()}
+
+    def to_row(self, columns=LEAD_COLUMNS):
+        """Values in `columns` order (None for fields that are not set), e.g. for executemany."""
+        return tuple(getattr(self, name, None) for name in columns)
+
+    def __eq__(self, other):
+        if isinstance(other, (Lead, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Lead({', '.join(f'{k}={v!r}' for k, v in self.to_dict().items())})"
+
+
+# Full-text search: an FTS5 index over these lead columns (external content, so
+# the text is not stored twice), kept in sync with leads by triggers
+SEARCH_COLUMNS = (
+    "full_name", "company_name", "role", "industry",
+    "message_email_a", "message_email_b", "message_linkedin_a", "message_linkedin_b",
+)
+# bm25 weight per SEARCH_COLUMNS entry: a hit on the name or company outranks one in message text
+SEARCH_WEIGHTS = (10.0, 8.0, 4.0, 2.0, 1.0, 1.0, 1.0, 1.0)
+SEARCH_PAGE_SIZE = 20
+# bm25 scores every match before sorting, so a query matching more rows than
+# this (a broad term on a big table) is listed newest-first instead of ranked
+SEARCH_RANK_LIMIT = 20_000
+
+# Archived message bodies are raw-deflate compressed against a preset dictionary
+# of the outreach templates (about 3.9x smaller than the text; plain zlib gets
+# 1.35x on messages this short). Blobs start with a format byte naming their
+# dictionary. These texts are frozen: never edit one, add a new version instead.
+MESSAGE_ZDICTS = {
+    1: (
+        "Subject: Question about  strategy\n\nHi ,\n\nSaw you're leading operations at .\n\n"
+        "Given the shift in , are you currently dealing with ? Many s I speak to are focused on this right now.\n\n"
+        "We help companies address exactly this using our new automated workflow.\n\n"
+        "Worth a 15-minute chat next Tuesday?\n\nBest,\n[Your Name]"
+        "Subject:  at ?\n\nHi ,\n\nI'm reaching out because I see you are the  at .\n\n"
+        "My team has been researching the  space and noticed that  is a major bottleneck for teams of your size ().\n\n"
+        "We have a solution that directly solves this.\n\nOpen to a brief call to discuss?\n\nCheers,\n[Your Name]"
+        "Hi , saw your work at . Are you feeling the impact of ? We help  leaders solve this. Let's connect."
+        "Hey , impressive tenure as . I'm curious if  is on your radar for Q4? I'd love to share how we fix that."
+    ).encode("utf-8"),
+}
+MESSAGE_ZDICT_VERSION = 1
+MESSAGE_COLUMNS = ("message_email_a", "message_email_b", "message_linkedin_a", "message_linkedin_b")
+
+# Identifies the process that performed a transition in lead_events
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def _ensure_column(cursor, table, column, decl):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def load_campaigns():
+    """The shard registry: {campaign: {"path", "created_at", "archived"}}."""
+    if not os.path.exists(CAMPAIGNS_FILE):
+        return {}
+    with open(CAMPAIGNS_FILE, "r") as f:
+        return json.load(f)
+
+def save_campaigns(registry):
+    # Write-then-rename so a crash never leaves a half-written registry
+    tmp = f"{CAMPAIGNS_FILE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp, CAMPAIGNS_FILE)
+
+# One open connection per in-memory database keeps it alive between connect() calls
+_memory_anchors = {}
+_memory_lock = threading.Lock()
+
+def compress_message(text):
+    """Message text -> compressed blob (None stays None)."""
+    if text is None:
+        return None
+    packer = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=MESSAGE_ZDICTS[MESSAGE_ZDICT_VERSION])
+    return bytes([MESSAGE_ZDICT_VERSION]) + packer.compress(text.encode("utf-8")) + packer.flush()
+
+
+def decompress_message(blob):
+    """Inverse of compress_message."""
+    if blob is None:
+        return None
+    unpacker = zlib.decompressobj(-15, zdict=MESSAGE_ZDICTS[blob[0]])
+    return (unpacker.decompress(blob[1:]) + unpacker.flush()).decode("utf-8")
+
+
+def sqlite_uri(path, read_only=False):
+    """URI for a database file or a "memory:NAME" database (shared within the process)."""
+    if path.startswith(MEMORY_PREFIX):
+        return f"file:/{path[len(MEMORY_PREFIX):] or 'default'}?vfs=memdb"
+    return f"file:{os.path.abspath(path)}" + ("?mode=ro" if read_only else "")
+
+def open_db(path):
+    """
+    sqlite3.connect for a file path or a "memory:NAME" database, with the
+    message (de)compression functions the archive and all_leads view use.
+    """
+    if path.startswith(MEMORY_PREFIX):
+        uri = sqlite_uri(path)
+        with _memory_lock:
+            if uri not in _memory_anchors:
+                _memory_anchors[uri] = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn = sqlite3.connect(uri, uri=True)
+    else:
+        conn = sqlite3.connect(path)
+    conn.create_function("compress_message", 1, compress_message, deterministic=True)
+    conn.create_function("decompress_message", 1, decompress_message, deterministic=True)
+    return conn
+
+def drop_memory_database(path):
+    """Free an in-memory database once nothing else has it open."""
+    anchor = _memory_anchors.pop(sqlite_uri(path), None)
+    if anchor is not None:
+        anchor.close()
+
+@contextmanager
+def memory_database(name=None):
+    """Point the default campaign at a fresh in-memory database for the duration of the block."""
+    global DB_NAME
+    path = f"{MEMORY_PREFIX}{name or uuid.uuid4().hex}"
+    previous, DB_NAME = DB_NAME, path
+    try:
+        yield path
+    finally:
+        DB_NAME = previous
+        drop_memory_database(path)
+
+def snapshot_db(dest, campaign=None):
+    """Copy a campaign's database to `dest` (a path or "memory:NAME") with SQLite's backup API."""
+    src, dst = connect(campaign), open_db(dest)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return dest
+
+def restore_db(source, campaign=None):
+    """Replace a campaign's database contents with a snapshot taken by snapshot_db."""
+    if not source.startswith(MEMORY_PREFIX) and not os.path.exists(source):
+        raise ValueError(f"No snapshot at {source}")
+    src, dst = open_db(source), connect(campaign)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+def get_db_path(campaign=None):
+    """Resolve a campaign name to its shard file (None -> the default campaign)."""
+    if campaign in (None, DEFAULT_CAMPAIGN):
+        return DB_NAME
+    entry = load_campaigns().get(campaign)
+    if entry is None:
+        raise ValueError(f"Unknown campaign: {campaign}")
+    if entry.get("archived"):
+        raise ValueError(f"Campaign {campaign} is archived")
+    return entry["path"]
+
+def connect(campaign=None):
+    """Open a connection to the shard that holds `campaign`."""
+    return open_db(get_db_path(campaign))
+
+def create_campaign(name):
+    """Register a new campaign shard and create its schema."""
+    if not CAMPAIGN_NAME.match(name) or name == DEFAULT_CAMPAIGN:
+        raise ValueError(f"Invalid campaign name: {name}")
+    registry = load_campaigns()
+    if name in registry:
+        raise ValueError(f"Campaign {name} already exists")
+    os.makedirs(CAMPAIGNS_DIR, exist_ok=True)
+    registry[name] = {
+        "path": os.path.join(CAMPAIGNS_DIR, f"{name}.db"),
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "archived": False,
+    }
+    save_campaigns(registry)
+    init_db(name)
+    return registry[name]["path"]
+
+def list_campaigns(include_archived=False):
+    names = [DEFAULT_CAMPAIGN]
+    names += [name for name, entry in load_campaigns().items() if include_archived or not entry.get("archived")]
+    return names
+
+def init_db(campaign=None):
+    conn = connect(campaign)
     cursor = conn.cursor()
+    # Lets archive.py hand freed pages back in small steps. Only takes effect on a
+    # new (empty) database; archive_leads converts existing files once.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
     # Added UNIQUE constraint to email
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS leads (
@@ -25,13 +311,133 @@ def init_db():
             message_email_b TEXT,
             message_linkedin_a TEXT,
             message_linkedin_b TEXT,
-            last_updated TIMESTAMP
+            last_updated TIMESTAMP,
+            send_key TEXT,
+            priority_score REAL NOT NULL DEFAULT 0,
+            send_owner TEXT,
+            send_claimed_at TIMESTAMP
 
         )
     ''')
+    # Columns added after the first release; ALTER existing databases in place
+    _ensure_column(cursor, "leads", "send_key", "TEXT")
+    _ensure_column(cursor, "leads", "priority_score", "REAL NOT NULL DEFAULT 0")
+    # Which send batch holds a SENDING lead, and since when (see sender.SEND_LEASE_SECONDS)
+    _ensure_column(cursor, "leads", "send_owner", "TEXT")
+    _ensure_column(cursor, "leads", "send_claimed_at", "TIMESTAMP")
+    # Stage scans page through one status in id order (the index carries the rowid)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_leads_status ON leads (status)")
+    # Stages take the top-k leads of a status by score straight off this index (no sort)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_leads_status_priority ON leads (status, priority_score DESC, id)")
+    # Incremental analytics exports read rows changed since the last snapshot
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_leads_last_updated ON leads (last_updated)")
+    # Append-only history of status transitions (one row per move between stages)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lead_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lead_id INTEGER NOT NULL,
+            from_status TEXT,
+            to_status TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            ts TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            worker TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lead_events_ts ON lead_events (ts)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lead_events_lead ON lead_events (lead_id, ts)")
+    # Durable retry queue for failed sends (see sender.py); DEAD rows are dead letters
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS send_retries (
+            lead_id INTEGER PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL,
+            last_error TEXT,
+            state TEXT NOT NULL DEFAULT 'SCHEDULED',
+            updated_at TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_send_retries_due ON send_retries (state, next_attempt_at)")
+    # Shared send rate limits (see dispatch.py): kind is 'account' or 'domain',
+    # next_at the earliest epoch second the next send may go out
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS send_rates (
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            rate_per_min REAL NOT NULL,
+            next_at REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, name)
+        )
+    ''')
+    _init_search(cursor)
+    _init_archive(cursor)
     conn.commit()
     conn.close()
-    print(f"Database {DB_NAME} initialized (Strict Mode).")
+    print(f"Database {get_db_path(campaign)} initialized (Strict Mode).")
+
+def _init_search(cursor):
+    """Create the leads_fts index and its sync triggers; backfill it on first creation."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'leads_fts'")
+    created = cursor.fetchone() is None
+    columns = ", ".join(SEARCH_COLUMNS)
+    new_values = ", ".join(f"new.{c}" for c in SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in SEARCH_COLUMNS)
+    # prefix='2 3' keeps search-as-you-type prefix queries off a full term scan
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5(
+            {columns}, content='leads', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS leads_fts_insert AFTER INSERT ON leads BEGIN
+            INSERT INTO leads_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS leads_fts_delete AFTER DELETE ON leads BEGIN
+            INSERT INTO leads_fts (leads_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+    ''')
+    # Only fires for updates that touch indexed text; status/enrichment updates skip it
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS leads_fts_update AFTER UPDATE OF {columns} ON leads BEGIN
+            INSERT INTO leads_fts (leads_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO leads_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    if created:
+        cursor.execute("INSERT INTO leads_fts (leads_fts) VALUES ('rebuild')")
+
+
+def _init_archive(cursor):
+    """
+    leads_archive holds finished leads moved out by archive.py (same ids,
+    compressed messages); all_leads reads hot and archived leads as one table.
+    all_leads calls the decompress_message function, which only connections
+    from open_db/connect register: the sqlite3 CLI, DuckDB's sqlite scanner
+    and plain sqlite3.connect fail on the view ("no such function"). They can
+    still read leads and leads_archive (message columns as compressed blobs).
+    """
+    columns = []
+    for column in LEAD_COLUMNS:
+        if column == "id":
+            columns.append("id INTEGER PRIMARY KEY")
+        elif column == "email":
+            columns.append("email TEXT UNIQUE")  # add_leads keeps skipping archived emails
+        elif column in MESSAGE_COLUMNS:
+            columns.append(f"{column} BLOB")
+        else:
+            columns.append(column)
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS leads_archive ({', '.join(columns)}, archived_at TIMESTAMP)")
+    hot = ", ".join(LEAD_COLUMNS)
+    cold = ", ".join(f"decompress_message({c}) AS {c}" if c in MESSAGE_COLUMNS else c for c in LEAD_COLUMNS)
+    cursor.execute(f'''
+        CREATE VIEW IF NOT EXISTS all_leads AS
+        SELECT {hot}, NULL AS archived_at FROM leads
+        UNION ALL
+        SELECT {cold}, archived_at FROM leads_archive
+    ''')
+
 
 def add_leads(leads_list):
     conn = sqlite3.connect(DB_NAME)
@@ -88,41 +494,315 @@ def add_leads(leads_list):
     # conn.commit()
     # conn.close()
     # print(f"Database {DB_NAME} initialized.")
-def add_leads(leads_list):
-    conn = sqlite3.connect(DB_NAME)
+def record_events(cursor, events):
+    """
+    Batch-insert status transitions into lead_events.
+    Runs on the caller's cursor so the rows commit together with the status update.
+    events: iterable of (lead_id, from_status, to_status, stage) tuples.
+    """
+    cursor.executemany('''
+        INSERT INTO lead_events (lead_id, from_status, to_status, stage, worker)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(lead_id, from_status, to_status, stage, WORKER_ID) for lead_id, from_status, to_status, stage in events])
+
+
+def add_leads(leads_list, stage="generate_leads", campaign=None):
+    conn = connect(campaign)
     cursor = conn.cursor()
-    before = conn.total_changes
+    fields = ("full_name", "company_name", "role", "industry", "website", "email", "linkedin_url", "country")
+    rows = [[lead[f] for f in fields] for lead in leads_list]
 
-    for lead in leads_list:
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO leads
-                (full_name, company_name, role, industry, website, email, linkedin_url, country, status, last_updated)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                lead['full_name'], lead['company_name'], lead['role'], lead['industry'],
-                lead['website'], lead['email'], lead['linkedin_url'], lead['country'],
-                'NEW', datetime.now()
-            ))
-        except sqlite3.Error as e:
-            print(f"Error adding lead: {e}")
+    # One statement for the whole batch: with the leads_fts triggers, every
+    # statement flushes the FTS index, so a row-at-a-time insert writes a
+    # segment per lead. RETURNING gives the ids that were not duplicates
+    # (of a lead in the pipeline or in the archive).
+    try:
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO leads ({", ".join(fields)}, status, last_updated)
+            SELECT {", ".join(f"json_extract(value, '$[{i}]')" for i in range(len(fields)))}, 'NEW', datetime('now')
+            FROM json_each(?)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM leads_archive a WHERE a.email = json_extract(value, '$[{fields.index("email")}]')
+            )
+            RETURNING id
+        ''', (json.dumps(rows),))
+        events = [(lead_id, None, 'NEW', stage) for (lead_id,) in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error adding leads: {e}")
+        events = []
 
+    record_events(cursor, events)
     conn.commit()
-    added = conn.total_changes - before
+    # One NEW event per inserted row; total_changes would also count the event rows
+    added = len(events)
     conn.close()
     print(f"Added {added} new leads to database (duplicates skipped).")
+    return added
+
+
+def iter_leads(status=None, columns=None, row_format="dict", batch_size=500, limit=None, conn=None, order="id", campaign=None):
+    """
+    Stream leads with keyset pagination (`id > last_seen`), so at most
+    `batch_size` rows are held in memory no matter how large the table is.
+
+    columns: projection to read (defaults to every column); `id` is always included.
+    row_format: "dict", "tuple" (column order as projected), "record" (namedtuple)
+    or "lead" (compact Lead objects, for stages that hold many rows).
+    conn: reuse the caller's connection, e.g. a stage that updates rows while reading;
+    otherwise a connection to `campaign`'s shard is opened.
+    order: "id", or "priority" (highest priority_score first; requires `status`,
+    and walks idx_leads_status_priority so no sort is needed).
+    """
+    cols = ["id"] + [c for c in (columns or LEAD_COLUMNS) if c != "id"]
+    unknown = set(cols) - set(LEAD_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown lead columns: {sorted(unknown)}")
+    if row_format not in ("dict", "tuple", "record", "lead"):
+        raise ValueError(f"Unknown row_format: {row_format}")
+    if order not in ("id", "priority") or (order == "priority" and not status):
+        raise ValueError(f"Unsupported order: {order}")
+
+    by_priority = order == "priority"
+    if by_priority:
+        # Keyset on (priority_score DESC, id): the <= bound seeks into the index,
+        # the OR only skips ties already returned
+        cols_sql = ", ".join(cols + ["priority_score"])
+        sql = f'''
+            SELECT {cols_sql} FROM leads
+            WHERE status = ? AND priority_score <= ? AND (priority_score < ? OR id > ?)
+            ORDER BY priority_score DESC, id LIMIT ?
+        '''
+    else:
+        where, params = ("WHERE status = ? AND id > ?", [status]) if status else ("WHERE id > ?", [])
+        sql = f"SELECT {', '.join(cols)} FROM leads {where} ORDER BY id LIMIT ?"
+
+    Record = namedtuple("LeadRecord", cols) if row_format == "record" else None
+    make_lead = Lead.row_factory(cols) if row_format == "lead" else None
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect(campaign)
+    cursor = conn.cursor()
+    cursor.row_factory = None  # plain tuples, whatever the connection's factory is
 
+    last_id = 0
+    last_score = float("inf")
+    remaining = limit
+    try:
+        while remaining is None or remaining > 0:
+            page_size = batch_size if remaining is None else min(batch_size, remaining)
+            if by_priority:
+                cursor.execute(sql, (status, last_score, last_score, last_id, page_size))
+            else:
+                cursor.execute(sql, (*params, last_id, page_size))
+            page = cursor.fetchmany(page_size)
+            if not page:
+                break
+            last_id = page[-1][0]
+            if by_priority:
+                last_score = page[-1][-1]
+                page = [row[:-1] for row in page]
+            if remaining is not None:
+                remaining -= len(page)
 
-def get_leads_by_status(status):
+            for row in page:
+                if row_format == "dict":
+                    yield dict(zip(cols, row))
+                elif row_format == "record":
+                    yield Record._make(row)
+                elif make_lead is not None:
+                    yield make_lead(row)
+                else:
+                    yield row
+
+            if len(page) < page_size:
+                break
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def get_leads_by_status(status, campaign=None):
     """Retrieve leads filtering by status."""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    return list(iter_leads(status, campaign=campaign))
+
+
+def get_status_counts(campaign=None):
+    """Lead count per status for one campaign (index-only GROUP BY)."""
+    conn = connect(campaign)
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM leads GROUP BY status").fetchall())
+    conn.close()
+    return counts
+
+
+def count_pending(conn, status, limit):
+    """Leads in `status`, capped at `limit`: how many a batch of that size will take."""
+    return conn.execute(
+        "SELECT COUNT(*) FROM (SELECT 1 FROM leads WHERE status = ? LIMIT ?)", (status, limit)
+    ).fetchone()[0]
+
+
+def count_due_retries(campaign=None):
+    """RETRY leads whose next attempt is due, i.e. what the next send batch picks up."""
+    conn = connect(campaign)
+    due = conn.execute('''
+        SELECT COUNT(*) FROM send_retries r JOIN leads l ON l.id = r.lead_id
+        WHERE r.state = 'SCHEDULED' AND r.next_attempt_at <= datetime('now') AND l.status = 'RETRY'
+    ''').fetchone()[0]
+    conn.close()
+    return due
+
+
+def export_leads_csv(fileobj, status=None, columns=None, campaign=None):
+    """Write leads as CSV to an open text file, streaming page by page."""
+    cols = ["id"] + [c for c in (columns or LEAD_COLUMNS) if c != "id"]
+    writer = csv.writer(fileobj)
+    writer.writerow(cols)
+    count = 0
+    for row in iter_leads(status, columns=cols, row_format="tuple", campaign=campaign):
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def get_stage_throughput(window_minutes=60, campaign=None):
+    """
+    Transitions per minute for each stage over the last `window_minutes`.
+    Bucketing and counting happen in SQL on the lead_events ts index.
+    """
+    conn = connect(campaign)
     cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM leads WHERE status = ?", (status,))
+    since = f"-{int(window_minutes)} minutes"
+
+    cursor.execute('''
+        SELECT stage, strftime('%Y-%m-%d %H:%M', ts) AS minute, COUNT(*)
+        FROM lead_events
+        WHERE ts >= strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+        GROUP BY stage, minute
+        ORDER BY stage, minute
+    ''', (since,))
+    rows = cursor.fetchall()
+    conn.close()
+
+    stats = {}
+    for stage, minute, count in rows:
+        entry = stats.setdefault(stage, {"total": 0, "per_minute": {}})
+        entry["total"] += count
+        entry["per_minute"][minute] = count
+    for entry in stats.values():
+        entry["avg_per_minute"] = round(entry["total"] / max(int(window_minutes), 1), 3)
+    return stats
+
+
+def get_stage_latency(window_minutes=60, campaign=None):
+    """
+    p50/p95/p99 seconds a lead spent in `from_status` before moving to `to_status`,
+    for transitions that happened in the last `window_minutes`.
+    Uses nearest-rank percentiles computed with window functions in SQL.
+    """
+    conn = connect(campaign)
+    cursor = conn.cursor()
+    since = f"-{int(window_minutes)} minutes"
+
+    cursor.execute('''
+        WITH recent AS (
+            SELECT DISTINCT lead_id FROM lead_events
+            WHERE ts >= strftime('%Y-%m-%d %H:%M:%f', 'now', ?1)
+        ),
+        hops AS (
+            SELECT e.from_status, e.to_status, e.ts,
+                   LAG(e.ts) OVER (PARTITION BY e.lead_id ORDER BY e.ts, e.id) AS prev_ts
+            FROM lead_events e JOIN recent r ON r.lead_id = e.lead_id
+        ),
+        durations AS (
+            SELECT from_status || '->' || to_status AS hop,
+                   (julianday(ts) - julianday(prev_ts)) * 86400.0 AS seconds
+            FROM hops
+            WHERE prev_ts IS NOT NULL
+              AND ts >= strftime('%Y-%m-%d %H:%M:%f', 'now', ?1)
+        ),
+        ranked AS (
+            SELECT hop, seconds,
+                   ROW_NUMBER() OVER (PARTITION BY hop ORDER BY seconds) AS rn,
+                   COUNT(*) OVER (PARTITION BY hop) AS n
+            FROM durations
+        )
+        SELECT hop, n,
+               MIN(CASE WHEN rn >= 0.50 * n THEN seconds END),
+               MIN(CASE WHEN rn >= 0.95 * n THEN seconds END),
+               MIN(CASE WHEN rn >= 0.99 * n THEN seconds END),
+               MAX(seconds)
+        FROM ranked
+        GROUP BY hop
+        ORDER BY hop
+    ''', (since,))
     rows = cursor.fetchall()
     conn.close()
-    return [dict(row) for row in rows]
+
+    return {
+        hop: {"count": n, "p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3), "max": round(mx, 3)}
+        for hop, n, p50, p95, p99, mx in rows
+    }
+
+def search_query(text):
+    """
+    Free text -> FTS5 MATCH expression: every word must match, the last one as
+    a prefix so partial input already finds results (an exact hit on it matches
+    both branches and so outranks a longer word). None if there are no words.
+    """
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    *head, last = [f'"{w}"' for w in words]
+    return " AND ".join(head + [f"({last} OR {last}*)"])
+
+
+def search_leads(query, status=None, limit=SEARCH_PAGE_SIZE, offset=0, campaign=None):
+    """
+    Ranked full-text search over names, company, role, industry and message
+    bodies. Results are best-first (weighted bm25) with a highlighted snippet
+    of the best-matching column, or newest-first when the query matches more
+    than SEARCH_RANK_LIMIT leads (ranked is False). next_offset is None on the
+    last page.
+    """
+    match = search_query(query)
+    if match is None:
+        return {"query": query, "ranked": True, "results": [], "next_offset": None}
+    limit, offset = max(1, min(int(limit), 100)), max(0, int(offset))
+    weights = ", ".join(str(w) for w in SEARCH_WEIGHTS)
+    sql = f'''
+        SELECT l.id, l.full_name, l.company_name, l.role, l.industry, l.status, l.email,
+               snippet(leads_fts, -1, '[', ']', '…', 12) AS snippet,
+               bm25(leads_fts, {weights}) AS score
+        FROM leads_fts JOIN leads l ON l.id = leads_fts.rowid
+        WHERE leads_fts MATCH ?
+    '''
+    params = [match]
+    if status:
+        sql += " AND l.status = ?"
+        params.append(status)
+
+    conn = connect(campaign)
+    conn.row_factory = sqlite3.Row
+    # Counting stops at the cap, so this stays cheap however broad the query
+    ranked = conn.execute(
+        "SELECT count(*) FROM (SELECT 1 FROM leads_fts WHERE leads_fts MATCH ? LIMIT ?)",
+        (match, SEARCH_RANK_LIMIT + 1),
+    ).fetchone()[0] <= SEARCH_RANK_LIMIT
+    sql += " ORDER BY score" if ranked else " ORDER BY leads_fts.rowid DESC"
+    # One extra row tells us whether there is another page without counting every match
+    sql += " LIMIT ? OFFSET ?"
+    params += [limit + 1, offset]
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+
+    results = [dict(row, score=round(-row["score"], 3)) for row in rows[:limit]]
+    return {
+        "query": query,
+        "ranked": ranked,
+        "results": results,
+        "next_offset": offset + limit if len(rows) > limit else None,
+    }
 
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import time
+import json
+import smtplib
+
+# Default limits. Receiving providers throttle per domain; our own provider
+# throttles per sending account (10/min matches the original global limit).
+ACCOUNT_RATE_PER_MIN = 10
+DOMAIN_RATE_PER_MIN = 6
+
+# Deferred domains never drop below this rate, and recover by this much per success
+MIN_RATE_PER_MIN = 0.5
+RECOVERY_PER_MIN = 0.5
+
+
+def email_domain(email):
+    return email.rsplit("@", 1)[-1].lower() if email else ""
+
+
+def is_deferral(exc):
+    """True for transient 4xx SMTP replies (greylisting, 421/450/451 throttling)."""
+    return isinstance(exc, smtplib.SMTPResponseException) and 400 <= exc.smtp_code < 500
+
+
+class RateLimit:
+    """
+    One shared limit (a sending account or a recipient domain): sends at most
+    one per 60 / rate_per_min seconds, the next one no earlier than `next_at`
+    (epoch seconds). Stored in the send_rates table, so every batch, job and
+    process sees the same state.
+    """
+
+    def __init__(self, nominal_rate, rate_per_min=None, next_at=0.0):
+        self.nominal_rate = nominal_rate
+        self.rate_per_min = nominal_rate if rate_per_min is None else rate_per_min
+        self.next_at = next_at
+
+    @property
+    def interval(self):
+        return 60.0 / self.rate_per_min
+
+    def slot(self, now):
+        """Earliest time a send may go out."""
+        return max(now, self.next_at)
+
+    def reserve(self, at):
+        """Book a send at `at`; the next one waits a full interval after it."""
+        self.next_at = max(self.next_at, at + self.interval)
+
+    def slow_down(self, now, factor=0.5):
+        """Multiplicative decrease after a deferral; nothing more goes out for one new interval."""
+        self.rate_per_min = max(MIN_RATE_PER_MIN, self.rate_per_min * factor)
+        self.next_at = max(self.next_at, now + self.interval)
+
+    def recover(self):
+        """Additive increase back towards the configured rate after a success."""
+        self.rate_per_min = min(self.nominal_rate, self.rate_per_min + RECOVERY_PER_MIN)
+
+
+def load_limits(cursor, kind, names, nominal_rate):
+    """name -> RateLimit for `names`; ones without a send_rates row start fresh at `nominal_rate`."""
+    names = list(dict.fromkeys(names))
+    cursor.execute('''
+        SELECT name, rate_per_min, next_at FROM send_rates
+        WHERE kind = ? AND name IN (SELECT value FROM json_each(?))
+    ''', (kind, json.dumps(names)))
+    stored = {name: (rate, next_at) for name, rate, next_at in cursor.fetchall()}
+    return {
+        name: RateLimit(nominal_rate, *stored[name]) if name in stored else RateLimit(nominal_rate)
+        for name in names
+    }
+
+
+def save_limits(cursor, kind, limits):
+    cursor.executemany('''
+        INSERT INTO send_rates (kind, name, rate_per_min, next_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (kind, name) DO UPDATE SET
+            rate_per_min = excluded.rate_per_min,
+            next_at = excluded.next_at
+    ''', [(kind, name, limit.rate_per_min, limit.next_at) for name, limit in limits.items()])
+
+
+class SendPlanner:
+    """
+    Reserves send slots against the shared per-account and per-domain limits.
+
+    Use it inside the claiming transaction (BEGIN IMMEDIATE): the limits are
+    read, advanced by plan() and written back by save() before the commit, so
+    consecutive batches and concurrent jobs or processes all book against the
+    same schedule instead of each starting with a full allowance.
+    """
+
+    def __init__(self, cursor, accounts=("default",), account_rate=ACCOUNT_RATE_PER_MIN,
+                 domain_rate=DOMAIN_RATE_PER_MIN, now=None):
+        self.cursor = cursor
+        self.now = time.time() if now is None else now
+        self.domain_rate = domain_rate
+        self.accounts = load_limits(cursor, "account", accounts, account_rate)
+        self.domains = {}
+
+    def plan(self, candidates, limit, horizon):
+        """
+        Pick up to `limit` of `candidates` (dicts with an "email"), earliest
+        possible send first, ties in candidate order, so a domain that is
+        waiting on its limit gives way to other domains. Candidates that could
+        not go out within `horizon` seconds are left. Returns
+        [(candidate, account, send_at)] in send order.
+        """
+        self.domains.update(load_limits(
+            self.cursor, "domain",
+            [email_domain(c["email"]) for c in candidates if email_domain(c["email"]) not in self.domains],
+            self.domain_rate,
+        ))
+        remaining = list(candidates)
+        planned = []
+        while remaining and len(planned) < limit:
+            # The account free soonest; ties go to the first configured
+            account = min(self.accounts, key=lambda name: self.accounts[name].next_at)
+            account_at = self.accounts[account].slot(self.now)
+            best = None
+            for i, candidate in enumerate(remaining):
+                at = self.domains[email_domain(candidate["email"])].slot(account_at)
+                if best is None or at < best[0]:
+                    best = (at, i)
+                if at == account_at:
+                    break  # nothing can go out sooner than the account allows
+            at, i = best
+            if at > self.now + horizon:
+                break
+            candidate = remaining.pop(i)
+            self.accounts[account].reserve(at)
+            self.domains[email_domain(candidate["email"])].reserve(at)
+            planned.append((candidate, account, at))
+        return planned
+
+    def save(self):
+        save_limits(self.cursor, "account", self.accounts)
+        save_limits(self.cursor, "domain", self.domains)
+
+
+def record_deferral(conn, domain, now=None, domain_rate=DOMAIN_RATE_PER_MIN):
+    """A 4xx deferral: halve the domain's shared rate and hold its sends for one new interval."""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    limits = load_limits(cursor, "domain", [domain], domain_rate)
+    limits[domain].slow_down(time.time() if now is None else now)
+    save_limits(cursor, "domain", limits)
+    conn.commit()
+
+
+def record_successes(cursor, domains, domain_rate=DOMAIN_RATE_PER_MIN):
+    """Recover the rate of slowed-down domains, one step per successful send (no commit)."""
+    cursor.executemany('''
+        UPDATE send_rates SET rate_per_min = MIN(?, rate_per_min + ?)
+        WHERE kind = 'domain' AND name = ? AND rate_per_min < ?
+    ''', [(domain_rate, RECOVERY_PER_MIN, domain, domain_rate) for domain in domains])
@@ -1,95 +1,110 @@
-import sqlite3
 import json
-import random
-from database import DB_NAME
+from datetime import date
+from database import connect, count_pending, iter_leads, record_events
+from jobs import JobCancelled
+from priority import load_weights, score_lead
+from rules import PAIN_POINTS, TRIGGERS, get_engine
+from seeding import lead_rng
 
-# Heuristic Data (Offline Mode Rules)
-PAIN_POINTS = {
-    "Technology": ["Legacy system integration", "High cloud infrastructure costs", "Developer retention"],
-    "Healthcare": ["HIPAA compliance data silos", "Patient scheduling inefficiencies", "Rising supply costs"],
-    "Finance": ["Regulatory reporting delays", "Data security threats", "Manual reconciliation errors"],
-    "Retail": ["Inventory mismanagement", "Supply chain visibility", "Omnichannel consistency"],
-    "Manufacturing": ["Equipment downtime", "Supply chain disruptions", "Quality control variability"]
-}
-
-TRIGGERS = [
-    "Recently expanded to new region",
-    "Hiring aggressively in engineering",
-    "Published new quarterly report",
-    "Announced strategic partnership",
-    "New leadership appointment"
-]
+# Offline rules (industry, role keywords, company patterns, country) live in
+# enrichment_rules.json and are compiled by rules.py
+ENRICH_CHUNK_SIZE = 1000
 
 def enrich_offline(lead):
-    """Rule-based enrichment using hardcoded industry patterns."""
-    industry = lead['industry']
-    
-    # Estimate size (randomized for demo purposes)
-    size = random.choice(["Small (1-50)", "Medium (51-500)", "Enterprise (500+)"])
-    
-    # Map industry to specific pain points
-    pains = PAIN_POINTS.get(industry, ["Process inefficiency", "Cost optimization"])
-    # Pick 2 random pain points
-    selected_pains = random.sample(pains, min(2, len(pains)))
-    
-    enrichment = {
-        "company_size": size,
-        "persona": f"{lead['role']} - Decision Maker",
-        "pain_points": selected_pains,
-        "buying_triggers": [random.choice(TRIGGERS)],
-        "confidence_score": random.randint(70, 95),
-        "source": "offline_rules"
-    }
-    return enrichment
+    """Rule-based enrichment for a single lead (see enrich_offline_batch)."""
+    return enrich_offline_batch([lead])[0]
+
+def enrich_offline_batch(leads, seed=None, today=None):
+    """
+    Rule-based enrichment for many leads, evaluated as one vectorized batch.
+    Deterministic per (seed, lead id, today); seed defaults to seeding.RUN_SEED
+    and today (the date trigger dates count back from) to the current date.
+    """
+    return get_engine().evaluate(leads, seed=seed, today=today)
 
-def enrich_ai(lead):
+def enrich_ai(lead, base_data=None, seed=None, today=None):
     """
     Simulates an AI enrichment call. 
     (Satisfies 'Mock Mode' requirement to avoid API keys for the demo).
     """
     # In a real app, you would call OpenAI here.
     # For now, we generate 'smarter' looking data to simulate AI.
-    base_data = enrich_offline(lead) 
+    base_data = base_data or enrich_offline_batch([lead], seed=seed, today=today)[0]
     base_data["source"] = "ai_mock"
-    base_data["confidence_score"] = random.randint(85, 99) # AI is 'more confident'
+    base_data["confidence_score"] = lead_rng(lead.get("id"), "ai_confidence", seed=seed).randint(85, 99) # AI is 'more confident'
     base_data["ai_insight"] = f"AI Analysis: {lead['company_name']} is likely prioritizing {base_data['pain_points'][0].lower()} to scale operations."
     
     return base_data
 
-def process_enrichment_batch(mode="offline", limit=50):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+# Only the columns enrichment reads; message bodies are never loaded here
+ENRICH_COLUMNS = ["id", "company_name", "role", "industry", "country"]
+
+def process_enrichment_batch(mode="offline", limit=50, campaign=None, progress=None, cancel=None, seed=None, today=None):
+    """
+    Enrich up to `limit` NEW leads in one transaction, ENRICH_CHUNK_SIZE leads
+    per rule-engine evaluation.
+    progress(done, total) is called per lead; setting the `cancel` event stops
+    after the current lead (whatever the chunk size), commits the leads finished
+    so far and raises JobCancelled with their count. `seed` overrides
+    seeding.RUN_SEED; `today` is the run date, fixed once so a run that crosses
+    midnight dates every chunk alike. Returns the count enriched.
+    """
+    today = today or date.today()
+    conn = connect(campaign)
     cursor = conn.cursor()
-    
-    # Select leads that are currently NEW
-    cursor.execute("SELECT * FROM leads WHERE status='NEW' LIMIT ?", (limit,))
-    rows = cursor.fetchall()
-    
-    if not rows:
-        print(f"No NEW leads found to enrich in {mode} mode.")
-        conn.close()
-        return
+    events = []
+    weights = load_weights()
+    total = count_pending(conn, 'NEW', limit)
+    cancelled = False
 
-    print(f"Enriching {len(rows)} leads using {mode} mode...")
-    
-    for row in rows:
-        lead = dict(row)
-        
-        if mode == "ai":
-            data = enrich_ai(lead)
-        else:
-            data = enrich_offline(lead)
-            
-        # Update the lead in the database
-        cursor.execute('''
+    def enrich_chunk(chunk):
+        """Evaluate a chunk at once, then apply it lead by lead; False once cancelled."""
+        results = enrich_offline_batch(chunk, seed=seed, today=today)
+        rows = []
+        finished = True
+        for lead, data in zip(chunk, results):
+            if cancel is not None and cancel.is_set():
+                finished = False
+                break
+            if mode == "ai":
+                data = enrich_ai(lead, data, seed=seed, today=today)
+            rows.append((json.dumps(data), score_lead(data, weights), lead['id']))
+            events.append((lead['id'], 'NEW', 'ENRICHED', 'enrich_leads'))
+            if progress:
+                progress(len(events), total)
+        # Update the leads in the database
+        cursor.executemany('''
             UPDATE leads 
-            SET enrichment_data = ?, status = 'ENRICHED', last_updated = datetime('now')
+            SET enrichment_data = ?, priority_score = ?, status = 'ENRICHED', last_updated = datetime('now')
             WHERE id = ?
-        ''', (json.dumps(data), lead['id']))
+        ''', rows)
+        return finished
+
+    # Stream leads that are currently NEW
+    chunk = []
+    for lead in iter_leads('NEW', columns=ENRICH_COLUMNS, row_format="lead", limit=limit, conn=conn, order="priority"):
+        chunk.append(lead)
+        if len(chunk) >= ENRICH_CHUNK_SIZE:
+            if not enrich_chunk(chunk):
+                cancelled = True
+                break
+            chunk = []
+    else:
+        if chunk:
+            cancelled = not enrich_chunk(chunk)
+    
+    if not events:
+        print(f"No NEW leads found to enrich in {mode} mode.")
+        conn.close()
+        return 0
         
+    record_events(cursor, events)
     conn.commit()
     conn.close()
-    print("Batch enrichment complete.")
+    print(f"Batch enrichment complete: {len(events)} leads enriched using {mode} mode.")
+    if cancelled:
+        raise JobCancelled(len(events))
+    return len(events)
 
 if __name__ == "__main__":
     # We will enrich half with offline rules and half with AI mock
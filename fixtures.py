@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import database
+from lead_gen import load_config
+
+# Populated pipeline databases for tests and benchmarks. A fixture is built once
+# (in memory), saved with the backup API, and restored in milliseconds:
+#
+#   python fixtures.py build 100000 ENRICHED
+#
+#   with database.memory_database():
+#       fixtures.load_fixture("enriched_100000")
+FIXTURES_DIR = "fixtures"
+FIXTURE_STATUSES = ("NEW", "ENRICHED", "MESSAGED")
+
+
+def fixture_path(name):
+    return os.path.join(FIXTURES_DIR, f"{name}.db")
+
+
+def synthetic_leads(count):
+    """Deterministic leads spread over the configured industries/roles (no Faker, so 100k is fast)."""
+    config = load_config()
+    pairs = [(industry, role) for industry, roles in config.items() for role in roles]
+    countries = ["United States", "United Kingdom", "Germany", "France", "India", "Canada"]
+    leads = []
+    for i in range(count):
+        industry, role = pairs[i % len(pairs)]
+        company = f"Company{i // 5}"
+        leads.append({
+            "full_name": f"Lead {i}",
+            "company_name": company,
+            "role": role,
+            "industry": industry,
+            "website": f"https://www.{company.lower()}.com",
+            "email": f"lead{i}@{company.lower()}.com",
+            "linkedin_url": f"https://www.linkedin.com/in/lead-{i}",
+            "country": countries[i % len(countries)],
+        })
+    return leads
+
+
+def build_fixture(count=100_000, status="ENRICHED", name=None, rebuild=False):
+    """
+    Build (or reuse) a fixture with `count` leads all at `status`, running the
+    real stages in an in-memory database. Returns the snapshot path.
+    """
+    import enrichment
+    import message_gen
+
+    if status not in FIXTURE_STATUSES:
+        raise ValueError(f"Fixture status must be one of {FIXTURE_STATUSES}")
+    path = fixture_path(name or f"{status.lower()}_{count}")
+    if os.path.exists(path) and not rebuild:
+        return path
+
+    with database.memory_database():
+        database.init_db()
+        database.add_leads(synthetic_leads(count))
+        if status in ("ENRICHED", "MESSAGED"):
+            enrichment.process_enrichment_batch(limit=count)
+        if status == "MESSAGED":
+            message_gen.generate_messages_batch(limit=count)
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        # Write-then-rename so a half-written fixture is never picked up
+        tmp = f"{path}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        database.snapshot_db(tmp)
+        os.replace(tmp, path)
+    return path
+
+
+def load_fixture(name, campaign=None):
+    """Restore a fixture (by name or path) into a campaign's database."""
+    path = name if os.path.exists(name) else fixture_path(name)
+    database.restore_db(path, campaign)
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "build":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+        status = sys.argv[3] if len(sys.argv) > 3 else "ENRICHED"
+        start = time.perf_counter()
+        path = build_fixture(count, status, rebuild=True)
+        print(f"Built {path} in {time.perf_counter() - start:.1f}s")
+        with database.memory_database():
+            start = time.perf_counter()
+            load_fixture(path)
+            print(f"Restored into memory in {(time.perf_counter() - start) * 1000:.1f}ms")
+    else:
+        print("usage: python fixtures.py build [COUNT] [NEW|ENRICHED|MESSAGED]")
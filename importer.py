@@ -0,0 +1,225 @@
+import csv
+import json
+import os
+import re
+import sys
+from database import add_leads
+from jobs import JobCancelled
+
+# Streaming importer for vendor lead lists (CSV or JSONL). Rows are mapped to
+# the leads schema, validated and normalized one at a time, and inserted in
+# chunks, so memory stays bounded however large the file is.
+IMPORT_CHUNK_SIZE = 5000
+# The import_leads tool only reads files from (and writes rejects into) this
+# directory; the command line takes any path
+IMPORT_DIR = os.environ.get("LEADGEN_IMPORT_DIR", "imports")
+
+IMPORT_FIELDS = ("full_name", "company_name", "role", "industry", "website", "email", "linkedin_url", "country")
+
+# Source column names recognised without an explicit mapping (case-insensitive;
+# spaces and dashes in headers count as underscores, so "Work Email" is work_email)
+COLUMN_ALIASES = {
+    "full_name": ["full_name", "name", "contact_name"],
+    "company_name": ["company_name", "company", "organization", "account"],
+    "role": ["role", "title", "job_title", "position"],
+    "industry": ["industry", "sector", "vertical"],
+    "website": ["website", "domain", "url", "company_website"],
+    "email": ["email", "email_address", "work_email", "e_mail"],
+    "linkedin_url": ["linkedin_url", "linkedin", "linkedin_profile"],
+    "country": ["country", "country_name", "location_country"],
+}
+
+HEADER_SEPARATORS = re.compile(r"[\s\-]+")
+EMAIL = re.compile(r"^[^@\s]+@[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}$")
+# Optional http(s) scheme, a dotted host, optional port and path (query/fragment dropped)
+URL = re.compile(r"^(?:https?://)?([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,})(?::\d+)?(/[^\s?#]*)?(?:[?#]\S*)?$", re.IGNORECASE)
+
+
+class RejectedRow(ValueError):
+    pass
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Cannot tell the format of {path}; pass fmt='csv' or fmt='jsonl'")
+
+
+def read_rows(path, fmt):
+    """Yield (line_number, row dict) one row at a time."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, RejectedRow(f"invalid JSON: {e.msg}")
+                    continue
+                yield line_number, row if isinstance(row, dict) else RejectedRow("not a JSON object")
+
+
+def resolve_mapping(columns, mapping=None):
+    """
+    {schema field: source column}. Explicit `mapping` entries win; remaining
+    fields are matched against COLUMN_ALIASES.
+    """
+    mapping = dict(mapping or {})
+    unknown = set(mapping) - set(IMPORT_FIELDS) - {"first_name", "last_name"}
+    if unknown:
+        raise ValueError(f"Unknown lead fields in mapping: {sorted(unknown)}")
+    by_lower = {HEADER_SEPARATORS.sub("_", column.strip().lower()): column for column in columns if column}
+    for field in IMPORT_FIELDS + ("first_name", "last_name"):
+        if field not in mapping:
+            for alias in COLUMN_ALIASES.get(field, [field]):
+                if alias in by_lower:
+                    mapping[field] = by_lower[alias]
+                    break
+    return mapping
+
+
+def normalize_email(value):
+    email = (value or "").lower()
+    if email.startswith("mailto:"):
+        email = email[len("mailto:"):]
+    if not EMAIL.match(email):
+        raise RejectedRow(f"invalid email: {value!r}")
+    return email
+
+
+def normalize_url(value, host_suffix=None):
+    """https URL with a lowercase host, or None when empty."""
+    if not value:
+        return None
+    match = URL.match(value)
+    if match is None:
+        raise RejectedRow(f"invalid URL: {value!r}")
+    host, path = match.group(1).lower(), (match.group(2) or "").rstrip("/")
+    if host_suffix and not (host == host_suffix or host.endswith("." + host_suffix)):
+        raise RejectedRow(f"not a {host_suffix} URL: {value!r}")
+    return f"https://{host}{path}"
+
+
+def _clean(value):
+    """Stripped string with runs of whitespace collapsed, or None if empty."""
+    if value is None:
+        return None
+    value = (value if isinstance(value, str) else str(value)).strip()
+    if "  " in value or "\t" in value or "\n" in value:
+        value = " ".join(value.split())
+    return value or None
+
+
+def normalize_row(row, mapping):
+    """Map one source row onto the leads schema; raises RejectedRow if unusable."""
+    values = {field: _clean(row.get(column)) for field, column in mapping.items()}
+    get = values.get
+
+    full_name = get("full_name") or " ".join(filter(None, (get("first_name"), get("last_name")))) or None
+    if not full_name:
+        raise RejectedRow("missing name")
+    return {
+        "full_name": full_name,
+        "company_name": get("company_name"),
+        "role": get("role"),
+        "industry": get("industry"),
+        "website": normalize_url(get("website")),
+        "email": normalize_email(get("email")),
+        "linkedin_url": normalize_url(get("linkedin_url"), host_suffix="linkedin.com"),
+        "country": get("country"),
+    }
+
+
+def resolve_import_path(path, import_dir=None):
+    """
+    `path` (relative to IMPORT_DIR, or absolute) with symlinks and ".." resolved.
+    Raises ValueError if it is not inside the import directory.
+    """
+    root = os.path.realpath(import_dir or IMPORT_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Import files must be inside the import directory {root}: {path}")
+    return resolved
+
+
+def import_leads(path, mapping=None, fmt=None, campaign=None, chunk_size=None, rejects_path=None,
+                 progress=None, cancel=None):
+    """
+    Stream a CSV/JSONL file into the leads table. Rejected rows go to
+    `rejects_path` (default <path>.rejects.jsonl) with their line and reason.
+    progress(rows_read, None, message) is called per chunk; setting `cancel`
+    stops after the current chunk and raises JobCancelled with the summary so
+    far. Returns a summary dict.
+    """
+    fmt = fmt or detect_format(path)
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    rejects_path = rejects_path or f"{path}.rejects.jsonl"
+    summary = {"read": 0, "imported": 0, "duplicates": 0, "rejected": 0, "rejects_path": rejects_path}
+    chunk = []
+    mappings = {}  # source columns -> resolved mapping (JSONL rows may differ)
+    cancelled = False
+
+    def flush():
+        added = add_leads(chunk, stage="import_leads", campaign=campaign)
+        summary["imported"] += added
+        summary["duplicates"] += len(chunk) - added
+        chunk.clear()
+        if progress:
+            progress(summary["read"], None, f"{summary['imported']} imported, {summary['rejected']} rejected")
+
+    with open(rejects_path, "w", encoding="utf-8") as rejects:
+        for line_number, row in read_rows(path, fmt):
+            # Stop between chunks, and only while there are rows left to import
+            if not chunk and cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            summary["read"] += 1
+            try:
+                if isinstance(row, RejectedRow):
+                    raise row
+                columns = tuple(row)
+                if columns not in mappings:
+                    mappings[columns] = resolve_mapping(columns, mapping)
+                chunk.append(normalize_row(row, mappings[columns]))
+            except RejectedRow as e:
+                summary["rejected"] += 1
+                rejects.write(json.dumps({
+                    "line": line_number, "reason": str(e), "row": row if isinstance(row, dict) else None,
+                }, ensure_ascii=False) + "\n")
+                continue
+            if len(chunk) >= chunk_size:
+                flush()
+        else:
+            if chunk:
+                flush()
+
+    if not summary["rejected"]:
+        os.remove(rejects_path)
+        summary["rejects_path"] = None
+    print(
+        f"Import of {path} complete: {summary['imported']} imported, {summary['duplicates']} duplicates, "
+        f"{summary['rejected']} rejected."
+    )
+    if cancelled:
+        raise JobCancelled(summary)
+    return summary
+
+
+if __name__ == "__main__":
+    # python importer.py FILE [--map email=Work Email,role=Title] [--campaign NAME]
+    if len(sys.argv) < 2:
+        print("usage: python importer.py FILE [--map field=column,...] [--campaign NAME]")
+        sys.exit(1)
+    mapping = None
+    if "--map" in sys.argv:
+        mapping = dict(pair.split("=", 1) for pair in sys.argv[sys.argv.index("--map") + 1].split(","))
+    campaign = sys.argv[sys.argv.index("--campaign") + 1] if "--campaign" in sys.argv else None
+    print(import_leads(sys.argv[1], mapping=mapping, campaign=campaign))
@@ -0,0 +1,129 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Long-running tool batches run here so the MCP session stays responsive
+MAX_WORKERS = 4
+# Finished jobs kept for job_status lookups
+MAX_FINISHED_JOBS = 100
+
+
+class JobCancelled(Exception):
+    """
+    Raised by a batch function that stopped early because `cancel` was set;
+    `result` is what it finished (and committed) before stopping.
+    """
+
+    def __init__(self, result=None):
+        super().__init__("cancelled")
+        self.result = result
+
+
+class Job:
+    """One background tool run: status, progress counters and a cancel flag."""
+
+    def __init__(self, tool, args):
+        self.id = uuid.uuid4().hex[:12]
+        self.tool = tool
+        self.args = args
+        self.status = "queued"  # queued -> running -> done | failed | cancelled
+        self.done = 0
+        self.total = None
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = None  # set by JobManager.submit; resolves when the job finishes
+        self._lock = threading.Lock()
+
+    def report(self, done, total=None, message=None):
+        """Progress callback handed to the batch function."""
+        with self._lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+            if message is not None:
+                self.message = message
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "tool": self.tool,
+                "args": self.args,
+                "status": self.status,
+                "progress": self.done,
+                "total": self.total,
+                "message": self.message,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """
+    Runs batch functions on a thread pool. Each function is called as
+    fn(progress=job.report, cancel=job.cancel_event, **args) and is expected to
+    check `cancel` between leads and stop cleanly (committing what it finished),
+    raising JobCancelled if it did stop early. A job whose function returns is
+    "done" even if the cancel came in after its last check.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, tool, fn, **args):
+        job = Job(tool, args)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+        job.future = self.executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+        job.status = "running"
+        try:
+            job.result = fn(progress=job.report, cancel=job.cancel_event, **job.args)
+            job.status = "done"
+        except JobCancelled as e:
+            job.result = e.result
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        finished = sorted((j for j in self.jobs.values() if j.finished), key=lambda j: j.finished_at)
+        for job in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job: {job_id}")
+        return job
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        job.cancel_event.set()
+        return job
+
+    def list(self):
+        return [job.to_dict() for job in sorted(self.jobs.values(), key=lambda j: j.created_at)]
@@ -1,12 +1,19 @@
 import random
 import json
 import os
-from faker import Faker
-from database import init_db, add_leads
+from database import Lead, init_db, add_leads
 
 # Set a seed for reproducibility
 # Faker.seed(42)
-fake = Faker()
+_fake = None
+
+def get_faker():
+    """Faker is slow to import and build, so create it on first use."""
+    global _fake
+    if _fake is None:
+        from faker import Faker
+        _fake = Faker()
+    return _fake
 
 CONFIG_FILE = "config.json"
 
@@ -20,9 +27,10 @@ def load_config():
 
 def generate_leads(count=200,seed=None):
     industries_map = load_config()
+    fake = get_faker()
     if seed is not None:
         random.seed(seed)
-        Faker.seed(seed)
+        fake.seed_instance(seed)
 
     # LOAD CONFIG DYNAMICALLY
     
@@ -44,16 +52,16 @@ def generate_leads(count=200,seed=None):
         clean_company = company.replace(' ', '').replace(',', '').replace('.', '').lower()
         email = f"{first_name.lower()}.{last_name.lower()}@{clean_company}.com"
         
-        lead = {
-            "full_name": f"{first_name} {last_name}",
-            "company_name": company,
-            "role": role,
-            "industry": industry,
-            "website": f"https://www.{clean_company}.com",
-            "email": email,
-            "linkedin_url": f"https://www.linkedin.com/in/{first_name.lower()}-{last_name.lower()}",
-            "country": fake.country()
-        }
+        lead = Lead(
+            full_name=f"{first_name} {last_name}",
+            company_name=company,
+            role=role,
+            industry=industry,
+            website=f"https://www.{clean_company}.com",
+            email=email,
+            linkedin_url=f"https://www.linkedin.com/in/{first_name.lower()}-{last_name.lower()}",
+            country=fake.country(),
+        )
         leads.append(lead)
         
     return leads
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+import httpx
+
+# Load generator for the HTTP bridge: concurrent callers replay a weighted mix
+# of /tool calls against a bridge started locally (or --url), then report
+# throughput, latency percentiles and error rates. SQLite lock contention shows
+# up as waiting (busy_timeout), not errors, so writes are reported separately
+# from reads: write p95/p99 rising while reads stay flat is the lock queue.
+#
+#   python loadtest.py --duration 30 --concurrency 16
+#   python loadtest.py --mix get_pipeline_status=8,enrich_leads=1 --url http://localhost:8000
+
+RESULTS_FILE = "loadtest_results.jsonl"
+BRIDGE_PORT = 8765
+DURATION = 20
+CONCURRENCY = 8
+# Calls go to their own campaign shard so a run never touches leads.db
+CAMPAIGN = "loadtest"
+REQUEST_TIMEOUT = 120
+
+DEFAULT_MIX = {
+    "get_pipeline_status": 6,
+    "generate_leads": 1,
+    "enrich_leads": 2,
+    "generate_messages": 1,
+    "send_outreach": 1,
+}
+
+# Dry-run only: a load test must never send
+TOOL_ARGS = {
+    "generate_leads": {"amount": 10},
+    "enrich_leads": {"mode": "offline"},
+    "generate_messages": {},
+    "get_pipeline_status": {},
+    "send_outreach": {"dry_run": True},
+}
+
+# Tools that take the SQLite write lock; the rest only read (send_outreach is a dry run)
+WRITE_TOOLS = ("generate_leads", "enrich_leads", "generate_messages")
+
+# Leads taken through to MESSAGED before the timed run, so dry-run
+# send_outreach previews real work from the first call
+SEED_LEADS = 50
+SEED_CALLS = [
+    ("generate_leads", {"amount": SEED_LEADS}),
+    ("enrich_leads", {"mode": "offline"}),
+    ("generate_messages", {}),
+]
+
+
+def parse_mix(text):
+    """"tool=weight,tool=weight" -> {tool: weight}."""
+    mix = {}
+    for part in text.split(","):
+        tool, _, weight = part.partition("=")
+        if tool not in TOOL_ARGS:
+            raise ValueError(f"Unsupported tool in mix: {tool}. Expected one of {sorted(TOOL_ARGS)}")
+        mix[tool] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile, as in database.get_stage_latency."""
+    if not sorted_values:
+        return None
+    rank = max(int(-(-pct * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, elapsed):
+    """samples are (tool, latency_seconds, ok) tuples."""
+    def stats(rows):
+        latencies = sorted(latency * 1000 for _, latency, _ in rows)
+        errors = sum(1 for _, _, ok in rows if not ok)
+        return {
+            "requests": len(rows),
+            "throughput_rps": round(len(rows) / elapsed, 2) if elapsed else 0,
+            "p50_ms": round(percentile(latencies, 50) or 0, 1),
+            "p95_ms": round(percentile(latencies, 95) or 0, 1),
+            "p99_ms": round(percentile(latencies, 99) or 0, 1),
+            "max_ms": round(latencies[-1], 1) if latencies else 0,
+            "error_rate": round(errors / len(rows), 4) if rows else 0,
+        }
+
+    tools = sorted({tool for tool, _, _ in samples})
+    return {
+        "overall": stats(samples),
+        "reads": stats([s for s in samples if s[0] not in WRITE_TOOLS]),
+        "writes": stats([s for s in samples if s[0] in WRITE_TOOLS]),
+        "tools": {tool: stats([s for s in samples if s[0] == tool]) for tool in tools},
+    }
+
+
+async def _worker(client, url, mix, deadline, rng, samples, errors):
+    tools, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        tool = rng.choices(tools, weights)[0]
+        args = dict(TOOL_ARGS[tool], campaign=CAMPAIGN)
+        start = time.perf_counter()
+        ok, detail = False, None
+        try:
+            response = await client.post(f"{url}/tool", json={"tool": tool, "args": args})
+            ok = response.status_code == 200
+            if not ok:
+                detail = response.text
+        except httpx.HTTPError as e:
+            detail = f"{type(e).__name__}: {e}"
+        if detail:
+            errors[detail[:200]] = errors.get(detail[:200], 0) + 1
+        samples.append((tool, time.perf_counter() - start, ok))
+
+
+async def run_load(url, mix, duration=DURATION, concurrency=CONCURRENCY, seed=0):
+    samples, errors = [], {}
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=httpx.Limits(max_connections=concurrency)) as client:
+        # Make sure the loadtest campaign shard exists
+        listed = await client.post(f"{url}/tool", json={"tool": "manage_campaign", "args": {"action": "list"}})
+        if CAMPAIGN not in listed.json()["campaigns"]:
+            created = await client.post(
+                f"{url}/tool", json={"tool": "manage_campaign", "args": {"action": "create", "name": CAMPAIGN}}
+            )
+            created.raise_for_status()
+        for tool, args in SEED_CALLS:
+            seeded = await client.post(f"{url}/tool", json={"tool": tool, "args": dict(args, campaign=CAMPAIGN)})
+            seeded.raise_for_status()
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(
+            _worker(client, url, mix, deadline, random.Random(seed + i), samples, errors)
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    report = summarize(samples, elapsed)
+    report["top_errors"] = dict(sorted(errors.items(), key=lambda kv: -kv[1])[:5])
+    return report
+
+
+def start_bridge(port=BRIDGE_PORT, timeout=30):
+    """Start bridge_http.py under uvicorn and wait for /health. Stage prints are discarded."""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bridge_http:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Bridge exited with code {proc.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Bridge did not become healthy in time")
+
+
+def save_result(result, path=RESULTS_FILE):
+    """Append to the results file; return the previous run with the same mix, if any."""
+    previous = None
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if row["config"]["mix"] == result["config"]["mix"]:
+                    previous = row
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+    return previous
+
+
+def print_report(result, previous=None):
+    print(f"{'tool':<22}{'req':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>7}")
+    report = result["report"]
+    rows = [(group, report[group]) for group in ("overall", "reads", "writes")] + list(report["tools"].items())
+    for tool, s in rows:
+        print(
+            f"{tool:<22}{s['requests']:>7}{s['throughput_rps']:>8}{s['p50_ms']:>9}{s['p95_ms']:>9}"
+            f"{s['p99_ms']:>9}{s['error_rate'] * 100:>7.1f}"
+        )
+    for error, count in result["report"]["top_errors"].items():
+        print(f"  {count}x {error}")
+    if previous:
+        before, after = previous["report"]["overall"], result["report"]["overall"]
+        print(f"vs {previous['ts']}: " + ", ".join(
+            f"{key} {before[key]} -> {after[key]}" for key in ("throughput_rps", "p95_ms", "p99_ms", "error_rate")
+        ))
+        if "writes" in previous["report"]:
+            before, after = previous["report"]["writes"], result["report"]["writes"]
+            print("  writes: " + ", ".join(f"{key} {before[key]} -> {after[key]}" for key in ("p95_ms", "p99_ms")))
+
+
+if __name__ == "__main__":
+    def option(name, default):
+        return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+    duration = float(option("--duration", DURATION))
+    concurrency = int(option("--concurrency", CONCURRENCY))
+    mix = parse_mix(option("--mix", ",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items())))
+    url = option("--url", None)
+
+    bridge = None
+    if url is None:
+        bridge, url = start_bridge(int(option("--port", BRIDGE_PORT)))
+    try:
+        report = asyncio.run(run_load(url, mix, duration, concurrency))
+    finally:
+        if bridge is not None:
+            bridge.terminate()
+            bridge.wait()
+
+    result = {
+        "ts": datetime.utcnow().isoformat() + "Z",
+        "config": {"url": url, "duration": duration, "concurrency": concurrency, "mix": mix},
+        "report": report,
+    }
+    print_report(result, save_result(result))
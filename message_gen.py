@@ -1,7 +1,7 @@
-import sqlite3
 import json
 import random
-from database import DB_NAME
+from database import connect, count_pending, iter_leads, record_events
+from jobs import JobCancelled
 
 # A/B Templates for Email
 EMAIL_TEMPLATES = {
@@ -47,24 +47,46 @@ def assert_word_limit(text, max_words, label):
     if words > max_words:
         raise ValueError(f"{label} exceeds {max_words} words ({words})")
 
-def generate_messages_batch(limit=50):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+# Only the columns the templates need
+MESSAGE_COLUMNS = ["id", "full_name", "company_name", "role", "industry", "enrichment_data"]
+# Leads per UPDATE: the batch stays one transaction, but only this many leads'
+# message bodies are held (and serialized) at a time
+MESSAGE_WRITE_CHUNK = 1000
+
+def generate_messages_batch(limit=50, campaign=None, progress=None, cancel=None):
+    """
+    Write A/B messages for up to `limit` ENRICHED leads in one transaction,
+    MESSAGE_WRITE_CHUNK leads per UPDATE so only one chunk of message bodies
+    is held in memory. progress/cancel behave as in
+    enrichment.process_enrichment_batch. Returns the number of leads messaged.
+    """
+    conn = connect(campaign)
     cursor = conn.cursor()
-    
-    # Get leads that are ENRICHED but not yet MESSAGED
-    cursor.execute("SELECT * FROM leads WHERE status='ENRICHED' LIMIT ?", (limit,))
-    rows = cursor.fetchall()
-    
-    if not rows:
-        print("No ENRICHED leads found to message.")
-        conn.close()
-        return
+    events, updates = [], []
+    messaged = 0
+    total = count_pending(conn, 'ENRICHED', limit)
+    cancelled = False
 
-    print(f"Generating messages for {len(rows)} leads...")
+    def flush():
+        # One UPDATE per chunk; per-row statements would each flush the leads_fts index
+        cursor.execute('''
+            UPDATE leads
+            SET
+                message_email_a = json_extract(m.value, '$[1]'),
+                message_email_b = json_extract(m.value, '$[2]'),
+                message_linkedin_a = json_extract(m.value, '$[3]'),
+                message_linkedin_b = json_extract(m.value, '$[4]'),
+                status = 'MESSAGED',
+                last_updated = datetime('now')
+            FROM json_each(?) AS m
+            WHERE leads.id = json_extract(m.value, '$[0]')
+        ''', (json.dumps(updates),))
+        record_events(cursor, events)
+        updates.clear()
+        events.clear()
     
-    for row in rows:
-        lead = dict(row)
+    # Stream leads that are ENRICHED but not yet MESSAGED, best first
+    for lead in iter_leads('ENRICHED', columns=MESSAGE_COLUMNS, row_format="lead", limit=limit, conn=conn, order="priority"):
         enrichment = json.loads(lead['enrichment_data'])
         
         # Extract data for templates
@@ -117,23 +139,31 @@ def generate_messages_batch(limit=50):
         assert_word_limit(linkedin_a, 60, "LinkedIn A")
         assert_word_limit(linkedin_b, 60, "LinkedIn B")
 
-        # Update DB
-        cursor.execute('''
-            UPDATE leads
-            SET
-                message_email_a = ?,
-                message_email_b = ?,
-                message_linkedin_a = ?,
-                message_linkedin_b = ?,
-                status = 'MESSAGED',
-                last_updated = datetime('now')
-            WHERE id = ?
-        ''', (email_a, email_b, linkedin_a, linkedin_b, lead['id']))
+        updates.append((lead['id'], email_a, email_b, linkedin_a, linkedin_b))
+        events.append((lead['id'], 'ENRICHED', 'MESSAGED', 'generate_messages'))
+        messaged += 1
+        if len(updates) >= MESSAGE_WRITE_CHUNK:
+            flush()
+        if progress:
+            progress(messaged, total)
+        if cancel is not None and cancel.is_set() and messaged < total:
+            cancelled = True
+            break
 
         
+    if not messaged:
+        print("No ENRICHED leads found to message.")
+        conn.close()
+        return 0
+
+    if updates:
+        flush()
     conn.commit()
     conn.close()
-    print("Message generation complete.")
+    print(f"Message generation complete for {messaged} leads.")
+    if cancelled:
+        raise JobCancelled(messaged)
+    return messaged
 
 if __name__ == "__main__":
     # Generate messages for all 200 enriched leads
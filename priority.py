@@ -0,0 +1,93 @@
+import json
+import os
+from datetime import date
+from database import connect
+
+# Optional overrides for DEFAULT_WEIGHTS, e.g. {"confidence": 0.7, "trigger_half_life_days": 14}
+PRIORITY_FILE = "priority.json"
+
+DEFAULT_WEIGHTS = {
+    "confidence": 0.5,
+    "company_size": 0.3,
+    "trigger_freshness": 0.2,
+    # A buying trigger loses half its value every this many days
+    "trigger_half_life_days": 30,
+}
+
+SIZE_SCORES = {
+    "Small (1-50)": 0.3,
+    "Medium (51-500)": 0.6,
+    "Enterprise (500+)": 1.0,
+}
+
+
+def load_weights():
+    """DEFAULT_WEIGHTS merged with the optional priority.json overrides."""
+    weights = dict(DEFAULT_WEIGHTS)
+    if os.path.exists(PRIORITY_FILE):
+        with open(PRIORITY_FILE, "r") as f:
+            weights.update(json.load(f))
+    return weights
+
+
+def score_lead(enrichment, weights=None, today=None):
+    """
+    Priority score in [0, 100] from confidence, company size and how recent the
+    buying trigger is. Higher scores are processed first by every stage.
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    today = today or date.today()
+
+    confidence = (enrichment.get("confidence_score") or 0) / 100.0
+    size = SIZE_SCORES.get(enrichment.get("company_size"), 0.5)
+
+    freshness = 0.0
+    if enrichment.get("trigger_detected_at"):
+        age_days = max((today - date.fromisoformat(enrichment["trigger_detected_at"])).days, 0)
+        freshness = 0.5 ** (age_days / weights["trigger_half_life_days"])
+
+    total = weights["confidence"] + weights["company_size"] + weights["trigger_freshness"]
+    if not total:
+        return 0.0
+    score = (
+        weights["confidence"] * confidence
+        + weights["company_size"] * size
+        + weights["trigger_freshness"] * freshness
+    ) / total
+    return round(100 * score, 3)
+
+
+def rescore_leads(status=None, batch_size=1000, campaign=None):
+    """
+    Recompute stored scores (trigger freshness decays over time, and weights may
+    have changed). Walks enriched leads in id pages and commits per page.
+    """
+    weights = load_weights()
+    conn = connect(campaign)
+    cursor = conn.cursor()
+    where = "AND status = ?" if status else ""
+    last_id, updated = 0, 0
+
+    while True:
+        cursor.execute(f'''
+            SELECT id, enrichment_data FROM leads
+            WHERE id > ? AND enrichment_data IS NOT NULL {where}
+            ORDER BY id LIMIT ?
+        ''', (last_id, *([status] if status else []), batch_size))
+        page = cursor.fetchall()
+        if not page:
+            break
+        cursor.executemany(
+            "UPDATE leads SET priority_score = ? WHERE id = ?",
+            [(score_lead(json.loads(data), weights), lead_id) for lead_id, data in page],
+        )
+        conn.commit()
+        updated += len(page)
+        last_id = page[-1][0]
+
+    conn.close()
+    return updated
+
+
+if __name__ == "__main__":
+    print(f"Rescored {rescore_leads()} leads.")
@@ -0,0 +1,235 @@
+import json
+import os
+import re
+from datetime import date
+import numpy as np
+from seeding import lead_integers
+
+# Offline enrichment rules. Edit enrichment_rules.json to tune enrichment
+# without code changes; DEFAULT_RULES is used when the file is missing.
+RULES_FILE = "enrichment_rules.json"
+
+PAIN_POINTS = {
+    "Technology": ["Legacy system integration", "High cloud infrastructure costs", "Developer retention"],
+    "Healthcare": ["HIPAA compliance data silos", "Patient scheduling inefficiencies", "Rising supply costs"],
+    "Finance": ["Regulatory reporting delays", "Data security threats", "Manual reconciliation errors"],
+    "Retail": ["Inventory mismanagement", "Supply chain visibility", "Omnichannel consistency"],
+    "Manufacturing": ["Equipment downtime", "Supply chain disruptions", "Quality control variability"]
+}
+
+TRIGGERS = [
+    "Recently expanded to new region",
+    "Hiring aggressively in engineering",
+    "Published new quarterly report",
+    "Announced strategic partnership",
+    "New leadership appointment"
+]
+
+DEFAULT_RULES = {
+    "company_sizes": ["Small (1-50)", "Medium (51-500)", "Enterprise (500+)"],
+    "confidence_range": [70, 95],
+    "trigger_max_age_days": 90,
+    # Used by leads no rule matches, and for outputs a matching rule leaves out
+    "default": {
+        "pain_points": ["Process inefficiency", "Cost optimization"],
+        "buying_triggers": TRIGGERS,
+        "persona": "{role} - Decision Maker",
+    },
+    "rules": [
+        {"name": industry.lower(), "industry": [industry], "pain_points": pains}
+        for industry, pains in PAIN_POINTS.items()
+    ],
+}
+
+# A rule matches when every condition it sets matches (case-insensitive):
+#   industry / country: any listed value; role_keywords: any word of the role;
+#   company_pattern: regex searched in company_name.
+# Each output comes from the first matching rule (file order) that sets it, so
+# narrow rules can override one output and leave the rest to broader rules.
+MATCH_KEYS = ("industry", "role_keywords", "company_pattern", "country")
+OUTPUT_KEYS = ("pain_points", "buying_triggers", "persona", "company_size", "confidence_boost")
+
+# Lead fields the rules read
+MATCH_COLUMNS = ("industry", "role", "company_name", "country")
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def load_rules(path=None):
+    path = path or RULES_FILE
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return DEFAULT_RULES
+
+
+class RuleEngine:
+    """
+    Rules compiled into lookup tables: for each industry, country and role word
+    a boolean row over rules. A batch is evaluated by factorizing each column,
+    looking up one row per distinct value and broadcasting, so the per-lead work
+    is numpy indexing rather than Python rule checks.
+    """
+
+    def __init__(self, spec):
+        rules = list(spec.get("rules", []))
+        for rule in rules:
+            unknown = set(rule) - set(MATCH_KEYS) - set(OUTPUT_KEYS) - {"name"}
+            if unknown:
+                raise ValueError(f"Unknown keys in rule {rule.get('name')}: {sorted(unknown)}")
+            if any(key in rule and not rule[key] for key in ("pain_points", "buying_triggers")):
+                raise ValueError(f"Rule {rule.get('name')} has an empty pain_points/buying_triggers list")
+        default = dict(DEFAULT_RULES["default"], confidence_boost=0, **spec.get("default", {}))
+        # Catch-all last, so every lead matches a rule for every output
+        rules.append(dict(default, name="default"))
+        self.rules = rules
+
+        self.company_sizes = np.array(spec.get("company_sizes", DEFAULT_RULES["company_sizes"]), dtype=object)
+        self.confidence_range = spec.get("confidence_range", DEFAULT_RULES["confidence_range"])
+        self.trigger_max_age_days = spec.get("trigger_max_age_days", DEFAULT_RULES["trigger_max_age_days"])
+
+        self.industry_table, self.industry_any = self._value_table(rules, "industry")
+        self.country_table, self.country_any = self._value_table(rules, "country")
+        self.keyword_table, self.keyword_any = self._value_table(rules, "role_keywords")
+        self.company_patterns = [
+            (i, re.compile(rule["company_pattern"], re.IGNORECASE))
+            for i, rule in enumerate(rules) if rule.get("company_pattern")
+        ]
+
+        # Which rules set each output, and the outputs as arrays indexed by rule
+        self.sets = {key: np.array([key in rule for rule in rules]) for key in OUTPUT_KEYS}
+        self.sets["company_size"][-1] = True  # default: random size
+        self.personas = [rule.get("persona") for rule in rules]
+        self.fixed_size = np.array([rule.get("company_size") for rule in rules], dtype=object)
+        self.boost = np.array([rule.get("confidence_boost", 0) for rule in rules])
+        self.pains, self.pain_counts = self._padded([rule.get("pain_points", []) for rule in rules])
+        self.triggers, self.trigger_counts = self._padded([rule.get("buying_triggers", []) for rule in rules])
+
+    @staticmethod
+    def _value_table(rules, key):
+        """value -> bool row over rules that accept it; plus the row for unlisted values."""
+        unconstrained = np.array([not rule.get(key) for rule in rules])
+        table = {}
+        for i, rule in enumerate(rules):
+            for value in rule.get(key) or []:
+                row = table.setdefault(value.lower(), unconstrained.copy())
+                row[i] = True
+        return table, unconstrained
+
+    @staticmethod
+    def _padded(lists):
+        width = max(len(values) for values in lists)
+        padded = np.array([list(values) + [None] * (width - len(values)) for values in lists], dtype=object)
+        return padded, np.array([len(values) for values in lists])
+
+    @staticmethod
+    def _factorize(values):
+        """(codes array, distinct values in first-seen order)."""
+        uniques = list(dict.fromkeys(values))
+        index = {value: i for i, value in enumerate(uniques)}
+        return np.array(list(map(index.__getitem__, values)), dtype=np.intp), uniques
+
+    def _lookup(self, values, row_for):
+        codes, uniques = self._factorize(values)
+        return np.stack([row_for((value or "").lower()) for value in uniques])[codes]
+
+    def _role_row(self, role):
+        row = self.keyword_any.copy()
+        for word in WORD.findall(role):
+            if word in self.keyword_table:
+                row |= self.keyword_table[word]
+        return row
+
+    def match(self, columns):
+        """
+        {output: index of the first matching rule that sets it} for each lead,
+        given the batch as {field: list of values}.
+        """
+        mask = self._lookup(columns["industry"], lambda v: self.industry_table.get(v, self.industry_any))
+        mask &= self._lookup(columns["country"], lambda v: self.country_table.get(v, self.country_any))
+        mask &= self._lookup(columns["role"], self._role_row)
+        if self.company_patterns:
+            companies = [name or "" for name in columns["company_name"]]
+            for i, pattern in self.company_patterns:
+                mask[:, i] &= np.fromiter(map(bool, map(pattern.search, companies)), dtype=bool, count=len(mask))
+        return {key: (mask & sets).argmax(axis=1) for key, sets in self.sets.items()}
+
+    def evaluate(self, leads, seed=None, today=None):
+        """
+        Enrichment dicts for a batch of lead dicts, in the same order. Random
+        choices are drawn per lead id (seeding.lead_integers), so a lead gets the
+        same enrichment whichever batch, shard or thread evaluates it.
+        """
+        if not leads:
+            return []
+        today = today or date.today()
+        columns = {key: [lead.get(key) for lead in leads] for key in MATCH_COLUMNS}
+        ids = [lead.get("id") or 0 for lead in leads]
+        matched = self.match(columns)
+
+        def draw(purpose, low, high):
+            return lead_integers(ids, purpose, low, high, seed=seed)
+
+        size_rule = matched["company_size"]
+        sizes = np.where(
+            self.fixed_size[size_rule] == None,  # noqa: E711 (elementwise)
+            self.company_sizes[draw("company_size", 0, len(self.company_sizes))],
+            self.fixed_size[size_rule],
+        )
+        # Two distinct pain points (or one if the rule has only one)
+        pain_rule = matched["pain_points"]
+        counts = self.pain_counts[pain_rule]
+        first = draw("pain_point", 0, counts)
+        second = (first + 1 + draw("second_pain_point", 0, np.maximum(counts - 1, 1))) % counts
+        trigger_rule = matched["buying_triggers"]
+        trigger = draw("buying_trigger", 0, self.trigger_counts[trigger_rule])
+        low, high = self.confidence_range
+        confidence = np.minimum(draw("confidence", low, high + 1) + self.boost[matched["confidence_boost"]], 100)
+        # At most trigger_max_age_days + 1 distinct dates: build each string once, share it across leads
+        ages = draw("trigger_age", 0, self.trigger_max_age_days + 1)
+        day_strings = (
+            np.datetime64(today, "D") - np.arange(self.trigger_max_age_days + 1).astype("timedelta64[D]")
+        ).astype(str).tolist()
+        detected = np.array(day_strings, dtype=object)[ages]
+
+        # Gather every output column with array indexing, then build the dicts
+        pain_a = self.pains[pain_rule, first].tolist()
+        pain_b = np.where(counts > 1, self.pains[pain_rule, second], None).tolist()
+        triggers = self.triggers[trigger_rule, trigger].tolist()
+        # Personas depend only on (rule, role): format once per distinct pair
+        role_codes, roles = self._factorize(columns["role"])
+        pairs, keys = np.unique(matched["persona"] * len(roles) + role_codes, return_inverse=True)
+        personas = np.array(
+            [self.personas[pair // len(roles)].format(role=roles[pair % len(roles)] or "") for pair in pairs.tolist()],
+            dtype=object,
+        )[keys].tolist()
+        names = np.array([rule["name"] for rule in self.rules], dtype=object)[pain_rule].tolist()
+
+        results = [
+            {
+                "company_size": size,
+                "persona": persona,
+                "pain_points": [a, b] if b is not None else [a],
+                "buying_triggers": [trig],
+                "trigger_detected_at": detected_at,
+                "confidence_score": score,
+                "source": "offline_rules",
+                "rule": name,  # the rule that supplied the pain points
+            }
+            for size, persona, a, b, trig, detected_at, score, name in zip(
+                sizes.tolist(), personas, pain_a, pain_b, triggers, detected.tolist(), confidence.tolist(), names
+            )
+        ]
+        return results
+
+
+_compiled = {}
+
+def get_engine(path=None):
+    """Compiled engine for the rules file, recompiled only when the file changes."""
+    path = path or RULES_FILE
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    cached = _compiled.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _compiled[path] = (mtime, RuleEngine(load_rules(path)))
+    return cached[1]
@@ -0,0 +1,46 @@
+import os
+import random
+import zlib
+import numpy as np
+
+# Every random draw in enrichment and simulated sending is keyed on
+# (RUN_SEED, lead id, purpose), so results do not depend on processing order,
+# batch boundaries, shards or threads. Set LEADGEN_RUN_SEED to vary a run.
+RUN_SEED = int(os.environ.get("LEADGEN_RUN_SEED", "0"))
+
+UINT64 = (1 << 64) - 1
+
+
+def lead_rng(lead_id, *purpose, seed=None):
+    """
+    random.Random for one lead and purpose, e.g. lead_rng(42, "send", attempt).
+    String seeds are hashed with SHA-512, so this is stable across processes.
+    """
+    seed = RUN_SEED if seed is None else seed
+    return random.Random(":".join(str(part) for part in (seed, lead_id, *purpose)))
+
+
+def _splitmix64(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def lead_uniforms(lead_ids, purpose, seed=None):
+    """
+    One float in [0, 1) per lead id, from a counter-based hash of (seed, purpose,
+    lead id). The vectorized counterpart of lead_rng(...).random().
+    """
+    seed = RUN_SEED if seed is None else seed
+    key = (seed * 0x100000001B3 + zlib.crc32(purpose.encode())) & UINT64
+    ids = np.asarray(lead_ids, dtype=np.int64).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        bits = _splitmix64(_splitmix64(np.uint64(key)) ^ ids)
+    return (bits >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+def lead_integers(lead_ids, purpose, low, high, seed=None):
+    """Integers in [low, high) per lead (low/high may be arrays)."""
+    span = np.asarray(high) - np.asarray(low)
+    return np.asarray(low) + (lead_uniforms(lead_ids, purpose, seed) * span).astype(np.int64)
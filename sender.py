@@ -1,8 +1,10 @@
-import sqlite3
 import time
-import random
 import logging
-from database import DB_NAME
+import uuid
+from database import WORKER_ID, Lead, connect, count_pending, iter_leads, record_events
+from dispatch import SendPlanner, email_domain, is_deferral, record_deferral, record_successes
+from jobs import JobCancelled
+from seeding import lead_rng
 import json
 from datetime import datetime
 
@@ -28,102 +30,397 @@ def log_event(event: dict):
 #     ]
 # )
 
-def send_email_smtp(to_email, subject, body):
+# Sending accounts; each gets its own ACCOUNT_RATE_PER_MIN budget (see dispatch.py)
+SENDER_ACCOUNTS = ["default"]
+
+# Send slots are wall-clock epoch seconds: the rate limits they are booked
+# against live in the database and are shared by every process
+clock = time.time
+
+# A batch claims only leads it can send within this many seconds; the rest wait
+# for a later batch, which books them against the limits as they are by then
+CLAIM_HORIZON_SECONDS = 60
+# Claiming picks the earliest sendable among up to limit * CLAIM_POOL_FACTOR
+# candidates per source, so one busy domain at the top of the priority order
+# does not hold the batch to that domain's rate
+CLAIM_POOL_FACTOR = 10
+
+# Failed sends are retried from the send_retries table with exponential backoff;
+# after MAX_ATTEMPTS the lead is dead-lettered (status FAILED, retry state DEAD)
+MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+
+def _rate_limit_sleep(seconds, cancel=None):
+    log_event({"level": "INFO", "stage": "send_outreach", "event": "rate_limit_sleep", "seconds": round(seconds, 3)})
+    if cancel is not None:
+        # Wake up as soon as the batch is cancelled
+        cancel.wait(seconds)
+    else:
+        time.sleep(seconds)
+
+# Completed leads are committed in groups of this size (one fsync per group, not per lead)
+COMMIT_EVERY = 10
+
+# A live batch owns the leads it claimed (send_owner) for this long after its last
+# renewal; it renews every SEND_LEASE_SECONDS / 2 while it runs. SENDING leads with
+# an older claim belong to a crashed run and are resumed by the next batch.
+SEND_LEASE_SECONDS = 600
+
+def send_email_smtp(to_email, subject, body, idempotency_key=None, from_account=None, lead_id=None, attempt=1):
     """
     Placeholder for real SMTP sending.
     For this assignment, we simulate success to avoid needing real credentials.
-    To make it real, you would use smtplib with Gmail App Password.
+    To make it real, you would use smtplib with Gmail App Password and set the
+    Message-ID header from `idempotency_key`, so a resend after a crash is
+    recognised as the same message.
+    The simulated failures are drawn per (lead_id, attempt), so a run is
+    reproducible however leads are batched or interleaved.
     """
     # Simulate network delay
     time.sleep(0.5) 
     
     # Simulate occasional network failure for retry logic testing
-    if random.random() < 0.1:  # 10% chance of failure
+    if lead_rng(lead_id, "send", attempt).random() < 0.1:  # 10% chance of failure
         raise Exception("SMTP Connection Timeout")
         
     return True
 
-def process_outreach_batch(dry_run=True, limit=5):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+def retry_delay(attempts):
+    """Backoff before retry number `attempts` (1-based): base * 2^(attempts-1), capped."""
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+def claim_sends(conn, limit, owner):
+    """
+    Durable checkpoint before dispatch: claim up to `limit` leads under
+    `owner`'s lease and reserve a send slot for each against the shared rate
+    limits (dispatch.SendPlanner), all in one IMMEDIATE transaction, so
+    concurrent batches book against the same limits and never claim the same
+    lead.
+
+    Candidates are SENDING leads whose lease has lapsed (a crashed or stopped
+    run's), then due retries, then MESSAGED leads by priority; the first two
+    keep their send_key, so a resend is the same message as far as the
+    provider is concerned. Of those, the earliest sendable go first, and only
+    leads that can go out within CLAIM_HORIZON_SECONDS are claimed. Returns
+    [(lead_id, from_status, account, send_at)] in send order.
+    """
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        pool = limit * CLAIM_POOL_FACTOR
+        candidates = []
+        for status, query, params in (
+            ('SENDING', '''
+                SELECT id, email FROM leads
+                WHERE status = 'SENDING' AND (send_claimed_at IS NULL OR send_claimed_at < datetime('now', ?))
+                ORDER BY priority_score DESC, id LIMIT ?
+            ''', (f"-{SEND_LEASE_SECONDS} seconds", pool)),
+            ('RETRY', '''
+                SELECT l.id, l.email FROM send_retries r JOIN leads l ON l.id = r.lead_id
+                WHERE r.state = 'SCHEDULED' AND r.next_attempt_at <= datetime('now') AND l.status = 'RETRY'
+                ORDER BY r.next_attempt_at LIMIT ?
+            ''', (pool,)),
+            # Highest priority first, read off idx_leads_status_priority
+            ('MESSAGED', "SELECT id, email FROM leads WHERE status='MESSAGED' ORDER BY priority_score DESC, id LIMIT ?", (pool,)),
+        ):
+            cursor.execute(query, params)
+            candidates += [{"id": lead_id, "email": email, "status": status} for lead_id, email in cursor.fetchall()]
+
+        planner = SendPlanner(cursor, SENDER_ACCOUNTS, now=clock())
+        plan = [
+            (lead["id"], lead["status"], account, send_at)
+            for lead, account, send_at in planner.plan(candidates, limit, CLAIM_HORIZON_SECONDS)
+        ]
+        claimed = {
+            status: json.dumps([lead_id for lead_id, from_status, _, _ in plan if from_status == status])
+            for status in ('SENDING', 'RETRY', 'MESSAGED')
+        }
+
+        # The write lock is held since BEGIN IMMEDIATE, so the statuses read above still hold
+        cursor.execute('''
+            UPDATE leads SET send_owner = ?, send_claimed_at = datetime('now')
+            WHERE id IN (SELECT value FROM json_each(?)) AND status = 'SENDING'
+        ''', (owner, claimed['SENDING']))
+        cursor.execute('''
+            UPDATE leads
+            SET status='SENDING', send_owner=?, send_claimed_at=datetime('now'), last_updated=datetime('now')
+            WHERE id IN (SELECT value FROM json_each(?)) AND status='RETRY'
+        ''', (owner, claimed['RETRY']))
+        cursor.execute('''
+            UPDATE leads
+            SET status = 'SENDING',
+                send_key = COALESCE(send_key, lower(hex(randomblob(16)))),
+                send_owner = ?,
+                send_claimed_at = datetime('now'),
+                last_updated = datetime('now')
+            WHERE id IN (SELECT value FROM json_each(?)) AND status = 'MESSAGED'
+        ''', (owner, claimed['MESSAGED']))
+        record_events(cursor, [
+            (lead_id, from_status, 'SENDING', 'send_outreach')
+            for lead_id, from_status, _, _ in plan if from_status != 'SENDING'
+        ])
+        planner.save()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return plan
+
+def renew_claims(conn, owner):
+    """Extend `owner`'s lease on the leads it still has in SENDING."""
+    conn.execute(
+        "UPDATE leads SET send_claimed_at=datetime('now') WHERE status='SENDING' AND send_owner=?",
+        (owner,),
+    )
+    conn.commit()
+
+def release_claims(conn, owner, keep=()):
+    """
+    Give up `owner`'s remaining SENDING leads (except `keep`) so the next batch
+    resumes them straight away instead of waiting for the lease to run out.
+    """
+    conn.execute('''
+        UPDATE leads SET send_owner=NULL, send_claimed_at=NULL
+        WHERE status='SENDING' AND send_owner=? AND id NOT IN (SELECT value FROM json_each(?))
+    ''', (owner, json.dumps(list(keep))))
+    conn.commit()
+
+def requeue_dead_letters(lead_ids=None, campaign=None):
+    """Give dead-lettered leads (all, or just `lead_ids`) a fresh set of attempts."""
+    conn = connect(campaign)
+    cursor = conn.cursor()
+    cursor.execute("SELECT lead_id FROM send_retries WHERE state='DEAD'")
+    dead = [row[0] for row in cursor.fetchall() if lead_ids is None or row[0] in lead_ids]
+
+    cursor.executemany('''
+        UPDATE send_retries
+        SET state='SCHEDULED', attempts=0, next_attempt_at=datetime('now'), updated_at=datetime('now')
+        WHERE lead_id=?
+    ''', [(lead_id,) for lead_id in dead])
+    cursor.executemany(
+        "UPDATE leads SET status='RETRY', last_updated=datetime('now') WHERE id=? AND status='FAILED'",
+        [(lead_id,) for lead_id in dead],
+    )
+    record_events(cursor, [(lead_id, 'FAILED', 'RETRY', 'requeue_dead_letters') for lead_id in dead])
+    conn.commit()
+    conn.close()
+    return len(dead)
+
+def _failed_attempts(cursor, lead_ids):
+    """lead_id -> failed attempts so far, for leads with a send_retries row."""
+    if not lead_ids:
+        return {}
+    placeholders = ", ".join("?" * len(lead_ids))
+    cursor.execute(f"SELECT lead_id, attempts FROM send_retries WHERE lead_id IN ({placeholders})", lead_ids)
+    return dict(cursor.fetchall())
+
+def _flush_completed(conn, pending, sent_domains):
+    """
+    Group-commit finished leads in one transaction: status updates, their events,
+    and the retry bookkeeping. pending holds (lead_id, error) with error None on success.
+    """
+    if not pending:
+        return
+    cursor = conn.cursor()
+
+    attempts = _failed_attempts(cursor, [lead_id for lead_id, error in pending if error is not None])
+
+    updates, retries = [], []
+    for lead_id, error in pending:
+        if error is None:
+            updates.append(('SENT', lead_id))
+            continue
+        attempt = attempts.get(lead_id, 0) + 1
+        if attempt >= MAX_ATTEMPTS:
+            updates.append(('FAILED', lead_id))
+            retries.append((lead_id, attempt, "+0 seconds", error, 'DEAD'))
+            log_event({"level": "ERROR", "stage": "send_outreach", "lead_id": lead_id, "event": "lead_failed", "attempts": attempt, "error": error})
+        else:
+            delay = retry_delay(attempt)
+            updates.append(('RETRY', lead_id))
+            retries.append((lead_id, attempt, f"+{delay} seconds", error, 'SCHEDULED'))
+            log_event({"level": "WARN", "stage": "send_outreach", "lead_id": lead_id, "event": "retry_scheduled", "attempts": attempt, "delay_seconds": delay, "error": error})
+
+    cursor.executemany(
+        "UPDATE leads SET status=?, last_updated=datetime('now') WHERE id=? AND status='SENDING'",
+        updates,
+    )
+    cursor.executemany(
+        "DELETE FROM send_retries WHERE lead_id=?",
+        [(lead_id,) for lead_id, error in pending if error is None],
+    )
+    cursor.executemany('''
+        INSERT INTO send_retries (lead_id, attempts, next_attempt_at, last_error, state, updated_at)
+        VALUES (?, ?, datetime('now', ?), ?, ?, datetime('now'))
+        ON CONFLICT (lead_id) DO UPDATE SET
+            attempts = excluded.attempts,
+            next_attempt_at = excluded.next_attempt_at,
+            last_error = excluded.last_error,
+            state = excluded.state,
+            updated_at = excluded.updated_at
+    ''', retries)
+    record_events(cursor, [(lead_id, 'SENDING', status, 'send_outreach') for status, lead_id in updates])
+    if sent_domains:
+        record_successes(cursor, sent_domains)
+        sent_domains.clear()
+    conn.commit()
+    log_event({"level": "INFO", "stage": "send_outreach", "event": "checkpoint", "committed": len(pending)})
+    pending.clear()
+
+# Only the columns dispatch needs
+SEND_COLUMNS = ["id", "email", "linkedin_url", "message_email_a", "message_linkedin_a", "send_key"]
+
+def claimed_leads(conn, owner):
+    """The SENDING leads `owner` holds, highest priority first."""
+    make_lead = Lead.row_factory(SEND_COLUMNS)
+    cursor = conn.execute(f'''
+        SELECT {", ".join(SEND_COLUMNS)} FROM leads
+        WHERE status='SENDING' AND send_owner=?
+        ORDER BY priority_score DESC, id
+    ''', (owner,))
+    return [make_lead(row) for row in cursor.fetchall()]
+
+def process_outreach_batch(dry_run=True, limit=5, commit_every=None, campaign=None, progress=None, cancel=None):
+    """
+    Dry-run previews, or sends, up to `limit` leads. progress(done, total) is
+    called per lead; setting `cancel` stops dispatch, checkpoints finished leads,
+    leaves the rest SENDING for the next batch and raises JobCancelled with the
+    count processed. A live batch only sends the leads it claimed itself, so
+    concurrent batches never send a lead twice. Returns the leads processed.
+    """
+    commit_every = commit_every or COMMIT_EVERY
+    conn = connect(campaign)
     cursor = conn.cursor()
     
-    # Get leads ready to send (MESSAGED status)
-    cursor.execute("SELECT * FROM leads WHERE status='MESSAGED' LIMIT ?", (limit,))
-    rows = cursor.fetchall()
-    
-    if not rows:
-        logging.info("No messages waiting in queue.")
+    if dry_run:
+        # Get leads ready to send (MESSAGED status); nothing is claimed in dry-run
+        total = count_pending(conn, 'MESSAGED', limit)
+        leads = iter_leads('MESSAGED', columns=SEND_COLUMNS, row_format="lead", limit=limit, conn=conn, order="priority")
+    else:
+        # Resume SENDING leads whose claim has lapsed (a crashed run's), then due
+        # retries, then new leads; all claimed under this batch's own token
+        owner = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+        plan = claim_sends(conn, limit, owner)
+        resumed = sum(1 for _, from_status, _, _ in plan if from_status == 'SENDING')
+        if resumed:
+            log_event({"level": "WARN", "stage": "send_outreach", "event": "resume_from_checkpoint", "leads": resumed})
+        retried = sum(1 for _, from_status, _, _ in plan if from_status == 'RETRY')
+        if retried:
+            log_event({"level": "INFO", "stage": "send_outreach", "event": "retries_due", "leads": retried})
+        leads = {lead["id"]: lead for lead in claimed_leads(conn, owner)}
+
+    logging.info(f"Starting batch of up to {limit} messages. Mode: {'DRY RUN' if dry_run else 'LIVE'}")
+
+    if dry_run:
+        processed = 0
+        for lead in leads:
+            if cancel is not None and cancel.is_set():
+                conn.close()
+                raise JobCancelled(processed)
+            processed += 1
+            log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead["id"], "email": lead["email"], "mode": "DRY_RUN", "event": "start_lead"})
+            log_event({
+                "level": "INFO",
+                "stage": "send_outreach",
+                "lead_id": lead["id"],
+                "email": lead["email"],
+                "event": "dry_run_preview",
+                "linkedin_url": lead.get("linkedin_url"),
+                "email_words": len((lead.get("message_email_a") or "").split()),
+                "linkedin_words": len((lead.get("message_linkedin_a") or "").split()),
+            })
+            # Do NOT update DB in dry-run
+            if progress:
+                progress(processed, total)
         conn.close()
-        return
+        if not processed:
+            logging.info("No messages waiting in queue.")
+        return processed
 
-    logging.info(f"Starting batch of {len(rows)} messages. Mode: {'DRY RUN' if dry_run else 'LIVE'}")
+    # Each lead goes out at the slot booked for it against the shared per-account
+    # and per-domain limits; a lead another batch took over meanwhile is skipped
+    plan = [(leads[lead_id], account, send_at) for lead_id, _, account, send_at in plan if lead_id in leads]
+    total = len(plan)
+    previous_attempts = _failed_attempts(cursor, list(leads))
+    processed = 0
+    pending = []
+    sent_domains = []
+    deferred = set()
+    in_flight = None
+    renewed_at = time.monotonic()
     
-    for row in rows:
-        lead = dict(row)
-        lead_id = lead["id"]
-        email = lead["email"]
-
-        email_body = lead.get("message_email_a") or ""
-        linkedin_body = lead.get("message_linkedin_a") or ""
-
-        try:
-            log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead_id, "email": email, "mode": "DRY_RUN" if dry_run else "LIVE", "event": "start_lead"})
-
-            if dry_run:
-                log_event({
-                    "level": "INFO",
-                    "stage": "send_outreach",
-                    "lead_id": lead_id,
-                    "email": email,
-                    "event": "dry_run_preview",
-                    "linkedin_url": lead.get("linkedin_url"),
-                    "email_words": len(email_body.split()),
-                    "linkedin_words": len(linkedin_body.split()),
-                })
-                # Do NOT update DB in dry-run
+    try:
+        for lead, account, send_at in plan:
+            if cancel is not None and cancel.is_set():
+                break
+            if email_domain(lead["email"]) in deferred:
+                # Its slot was booked at the old rate; released below for a later batch
                 continue
+            wait = send_at - clock()
+            if wait > 0:
+                _rate_limit_sleep(wait, cancel)
+                if cancel is not None and cancel.is_set():
+                    break
+            if time.monotonic() - renewed_at > SEND_LEASE_SECONDS / 2:
+                renew_claims(conn, owner)
+                renewed_at = time.monotonic()
+            processed += 1
+            lead_id = lead["id"]
+            email = lead["email"]
+            email_body = lead.get("message_email_a") or ""
 
-            max_retries = 2
-            sent = False
-            last_error = None
+            try:
+                log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead_id, "email": email, "mode": "LIVE", "event": "start_lead", "account": account})
 
-            for attempt in range(1, max_retries + 2):  # 1..3
+                # One attempt per batch; failures go to the durable retry queue so the batch moves on
                 try:
-                    log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "attempt", "attempt": attempt})
+                    log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "attempt", "send_key": lead["send_key"]})
 
                     # Send Email (Simulated)
-                    send_email_smtp(email, "Quick question", email_body)
+                    in_flight = lead_id
+                    send_email_smtp(
+                        email, "Quick question", email_body, idempotency_key=lead["send_key"], from_account=account,
+                        lead_id=lead_id, attempt=previous_attempts.get(lead_id, 0) + 1,
+                    )
 
                     # LinkedIn DM (Simulated)
                     # send_linkedin_dm(...)
 
-                    sent = True
-                    log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "attempt_success", "attempt": attempt})
-                    break
+                    pending.append((lead_id, None))
+                    sent_domains.append(email_domain(email))
+                    in_flight = None
+                    log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "lead_sent"})
                 except Exception as e:
-                    last_error = str(e)
-                    log_event({"level": "WARN", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "attempt_failed", "attempt": attempt, "error": last_error})
-                    time.sleep(1)
-
-            if sent:
-                cursor.execute("UPDATE leads SET status='SENT', last_updated=datetime('now') WHERE id=?", (lead_id,))
-                conn.commit()
-                log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "lead_sent"})
-            else:
-                cursor.execute("UPDATE leads SET status='FAILED', last_updated=datetime('now') WHERE id=?", (lead_id,))
-                conn.commit()
-                log_event({"level": "ERROR", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "lead_failed", "error": last_error})
-
-            # Rate limit: 10/min = 6s per message
-            log_event({"level": "INFO", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "rate_limit_sleep", "seconds": 6})
-            time.sleep(6)
-
-        except Exception as e:
-            log_event({"level": "ERROR", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "critical_error", "error": str(e)})
+                    if is_deferral(e):
+                        # Receiving domain is throttling us: back off that domain for every batch
+                        record_deferral(conn, email_domain(email), now=clock())
+                        deferred.add(email_domain(email))
+                    pending.append((lead_id, str(e)))
+                    in_flight = None
+                    log_event({"level": "WARN", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "attempt_failed", "deferral": is_deferral(e), "error": str(e)})
 
-    conn.close()
+                if len(pending) >= commit_every:
+                    _flush_completed(conn, pending, sent_domains)
+                if progress:
+                    progress(processed, total)
+
+            except Exception as e:
+                log_event({"level": "ERROR", "stage": "send_outreach", "lead_id": lead_id, "email": email, "event": "critical_error", "error": str(e)})
+    finally:
+        # Whatever was completed before an error is still committed. Leads never
+        # attempted are released; one interrupted mid-send keeps its claim until
+        # the lease runs out, as it may have gone out.
+        _flush_completed(conn, pending, sent_domains)
+        release_claims(conn, owner, keep=[in_flight] if in_flight is not None else ())
+        conn.close()
+    if not total:
+        logging.info("No messages waiting in queue.")
+        return 0
+    if processed < total and cancel is not None and cancel.is_set():
+        raise JobCancelled(processed)
     logging.info("Batch processing complete.")
+    return processed
 
 if __name__ == "__main__":
     # Test 1: Run a DRY RUN (Safe, no DB changes)
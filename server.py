@@ -1,14 +1,100 @@
-from mcp.server.fastmcp import FastMCP
-import sqlite3
-from database import DB_NAME, add_leads
-import lead_gen
-import enrichment
-import message_gen
-import sender
+import asyncio
+from mcp.server.fastmcp import Context, FastMCP
+from database import (
+    add_leads, count_due_retries, create_campaign, get_stage_throughput, get_stage_latency, get_status_counts, list_campaigns,
+    search_leads as _search_leads,
+)
+from jobs import JobManager
+
+# Stage modules (and Faker, via lead_gen) are imported on first use so the
+# server answers its first request quickly; see bench_startup.py.
 
 # Initialize the MCP Server
 mcp = FastMCP("Lead Gen System")
 
+# Long-running batches run on this executor instead of inside the tool call
+jobs = JobManager()
+# How often a waiting tool call forwards job progress to the client
+JOB_POLL_SECONDS = 0.5
+
+
+def _generate_leads_job(amount=10, campaign=None, progress=None, cancel=None):
+    import lead_gen
+    leads = lead_gen.generate_leads(amount)
+    added = add_leads(leads, campaign=campaign)
+    if progress:
+        progress(len(leads), amount)
+    return added
+
+
+def _enrich_leads_job(mode="offline", **kw):
+    import enrichment
+    return enrichment.process_enrichment_batch(mode=mode, limit=50, **kw)
+
+
+def _generate_messages_job(**kw):
+    import message_gen
+    return message_gen.generate_messages_batch(limit=50, **kw)
+
+
+def _send_outreach_job(dry_run=True, **kw):
+    import sender
+    return sender.process_outreach_batch(dry_run=dry_run, limit=10, **kw)
+
+
+def _import_leads_job(path, mapping=None, file_format=None, **kw):
+    import importer
+    # Tool callers only reach files in the import directory; rejects land next to the file
+    path = importer.resolve_import_path(path)
+    return importer.import_leads(path, mapping=mapping, fmt=file_format, **kw)
+
+
+def _archive_leads_job(older_than_days=30, **kw):
+    import archive
+    return archive.archive_leads(older_than_days, **kw)
+
+
+# Tool name -> batch function accepting progress/cancel callbacks
+JOB_TARGETS = {
+    "generate_leads": _generate_leads_job,
+    "enrich_leads": _enrich_leads_job,
+    "generate_messages": _generate_messages_job,
+    "send_outreach": _send_outreach_job,
+    "import_leads": _import_leads_job,
+    "archive_leads": _archive_leads_job,
+}
+
+
+def _start(tool, args):
+    if tool not in JOB_TARGETS:
+        raise ValueError(f"Unknown job tool: {tool}. Expected one of {sorted(JOB_TARGETS)}")
+    return jobs.submit(tool, JOB_TARGETS[tool], **args)
+
+
+async def _run_job(tool, args, ctx=None):
+    """
+    Run a batch on the job executor and wait for it, forwarding progress as MCP
+    progress notifications. If the tool call itself is cancelled, the job is too.
+    """
+    job = _start(tool, args)
+    finished = asyncio.wrap_future(job.future)
+    reported = None
+    try:
+        # Returns as soon as the job finishes; the timeout only paces progress updates
+        while True:
+            await asyncio.wait({finished}, timeout=JOB_POLL_SECONDS)
+            if ctx is not None and job.done != reported:
+                reported = job.done
+                await ctx.report_progress(job.done, job.total, job.message)
+            if finished.done():
+                break
+    except asyncio.CancelledError:
+        job.cancel_event.set()
+        raise
+    if job.status == "failed":
+        raise RuntimeError(f"{tool} failed: {job.error}")
+    return job
+
 # @mcp.tool()
 # def generate_leads(amount: int = 10, seed: int | None = None) -> str:
 #     """
@@ -21,12 +107,13 @@ mcp = FastMCP("Lead Gen System")
 #     add_leads(leads)
 #     return f"Successfully generated and saved {len(leads)} new leads."
 @mcp.tool()
-def generate_leads(amount: int = 10) -> str:
+async def generate_leads(amount: int = 10, campaign: str | None = None, ctx: Context | None = None) -> str:
     """
     Tool: generate_leads
     Input schema:
     {
-      "amount": number (required) — number of leads to generate
+      "amount": number (required) — number of leads to generate,
+      "campaign": string (optional) — campaign shard (default campaign if omitted)
     }
 
     Output:
@@ -37,6 +124,8 @@ def generate_leads(amount: int = 10) -> str:
     Description:
     Generates synthetic but realistic B2B leads and persists them to SQLite.
     """
+    job = await _run_job("generate_leads", {"amount": amount, "campaign": campaign}, ctx)
+    return f"Successfully generated {amount} leads and saved {job.result} new ones (duplicates skipped)."
 
 # @mcp.tool()
 # def enrich_leads(mode: str = "offline") -> str:
@@ -49,12 +138,13 @@ def generate_leads(amount: int = 10) -> str:
 #     enrichment.process_enrichment_batch(mode=mode, limit=50)
 #     return f"Batch enrichment complete using {mode} mode."
 @mcp.tool()
-def enrich_leads(mode: str = "offline") -> str:
+async def enrich_leads(mode: str = "offline", campaign: str | None = None, ctx: Context | None = None) -> str:
     """
     Tool: enrich_leads
     Input schema:
     {
-      "mode": "offline" | "ai"
+      "mode": "offline" | "ai",
+      "campaign": string (optional)
     }
 
     Output:
@@ -65,6 +155,9 @@ def enrich_leads(mode: str = "offline") -> str:
     Description:
     Enriches NEW leads with personas, company size, pain points, triggers, and confidence score.
     """
+    # Batch size of 50 for efficiency
+    await _run_job("enrich_leads", {"mode": mode, "campaign": campaign}, ctx)
+    return f"Batch enrichment complete using {mode} mode."
 
 # @mcp.tool()
 # def generate_messages() -> str:
@@ -75,10 +168,13 @@ def enrich_leads(mode: str = "offline") -> str:
 #     return "Message generation complete for pending enriched leads."
 
 @mcp.tool()
-def generate_messages() -> str:
+async def generate_messages(campaign: str | None = None, ctx: Context | None = None) -> str:
     """
     Tool: generate_messages
-    Input schema: {}
+    Input schema:
+    {
+      "campaign": string (optional)
+    }
 
     Output:
     {
@@ -88,6 +184,8 @@ def generate_messages() -> str:
     Description:
     Generates A/B variants of email and LinkedIn messages using enriched lead data.
     """
+    await _run_job("generate_messages", {"campaign": campaign}, ctx)
+    return "Message generation complete for pending enriched leads."
 
 
 # @mcp.tool()
@@ -101,12 +199,13 @@ def generate_messages() -> str:
 #     return f"Outreach batch complete. Dry Run: {dry_run}"
 
 @mcp.tool()
-def send_outreach(dry_run: bool = True) -> str:
+async def send_outreach(dry_run: bool = True, campaign: str | None = None, ctx: Context | None = None) -> str:
     """
     Tool: send_outreach
     Input schema:
     {
-      "dry_run": boolean
+      "dry_run": boolean,
+      "campaign": string (optional)
     }
 
     Output:
@@ -116,7 +215,10 @@ def send_outreach(dry_run: bool = True) -> str:
 
     Description:
     Sends or simulates outreach with retry logic, rate limiting, and structured logging.
+    Reports MCP progress per lead; use start_job to run it without waiting.
     """
+    await _run_job("send_outreach", {"dry_run": dry_run, "campaign": campaign}, ctx)
+    return f"Outreach batch complete. Dry Run: {dry_run}"
 
 
 # @mcp.tool()
@@ -144,24 +246,275 @@ def send_outreach(dry_run: bool = True) -> str:
 #     conn.close()
 #     return stats
 
+PIPELINE_STATUSES = ["NEW", "ENRICHED", "MESSAGED", "SENDING", "RETRY", "SENT", "FAILED"]
+
 @mcp.tool()
-def get_pipeline_status() -> dict:
+def get_pipeline_status(campaign: str | None = None) -> dict:
     """
     Tool: get_pipeline_status
-    Input schema: {}
+    Input schema:
+    {
+      "campaign": string (optional)
+    }
 
     Output:
     {
       "NEW": number,
       "ENRICHED": number,
       "MESSAGED": number,
+      "SENDING": number,
+      "RETRY": number,
       "SENT": number,
-      "FAILED": number
+      "FAILED": number,
+      "RETRY_DUE": number
     }
 
     Description:
     Returns real-time pipeline counts for frontend and orchestration.
+    RETRY_DUE counts the RETRY leads whose next attempt is due.
+    """
+    counts = get_status_counts(campaign)
+    stats = {status: counts.get(status, 0) for status in PIPELINE_STATUSES}
+    stats["RETRY_DUE"] = count_due_retries(campaign) if stats["RETRY"] else 0
+    return stats
+
+
+@mcp.tool()
+def get_campaigns_status() -> dict:
+    """
+    Tool: get_campaigns_status
+    Input schema: {}
+
+    Output:
+    {
+      "total": { status: number },
+      "<campaign>": { status: number }
+    }
+
+    Description:
+    Pipeline counts for every active campaign shard and in total (one ATTACH query per group of shards).
+    """
+    import shards
+    return shards.cross_shard_status_counts()
+
+
+@mcp.tool()
+def manage_campaign(action: str, name: str | None = None) -> dict:
+    """
+    Tool: manage_campaign
+    Input schema:
+    {
+      "action": "list" | "create" | "archive",
+      "name": string (required for create/archive)
+    }
+
+    Output:
+    {
+      "campaigns": [string],
+      "message": string
+    }
+
+    Description:
+    Lists, creates or archives campaign shards. Archiving moves the shard file to campaigns/archive/.
+    """
+    import shards
+    if action == "create":
+        message = f"Created campaign {name} at {create_campaign(name)}"
+    elif action == "archive":
+        message = f"Archived campaign {name} to {shards.archive_campaign(name)}"
+    elif action == "list":
+        message = "ok"
+    else:
+        raise ValueError(f"Unknown action: {action}")
+    return {"campaigns": list_campaigns(), "message": message}
+
+
+@mcp.tool()
+def get_stage_metrics(window_minutes: int = 60, campaign: str | None = None) -> dict:
+    """
+    Tool: get_stage_metrics
+    Input schema:
+    {
+      "window_minutes": number — look-back window (default 60),
+      "campaign": string (optional)
+    }
+
+    Output:
+    {
+      "throughput": { stage: { "total": number, "avg_per_minute": number, "per_minute": { "YYYY-MM-DD HH:MM": number } } },
+      "latency": { "FROM->TO": { "count": number, "p50": number, "p95": number, "p99": number, "max": number } }
+    }
+
+    Description:
+    Reports stage throughput and time-in-stage percentiles (seconds) from the lead_events history.
+    """
+    return {
+        "throughput": get_stage_throughput(window_minutes, campaign=campaign),
+        "latency": get_stage_latency(window_minutes, campaign=campaign),
+    }
+
+
+@mcp.tool()
+def search_leads(
+    query: str,
+    status: str | None = None,
+    limit: int = 20,
+    offset: int = 0,
+    campaign: str | None = None,
+) -> dict:
+    """
+    Tool: search_leads
+    Input schema:
+    {
+      "query": string — free text; words are ANDed, the last one may be a prefix,
+      "status": string (optional) — e.g. "MESSAGED",
+      "limit": number — page size (default 20, max 100),
+      "offset": number — from next_offset of the previous page (default 0),
+      "campaign": string (optional)
+    }
+
+    Output:
+    {
+      "query": string,
+      "ranked": boolean — false when the query is too broad to rank (newest first),
+      "results": [ { "id", "full_name", "company_name", "role", "industry", "status", "email", "snippet", "score" } ],
+      "next_offset": number | null
+    }
+
+    Description:
+    Full-text search over lead names, company, role, industry and generated messages (SQLite FTS5).
+    """
+    return _search_leads(query, status=status, limit=limit, offset=offset, campaign=campaign)
+
+
+@mcp.tool()
+async def import_leads(
+    path: str,
+    mapping: dict | None = None,
+    file_format: str | None = None,
+    campaign: str | None = None,
+    ctx: Context | None = None,
+) -> dict:
+    """
+    Tool: import_leads
+    Input schema:
+    {
+      "path": string (required) — CSV or JSONL file in the server's import directory (importer.IMPORT_DIR),
+      "mapping": object (optional) — { lead field: source column }, e.g. { "email": "Work Email" },
+      "file_format": "csv" | "jsonl" (optional, default from the file extension),
+      "campaign": string (optional)
+    }
+
+    Output:
+    {
+      "read": number, "imported": number, "duplicates": number, "rejected": number,
+      "rejects_path": string | null
+    }
+
+    Description:
+    Streams a vendor lead list into the pipeline in chunks, validating and normalizing
+    emails and URLs. Rejected rows are written to <path>.rejects.jsonl with the reason.
+    Paths resolving outside the import directory are refused.
+    """
+    job = await _run_job(
+        "import_leads", {"path": path, "mapping": mapping, "file_format": file_format, "campaign": campaign}, ctx
+    )
+    return job.result
+
+
+@mcp.tool()
+async def archive_leads(older_than_days: int = 30, campaign: str | None = None, ctx: Context | None = None) -> dict:
+    """
+    Tool: archive_leads
+    Input schema:
+    {
+      "older_than_days": number (optional, default 30),
+      "campaign": string (optional)
+    }
+
+    Output:
+    {
+      "archived": number, "batches": number, "bytes_before": number, "bytes_after": number
+    }
+
+    Description:
+    Moves SENT/FAILED leads idle for older_than_days into the compressed leads_archive
+    table and returns the freed space to the filesystem (databases created before
+    incremental vacuum need a one-off `python archive.py --convert` first). Archived leads stay readable
+    through the all_leads view and are still skipped as duplicates.
+    """
+    job = await _run_job("archive_leads", {"older_than_days": older_than_days, "campaign": campaign}, ctx)
+    return job.result
+
+
+@mcp.tool()
+def start_job(tool: str, args: dict | None = None) -> dict:
+    """
+    Tool: start_job
+    Input schema:
+    {
+      "tool": "generate_leads" | "enrich_leads" | "generate_messages" | "send_outreach" | "import_leads"
+              | "archive_leads",
+      "args": object (optional) — the same arguments the tool takes
+    }
+
+    Output:
+    {
+      "job_id": string, "tool": string, "status": string, ...
+    }
+
+    Description:
+    Starts a pipeline stage in the background and returns immediately. Poll with job_status.
+    """
+    return _start(tool, args or {}).to_dict()
+
+
+@mcp.tool()
+def job_status(job_id: str | None = None) -> dict:
+    """
+    Tool: job_status
+    Input schema:
+    {
+      "job_id": string (optional) — omit to list all recent jobs
+    }
+
+    Output:
+    {
+      "job_id": string,
+      "tool": string,
+      "status": "queued" | "running" | "done" | "failed" | "cancelled",
+      "progress": number,
+      "total": number | null,
+      "result": any,
+      "error": string | null
+    }
+    or { "jobs": [ ... ] }
+
+    Description:
+    Reports progress and outcome of background jobs.
+    """
+    if job_id is None:
+        return {"jobs": jobs.list()}
+    return jobs.get(job_id).to_dict()
+
+
+@mcp.tool()
+def cancel_job(job_id: str) -> dict:
+    """
+    Tool: cancel_job
+    Input schema:
+    {
+      "job_id": string
+    }
+
+    Output:
+    { job_status output }
+
+    Description:
+    Asks a job to stop after the current lead. Work already finished is committed;
+    claimed but unsent leads stay SENDING and are resumed by the next send batch.
     """
+    return jobs.cancel(job_id).to_dict()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+import sqlite3
+import os
+import sys
+from datetime import datetime
+from database import (
+    CAMPAIGNS_DIR, DEFAULT_CAMPAIGN, get_db_path, list_campaigns, load_campaigns, save_campaigns, sqlite_uri,
+)
+
+# SQLite allows 10 attached databases per connection by default
+MAX_ATTACHED = 10
+ARCHIVE_DIR = os.path.join(CAMPAIGNS_DIR, "archive")
+
+
+def _attached_query(campaigns, select_for_shard):
+    """
+    Run one UNION ALL query across shards, attaching them read-only in groups of
+    MAX_ATTACHED. `select_for_shard(alias)` returns the SELECT for one shard;
+    each returned row is prefixed with the campaign name.
+    """
+    rows = []
+    conn = sqlite3.connect("file::memory:", uri=True)
+    try:
+        for start in range(0, len(campaigns), MAX_ATTACHED):
+            chunk = campaigns[start:start + MAX_ATTACHED]
+            aliases = []
+            for i, campaign in enumerate(chunk):
+                conn.execute(f"ATTACH DATABASE ? AS s{i}", (sqlite_uri(get_db_path(campaign), read_only=True),))
+                aliases.append((campaign, f"s{i}"))
+            try:
+                sql = " UNION ALL ".join(
+                    f"SELECT ? AS campaign, * FROM ({select_for_shard(alias)})" for _, alias in aliases
+                )
+                rows += conn.execute(sql, [campaign for campaign, _ in aliases]).fetchall()
+            finally:
+                for _, alias in aliases:
+                    conn.execute(f"DETACH DATABASE {alias}")
+    finally:
+        conn.close()
+    return rows
+
+
+def cross_shard_status_counts(campaigns=None):
+    """Status counts per campaign plus a "total" across every active shard."""
+    campaigns = campaigns or list_campaigns()
+    rows = _attached_query(
+        campaigns, lambda alias: f"SELECT status, COUNT(*) FROM {alias}.leads GROUP BY status"
+    )
+    result = {"total": {}}
+    for campaign, status, count in rows:
+        result.setdefault(campaign, {})[status] = count
+        result["total"][status] = result["total"].get(status, 0) + count
+    return result
+
+
+def cross_shard_stage_throughput(window_minutes=60, campaigns=None):
+    """Transitions per stage over the last `window_minutes`, per campaign and in total."""
+    campaigns = campaigns or list_campaigns()
+    since = f"-{int(window_minutes)} minutes"
+    rows = _attached_query(
+        campaigns,
+        lambda alias: (
+            f"SELECT stage, COUNT(*) FROM {alias}.lead_events "
+            f"WHERE ts >= strftime('%Y-%m-%d %H:%M:%f', 'now', '{since}') GROUP BY stage"
+        ),
+    )
+    result = {"total": {}}
+    for campaign, stage, count in rows:
+        result.setdefault(campaign, {})[stage] = count
+        result["total"][stage] = result["total"].get(stage, 0) + count
+    return result
+
+
+def archive_campaign(name):
+    """
+    Retire a finished campaign: move its shard file into campaigns/archive/ and
+    mark it archived so it is no longer routed to or included in cross-shard queries.
+    """
+    if name == DEFAULT_CAMPAIGN:
+        raise ValueError("The default campaign cannot be archived")
+    registry = load_campaigns()
+    entry = registry.get(name)
+    if entry is None or entry.get("archived"):
+        raise ValueError(f"Unknown or already archived campaign: {name}")
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archived_path = os.path.join(ARCHIVE_DIR, os.path.basename(entry["path"]))
+    os.replace(entry["path"], archived_path)
+    entry.update(path=archived_path, archived=True, archived_at=datetime.utcnow().isoformat() + "Z")
+    save_campaigns(registry)
+    return archived_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "archive":
+        print(f"Archived to {archive_campaign(sys.argv[2])}")
+    else:
+        for campaign, counts in cross_shard_status_counts().items():
+            print(campaign, counts)
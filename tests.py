@@ -1,7 +1,56 @@
+import asyncio
+import contextlib
+import datetime
+import functools
+import textwrap
+import time
+import random
+import io
+import json
+import os
+import smtplib
+import sqlite3
+import tempfile
+import threading
 import unittest
+from unittest import mock
+
+import agent
+import agent_runs
+import archive
+import database
+import loadtest
+import enrichment
+import fixtures
+import importer
+import message_gen
+import priority
+import rules
+import sender
+import server
+from bench_startup import import_time
+from concurrent.futures import ThreadPoolExecutor
+from dispatch import RateLimit, SendPlanner, load_limits, record_deferral
 from enrichment import enrich_offline
+from jobs import JobManager
 from message_gen import EMAIL_TEMPLATES
 
+
+def sample_leads(count):
+    return [
+        {
+            "full_name": f"Test Lead{i}",
+            "company_name": f"Company {i}",
+            "role": "CTO",
+            "industry": "Technology",
+            "website": f"https://www.company{i}.com",
+            "email": f"lead{i}@company{i}.com",
+            "linkedin_url": f"https://www.linkedin.com/in/lead-{i}",
+            "country": "Germany",
+        }
+        for i in range(count)
+    ]
+
 class TestLeadSystem(unittest.TestCase):
 
     def test_enrichment_structure(self):
@@ -35,5 +84,1082 @@ class TestLeadSystem(unittest.TestCase):
         self.assertIn("Acme", formatted)
         print("✓ Message Templates Valid")
 
+
+class FakeClock:
+    """Deterministic time source; sleeping just advances the clock."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TempDBTestCase(unittest.TestCase):
+    """Points every pipeline module (and the campaign registry) at throwaway files."""
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.workdir.name, "leads.db")
+        self.patches = [
+            mock.patch.object(database, "DB_NAME", self.db_path),
+            mock.patch.object(database, "CAMPAIGNS_FILE", os.path.join(self.workdir.name, "campaigns.json")),
+            mock.patch.object(database, "CAMPAIGNS_DIR", os.path.join(self.workdir.name, "campaigns")),
+            mock.patch.object(sender, "LOG_FILE", os.devnull),
+            mock.patch("builtins.print"),
+        ]
+        for p in self.patches:
+            p.start()
+        database.init_db()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.workdir.cleanup()
+
+    def statuses(self):
+        conn = sqlite3.connect(self.db_path)
+        rows = dict(conn.execute("SELECT status, COUNT(*) FROM leads GROUP BY status").fetchall())
+        conn.close()
+        return rows
+
+
+class TestRuleEngine(unittest.TestCase):
+
+    SPEC = {
+        "company_sizes": ["Small (1-50)"],
+        "default": {"pain_points": ["Generic pain"], "buying_triggers": ["Generic trigger"]},
+        "rules": [
+            {"name": "risk", "industry": ["Finance"], "role_keywords": ["risk"], "persona": "{role} - Risk Owner"},
+            {"name": "big", "company_pattern": r"\bholdings\b", "company_size": "Enterprise (500+)"},
+            {"name": "uk-finance", "industry": ["finance"], "country": ["United Kingdom"], "pain_points": ["FCA reporting"]},
+            {"name": "finance", "industry": ["Finance"], "pain_points": ["Reconciliation", "Audit prep"],
+             "confidence_boost": 50},
+        ],
+    }
+
+    def test_each_output_comes_from_first_matching_rule_that_sets_it(self):
+        engine = rules.RuleEngine(self.SPEC)
+        risk, uk, other = engine.evaluate([
+            {"industry": "Finance", "role": "Chief Risk Officer", "company_name": "Acme Holdings", "country": "France"},
+            {"industry": "Finance", "role": "Analyst", "company_name": "Acme", "country": "United Kingdom"},
+            {"industry": "Retail", "role": "Risk Officer", "company_name": None},
+        ])
+        self.assertEqual(risk["persona"], "Chief Risk Officer - Risk Owner")
+        self.assertEqual(risk["company_size"], "Enterprise (500+)")
+        self.assertEqual(sorted(risk["pain_points"]), ["Audit prep", "Reconciliation"])
+        self.assertEqual(risk["confidence_score"], 100)
+        self.assertEqual((uk["rule"], uk["pain_points"], uk["persona"]), ("uk-finance", ["FCA reporting"], "Analyst - Decision Maker"))
+        self.assertEqual((other["rule"], other["company_size"]), ("default", "Small (1-50)"))
+        self.assertEqual(other["buying_triggers"], ["Generic trigger"])
+
+    def test_rules_file_is_recompiled_when_changed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rules.json")
+            with open(path, "w") as f:
+                json.dump(self.SPEC, f)
+            engine = rules.get_engine(path)
+            self.assertIs(rules.get_engine(path), engine)
+            with open(path, "w") as f:
+                json.dump({"rules": [{"name": "bad", "industy": ["Finance"]}]}, f)
+            os.utime(path, (0, 0))
+            with self.assertRaises(ValueError):
+                rules.get_engine(path)
+
+
+class TestDeterministicEnrichment(TempDBTestCase):
+
+    def leads(self, count=500):
+        industries = list(rules.PAIN_POINTS) + ["Unknown"]
+        leads = [dict(lead, id=i + 1, industry=industries[i % len(industries)]) for i, lead in enumerate(sample_leads(count))]
+        random.Random(7).shuffle(leads)
+        return leads
+
+    def test_parallel_shards_match_serial_run(self):
+        """Any sharding, ordering or thread count gives byte-identical enrichment."""
+        leads = self.leads()
+        serial = {lead["id"]: json.dumps(data) for lead, data in zip(leads, enrichment.enrich_offline_batch(leads))}
+
+        shards = [sorted(leads[i::7], key=lambda lead: -lead["id"]) for i in range(7)]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = pool.map(lambda shard: (shard, enrichment.enrich_offline_batch(shard)), shards)
+            parallel = {lead["id"]: json.dumps(data) for shard, out in results for lead, data in zip(shard, out)}
+        self.assertEqual(parallel, serial)
+
+        ai = [json.dumps(enrichment.enrich_ai(lead)) for lead in leads[:20]]
+        self.assertEqual(ai, [json.dumps(enrichment.enrich_ai(lead)) for lead in leads[:20]])
+
+    def test_seed_changes_draws(self):
+        leads = self.leads(50)
+        self.assertNotEqual(
+            enrichment.enrich_offline_batch(leads, seed=1), enrichment.enrich_offline_batch(leads, seed=2)
+        )
+
+    def test_run_date_is_fixed_per_run(self):
+        """A run crossing midnight dates every chunk from the day it started."""
+        database.add_leads(sample_leads(6))
+        start = datetime.date(2026, 1, 1)
+        # Each call to date.today() is one day later
+        fake_date = mock.Mock(today=mock.Mock(side_effect=[start + datetime.timedelta(days=n) for n in range(10)]))
+        with mock.patch.object(enrichment, "ENRICH_CHUNK_SIZE", 3), \
+             mock.patch.object(enrichment, "date", fake_date), mock.patch.object(rules, "date", fake_date):
+            enrichment.process_enrichment_batch(limit=6)
+
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(
+            f"SELECT {', '.join(enrichment.ENRICH_COLUMNS)}, enrichment_data FROM leads ORDER BY id"
+        ).fetchall()
+        conn.close()
+        leads = [dict(zip(enrichment.ENRICH_COLUMNS, row[:-1])) for row in rows]
+        expected = enrichment.enrich_offline_batch(leads, today=start)
+        self.assertEqual([json.loads(row[-1]) for row in rows], expected)
+
+    def test_simulated_send_failures_are_per_lead_and_attempt(self):
+        def outcomes(attempt):
+            failed = set()
+            for lead_id in range(1, 201):
+                try:
+                    sender.send_email_smtp("x@example.com", "s", "b", lead_id=lead_id, attempt=attempt)
+                except Exception:
+                    failed.add(lead_id)
+            return failed
+
+        with mock.patch.object(sender.time, "sleep"):
+            first = outcomes(1)
+            self.assertEqual(outcomes(1), first)
+            self.assertNotEqual(outcomes(2), first)
+        self.assertTrue(0 < len(first) < 60)
+
+
+class TestLeadEvents(TempDBTestCase):
+
+    def test_transitions_recorded_with_status_update(self):
+        """Every insert and stage move writes one lead_events row."""
+        database.add_leads(sample_leads(5))
+        enrichment.process_enrichment_batch(mode="offline", limit=3)
+
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(
+            "SELECT from_status, to_status, stage, COUNT(*) FROM lead_events GROUP BY 1, 2, 3 ORDER BY 4 DESC"
+        ).fetchall()
+        conn.close()
+        self.assertEqual(rows, [(None, "NEW", "generate_leads", 5), ("NEW", "ENRICHED", "enrich_leads", 3)])
+
+    def test_messages_written_in_chunks(self):
+        """Messages are written a chunk at a time; every lead and event still lands."""
+        database.add_leads(sample_leads(5))
+        enrichment.process_enrichment_batch(limit=5)
+        chunks = []
+
+        def record(cursor, events):
+            chunks.append(len(events))
+            database.record_events(cursor, events)
+
+        with mock.patch.object(message_gen, "MESSAGE_WRITE_CHUNK", 2), mock.patch.object(message_gen, "record_events", record):
+            self.assertEqual(message_gen.generate_messages_batch(limit=5), 5)
+        self.assertEqual(chunks, [2, 2, 1])
+
+        conn = sqlite3.connect(self.db_path)
+        written = conn.execute("SELECT COUNT(*) FROM leads WHERE status = 'MESSAGED' AND message_linkedin_b IS NOT NULL").fetchone()[0]
+        events = conn.execute("SELECT COUNT(*) FROM lead_events WHERE stage = 'generate_messages'").fetchone()[0]
+        conn.close()
+        self.assertEqual((written, events), (5, 5))
+
+    def test_stage_metrics(self):
+        """Throughput and latency percentiles are computed from the event history."""
+        database.add_leads(sample_leads(4))
+        enrichment.process_enrichment_batch(mode="offline", limit=4)
+
+        throughput = database.get_stage_throughput(window_minutes=5)
+        self.assertEqual(throughput["enrich_leads"]["total"], 4)
+
+        latency = database.get_stage_latency(window_minutes=5)
+        self.assertEqual(latency["NEW->ENRICHED"]["count"], 4)
+        self.assertGreaterEqual(latency["NEW->ENRICHED"]["p99"], latency["NEW->ENRICHED"]["p50"])
+
+
+
+class TestMemoryDatabaseAndFixtures(TempDBTestCase):
+
+    def test_memory_databases_are_isolated(self):
+        with database.memory_database() as first:
+            database.init_db()
+            database.add_leads(sample_leads(3))
+            with database.memory_database():
+                database.init_db()
+                self.assertEqual(database.get_status_counts(), {})
+            self.assertEqual(database.DB_NAME, first)
+            self.assertEqual(database.get_status_counts(), {"NEW": 3})
+        self.assertEqual(database.DB_NAME, self.db_path)
+
+    def test_fixture_snapshot_and_restore(self):
+        with mock.patch.object(fixtures, "FIXTURES_DIR", os.path.join(self.workdir.name, "fixtures")):
+            path = fixtures.build_fixture(40, "MESSAGED")
+            self.assertEqual(fixtures.build_fixture(40, "MESSAGED"), path)  # reused, not rebuilt
+            with database.memory_database():
+                fixtures.load_fixture("messaged_40")
+                self.assertEqual(database.get_status_counts(), {"MESSAGED": 40})
+                enrichment.process_enrichment_batch(limit=10)  # stages run against the restored copy
+                database.add_leads(sample_leads(2))
+                fixtures.load_fixture(path)
+                self.assertEqual(database.get_status_counts(), {"MESSAGED": 40})
+        # The file database was never touched
+        self.assertEqual(self.statuses(), {})
+
+
+class TestImporter(TempDBTestCase):
+
+    def write(self, name, text):
+        path = os.path.join(self.workdir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_csv_import_normalizes_and_rejects(self):
+        path = self.write("vendor.csv", (
+            "First Name,Last Name,Company,Title,Work Email,Domain,LinkedIn\n"
+            "Ada,Lovelace,Analytical,CTO, ADA@Example.COM ,example.com/,linkedin.com/in/ada\n"
+            "Bad,Email,Acme,CEO,not-an-email,acme.com,\n"
+            "Grace,Hopper,Navy,Admiral,grace@navy.mil,,https://twitter.com/grace\n"
+            "Ada,Again,Analytical,CTO,ada@example.com,,\n"
+            "Alan,Turing,Bletchley,Lead,alan@bletchley.uk,http://Bletchley.UK,\n"
+        ))
+        reports = []
+        summary = importer.import_leads(
+            path, mapping={"first_name": "First Name", "last_name": "Last Name"}, chunk_size=2,
+            progress=lambda done, total, message: reports.append(done),
+        )
+        self.assertEqual(
+            {k: summary[k] for k in ("read", "imported", "duplicates", "rejected")},
+            {"read": 5, "imported": 2, "duplicates": 1, "rejected": 2},
+        )
+        self.assertEqual(reports, [4, 5])
+
+        rows = list(database.iter_leads("NEW", columns=["full_name", "email", "website", "linkedin_url", "role"]))
+        self.assertEqual(
+            [(r["full_name"], r["email"], r["website"], r["linkedin_url"], r["role"]) for r in rows],
+            [
+                ("Ada Lovelace", "ada@example.com", "https://example.com", "https://linkedin.com/in/ada", "CTO"),
+                ("Alan Turing", "alan@bletchley.uk", "https://bletchley.uk", None, "Lead"),
+            ],
+        )
+        with open(summary["rejects_path"]) as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual([(r["line"], r["reason"].split(":")[0]) for r in rejects], [(3, "invalid email"), (4, "not a linkedin.com URL")])
+
+    def test_tool_imports_only_from_import_directory(self):
+        import_dir = os.path.join(self.workdir.name, "imports")
+        os.mkdir(import_dir)
+        self.write("imports/vendor.csv", "Name,Email\nAda,ada@example.com\nBad,nope\n")
+        outside = self.write("outside.csv", "Name,Email\nEve,eve@example.com\n")
+        os.symlink(outside, os.path.join(import_dir, "link.csv"))
+        with mock.patch.object(importer, "IMPORT_DIR", import_dir):
+            summary = server._import_leads_job("vendor.csv")
+            for path in (outside, "../outside.csv", "link.csv"):
+                with self.assertRaises(ValueError):
+                    server._import_leads_job(path)
+        self.assertEqual(summary["imported"], 1)
+        self.assertEqual(summary["rejects_path"], os.path.join(os.path.realpath(import_dir), "vendor.csv.rejects.jsonl"))
+        self.assertEqual(self.statuses(), {"NEW": 1})
+
+    def test_jsonl_import_with_mapping(self):
+        path = self.write("vendor.jsonl", "\n".join([
+            json.dumps({"Contact": "Linus T", "Mail": "linus@kernel.org", "country": "Finland"}),
+            "{broken",
+            json.dumps({"Contact": "Ken T", "Mail": "ken@bell-labs.com", "sector": "Technology"}),
+        ]))
+        summary = importer.import_leads(path, mapping={"full_name": "Contact", "email": "Mail"})
+        self.assertEqual((summary["imported"], summary["rejected"]), (2, 1))
+        rows = list(database.iter_leads("NEW", columns=["full_name", "country", "industry"]))
+        self.assertEqual([(r["full_name"], r["country"], r["industry"]) for r in rows],
+                         [("Linus T", "Finland", None), ("Ken T", None, "Technology")])
+
+
+class TestStreamingReads(TempDBTestCase):
+
+    def test_keyset_pages_cover_every_row_once(self):
+        """Small pages still yield each matching lead exactly once, in id order."""
+        database.add_leads(sample_leads(23))
+        ids = [row[0] for row in database.iter_leads("NEW", columns=["email"], row_format="tuple", batch_size=5)]
+        self.assertEqual(ids, list(range(1, 24)))
+        self.assertEqual(len(list(database.iter_leads("NEW", batch_size=5, limit=12))), 12)
+
+    def test_projection_and_row_formats(self):
+        """Only projected columns are read, as dicts, tuples or records."""
+        database.add_leads(sample_leads(2))
+        as_dict = next(database.iter_leads("NEW", columns=["email"]))
+        self.assertEqual(as_dict, {"id": 1, "email": "lead0@company0.com"})
+        record = next(database.iter_leads("NEW", columns=["email", "country"], row_format="record"))
+        self.assertEqual((record.id, record.country), (1, "Germany"))
+        with self.assertRaises(ValueError):
+            next(database.iter_leads("NEW", columns=["email; DROP TABLE leads"]))
+
+    def test_lead_rows_are_compact_and_dict_like(self):
+        database.add_leads(sample_leads(3))
+        leads = list(database.iter_leads("NEW", columns=["full_name", "role", "industry"], row_format="lead"))
+        first, second = leads[0], leads[1]
+        self.assertFalse(hasattr(first, "__dict__"))
+        # Categorical values are interned: one shared string for every lead
+        self.assertIs(first["role"], second["role"])
+        self.assertIsNot(first["full_name"], second["full_name"])
+        self.assertEqual(first, {"id": 1, "full_name": "Test Lead0", "role": "CTO", "industry": "Technology"})
+        # Columns that were not loaded behave like missing dict keys
+        self.assertNotIn("email", first)
+        self.assertIsNone(first.get("email"))
+        with self.assertRaises(KeyError):
+            first["email"]
+        with self.assertRaises(KeyError):
+            first["get"]
+        self.assertEqual(first.to_row(["id", "role", "email"]), (1, "CTO", None))
+
+    def test_generated_leads_round_trip(self):
+        lead = database.Lead(**sample_leads(1)[0])
+        self.assertEqual(database.add_leads([lead]), 1)
+        stored = next(database.iter_leads("NEW", columns=list(lead.keys()), row_format="lead"))
+        self.assertEqual(stored.to_dict(), dict(lead.to_dict(), id=1))
+        with self.assertRaises(KeyError):
+            database.Lead(nickname="Ada")
+
+    def test_csv_export(self):
+        database.add_leads(sample_leads(3))
+        buf = io.StringIO()
+        self.assertEqual(database.export_leads_csv(buf, columns=["email"]), 3)
+        self.assertEqual(buf.getvalue().splitlines()[0], "id,email")
+
+
+class TestSearch(TempDBTestCase):
+
+    def test_triggers_keep_index_in_sync(self):
+        """Inserts, message updates and deletes are all reflected in search results."""
+        database.add_leads(sample_leads(5))
+        self.assertEqual([r["id"] for r in database.search_leads("Company 3")["results"]], [4])
+        self.assertEqual(database.search_leads("compliance")["results"], [])
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE leads SET message_email_a = 'Is compliance on your radar?' WHERE id = 2")
+        conn.commit()
+        self.assertEqual([r["id"] for r in database.search_leads("compliance")["results"]], [2])
+        conn.execute("DELETE FROM leads WHERE id = 2")
+        conn.commit()
+        conn.close()
+        self.assertEqual(database.search_leads("compliance")["results"], [])
+
+    def test_existing_rows_are_backfilled(self):
+        database.add_leads(sample_leads(3))
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("DROP TABLE leads_fts; DROP TRIGGER leads_fts_insert;")
+        conn.close()
+        database.init_db()
+        self.assertEqual(len(database.search_leads("technology")["results"]), 3)
+
+    def test_ranking_prefix_and_pages(self):
+        leads = sample_leads(45)
+        leads[30]["company_name"] = "Lead Ventures"  # hit in a heavily weighted column
+        database.add_leads(leads)
+        page = database.search_leads("lead", limit=20)
+        self.assertTrue(page["ranked"])
+        self.assertEqual(page["results"][0]["id"], 31)
+        self.assertEqual(page["results"][0]["snippet"], "[Lead] Ventures")
+        # Partial last word matches as a prefix; an exact hit outranks longer words
+        self.assertEqual(database.search_leads("Test Lea")["results"][0]["full_name"][:8], "Test Lea")
+        self.assertEqual(database.search_leads("lead4")["results"][0]["id"], 5)
+
+        seen, offset = [], 0
+        while offset is not None:
+            page = database.search_leads("technology", limit=20, offset=offset)
+            seen += [r["id"] for r in page["results"]]
+            offset = page["next_offset"]
+        self.assertEqual(sorted(seen), list(range(1, 46)))
+        self.assertEqual(database.search_leads("technology", status="SENT")["results"], [])
+
+    def test_broad_queries_fall_back_to_newest_first(self):
+        database.add_leads(sample_leads(12))
+        with mock.patch.object(database, "SEARCH_RANK_LIMIT", 10):
+            page = database.search_leads("cto", limit=5)
+        self.assertFalse(page["ranked"])
+        self.assertEqual([r["id"] for r in page["results"]], [12, 11, 10, 9, 8])
+
+    def test_query_text_is_not_fts_syntax(self):
+        database.add_leads(sample_leads(2))
+        for text in ('"', "lead0 OR", "NEAR(", "*", "company-1 AND"):
+            database.search_leads(text)
+        self.assertEqual(server.search_leads("   ")["results"], [])
+
+
+class TestArchive(TempDBTestCase):
+
+    def finish(self, ids, status="SENT", days=40):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            f"UPDATE leads SET status = ?, message_email_a = 'Hi ' || full_name || ', quick question.', "
+            f"last_updated = datetime('now', ?) WHERE id IN ({', '.join('?' for _ in ids)})",
+            (status, f"-{days} days", *ids),
+        )
+        conn.commit()
+        conn.close()
+
+    def test_moves_idle_finished_leads(self):
+        database.add_leads(sample_leads(10))
+        self.finish([1, 2, 3])
+        self.finish([4], status="FAILED")
+        self.finish([5], days=5)  # sent recently: stays hot
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO send_retries (lead_id, next_attempt_at, state) VALUES (4, datetime('now'), 'DEAD')")
+        conn.commit()
+        conn.close()
+
+        summary = archive.archive_leads(batch_size=3)
+        self.assertEqual((summary["archived"], summary["batches"]), (4, 2))
+        self.assertEqual(self.statuses(), {"NEW": 5, "SENT": 1})
+        self.assertEqual(archive.archived_status_counts(), {"SENT": 3, "FAILED": 1})
+        self.assertEqual(archive.archive_leads()["archived"], 0)
+
+        conn = database.connect()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM send_retries").fetchone()[0], 0)
+        stored = conn.execute("SELECT message_email_a FROM leads_archive WHERE id = 2").fetchone()[0]
+        self.assertIsInstance(stored, bytes)
+        row = conn.execute("SELECT status, message_email_a, archived_at FROM all_leads WHERE id = 2").fetchone()
+        conn.close()
+        self.assertEqual(row[:2], ("SENT", "Hi Test Lead1, quick question."))
+        self.assertIsNotNone(row[2])
+        self.assertEqual([r["id"] for r in database.search_leads("lead1")["results"]], [])
+
+        # Archived leads still count as duplicates
+        self.assertEqual(database.add_leads(sample_leads(12)), 2)
+
+    def test_message_codec_round_trip(self):
+        text = "Subject: Café ☕\n\nHi Ana, I noticed Company 3 is growing in Fintech."
+        blob = database.compress_message(text)
+        self.assertEqual(blob[0], database.MESSAGE_ZDICT_VERSION)
+        self.assertLess(len(blob), len(text.encode()))
+        self.assertEqual(database.decompress_message(blob), text)
+        self.assertIsNone(database.compress_message(None))
+        self.assertIsNone(database.decompress_message(None))
+
+    def test_space_is_returned_to_the_filesystem(self):
+        # A database created before incremental vacuum is only converted on request
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA auto_vacuum = NONE")
+        conn.execute("VACUUM")
+        conn.close()
+        self.assertEqual(archive.archive_leads()["archived"], 0)
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+        conn.close()
+        self.assertTrue(archive.enable_incremental_vacuum())
+        self.assertFalse(archive.enable_incremental_vacuum())
+        database.add_leads(sample_leads(400))
+        self.finish(list(range(1, 401)))
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE leads SET message_email_b = printf('%.2000c', '.') || message_email_a")
+        conn.commit()
+        conn.close()
+        summary = archive.archive_leads()
+        self.assertEqual(summary["archived"], 400)
+        self.assertLess(summary["bytes_after"], summary["bytes_before"])
+        self.assertEqual(os.path.getsize(self.db_path), summary["bytes_after"])
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        self.assertEqual(conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+        conn.close()
+
+
+class TestAnalyticsSnapshot(TempDBTestCase):
+
+    def setUp(self):
+        super().setUp()
+        import analytics
+        self.analytics = analytics
+        self.con = analytics.connect(os.path.join(self.workdir.name, "snapshot.duckdb"))
+
+    def tearDown(self):
+        self.con.close()
+        super().tearDown()
+
+    def test_incremental_refresh_and_aggregates(self):
+        """Refresh copies only changed leads and aggregations read the snapshot."""
+        database.add_leads(sample_leads(6))
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE leads SET last_updated = '2020-01-0' || id || ' 00:00:00'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.analytics.refresh_snapshot(self.con, force=True), 6)
+        # Fresh snapshot: readers don't re-export within the TTL
+        self.assertIsNone(self.analytics.refresh_snapshot(self.con))
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE leads SET last_updated = '2999-01-01 00:00:00', status = 'ENRICHED' WHERE id <= 2")
+        conn.commit()
+        conn.close()
+        # The two changed leads plus lead 6, re-read because it sits on the watermark
+        self.assertEqual(self.analytics.refresh_snapshot(self.con, force=True), 3)
+
+        self.assertEqual(self.analytics.status_counts(self.con), {"NEW": 4, "ENRICHED": 2})
+        by_industry = self.analytics.breakdown("industry", con=self.con)
+        self.assertEqual(by_industry.iloc[0]["leads"], 6)
+        with self.assertRaises(ValueError):
+            self.analytics.breakdown("email", con=self.con)
+
+    def test_background_refresh(self):
+        database.add_leads(sample_leads(3))
+        path = os.path.join(self.workdir.name, "background.duckdb")
+        with mock.patch.object(self.analytics, "ANALYTICS_DB", path):
+            self.assertTrue(self.analytics.refresh_in_background())
+            self.analytics._refreshing[path].join(10)
+            self.assertEqual(self.analytics.status_counts(), {"NEW": 3})
+
+    def test_late_commits_and_removed_leads(self):
+        """Rows stamped just below the watermark are still picked up; removed leads leave the snapshot."""
+        database.add_leads(sample_leads(4))
+        self.analytics.refresh_snapshot(self.con, force=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "UPDATE leads SET status = 'ENRICHED', "
+            "last_updated = datetime((SELECT MAX(last_updated) FROM leads), '-60 seconds') WHERE id = 1"
+        )
+        conn.execute("DELETE FROM leads WHERE id = 4")  # e.g. moved to leads_archive
+        conn.commit()
+        conn.close()
+        self.analytics.refresh_snapshot(self.con, force=True)
+        self.assertEqual(self.analytics.status_counts(self.con), {"NEW": 2, "ENRICHED": 1})
+
+
+class TestPriority(TempDBTestCase):
+
+    def test_score_components(self):
+        """Confidence, size and trigger freshness all raise the score."""
+        from datetime import date
+        today = date(2026, 1, 31)
+        base = {"confidence_score": 80, "company_size": "Small (1-50)", "trigger_detected_at": "2025-10-01"}
+        score = priority.score_lead(base, today=today)
+        self.assertGreater(priority.score_lead({**base, "company_size": "Enterprise (500+)"}, today=today), score)
+        self.assertGreater(priority.score_lead({**base, "trigger_detected_at": "2026-01-30"}, today=today), score)
+        self.assertGreater(priority.score_lead({**base, "confidence_score": 95}, today=today), score)
+
+    def test_weights_file_overrides_defaults(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"confidence": 1, "company_size": 0, "trigger_freshness": 0}, f)
+        with mock.patch.object(priority, "PRIORITY_FILE", f.name):
+            weights = priority.load_weights()
+        os.remove(f.name)
+        self.assertEqual(priority.score_lead({"confidence_score": 90}, weights), 90.0)
+
+    def test_stages_take_top_k_by_score_from_index(self):
+        """Priority reads page through ties in score order without a sort step."""
+        database.add_leads(sample_leads(9))
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE leads SET priority_score = id % 3")
+        conn.commit()
+        plan = " ".join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM leads WHERE status = 'NEW' AND priority_score <= 5 "
+            "AND (priority_score < 5 OR id > 0) ORDER BY priority_score DESC, id LIMIT 3"
+        ))
+        conn.close()
+        self.assertIn("idx_leads_status_priority", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+        ids = [row[0] for row in database.iter_leads("NEW", columns=["id"], row_format="tuple", batch_size=2, order="priority")]
+        self.assertEqual(ids, [2, 5, 8, 1, 4, 7, 3, 6, 9])
+
+        enrichment.process_enrichment_batch(limit=3)
+        self.assertEqual(self.statuses(), {"ENRICHED": 3, "NEW": 6})
+        conn = sqlite3.connect(self.db_path)
+        enriched = [row[0] for row in conn.execute("SELECT id FROM leads WHERE status = 'ENRICHED' ORDER BY id")]
+        conn.close()
+        self.assertEqual(enriched, [2, 5, 8])
+
+
+class TestCampaignShards(TempDBTestCase):
+
+    def test_stages_are_routed_to_campaign_shard(self):
+        """Each campaign writes to its own file; the default shard is untouched."""
+        path = database.create_campaign("spring")
+        database.add_leads(sample_leads(4), campaign="spring")
+        enrichment.process_enrichment_batch(limit=2, campaign="spring")
+
+        self.assertEqual(database.get_status_counts("spring"), {"NEW": 2, "ENRICHED": 2})
+        self.assertEqual(database.get_status_counts(), {})
+        self.assertTrue(path.endswith(os.path.join("campaigns", "spring.db")))
+        with self.assertRaises(ValueError):
+            database.connect("unknown")
+        with self.assertRaises(ValueError):
+            database.create_campaign("../escape")
+
+    def test_cross_shard_queries_and_archive(self):
+        """Status counts across shards via ATTACH; archived shards drop out."""
+        import shards
+        database.add_leads(sample_leads(3))
+        database.create_campaign("a")
+        database.create_campaign("b")
+        database.add_leads(sample_leads(2), campaign="a")
+        database.add_leads(sample_leads(5), campaign="b")
+
+        # More shards than one ATTACH group holds
+        with mock.patch.object(shards, "MAX_ATTACHED", 2):
+            counts = shards.cross_shard_status_counts()
+            throughput = shards.cross_shard_stage_throughput(window_minutes=5)
+        self.assertEqual(counts["total"], {"NEW": 10})
+        self.assertEqual(counts["b"], {"NEW": 5})
+        self.assertEqual(throughput["total"], {"generate_leads": 10})
+
+        archived = shards.archive_campaign("b")
+        self.assertTrue(os.path.exists(archived))
+        self.assertEqual(database.list_campaigns(), ["default", "a"])
+        self.assertEqual(shards.cross_shard_status_counts()["total"], {"NEW": 5})
+        with self.assertRaises(ValueError):
+            database.connect("b")
+
+
+class TestSenderCheckpoint(TempDBTestCase):
+
+    def setUp(self):
+        super().setUp()
+        database.add_leads(sample_leads(6))
+        enrichment.process_enrichment_batch(limit=6)
+        message_gen.generate_messages_batch(limit=6)
+        clock = FakeClock()
+        # Rate-limit sleeps advance the fake clock instead of blocking
+        self.sleep = mock.patch.object(sender.time, "sleep", side_effect=clock.sleep)
+        self.clock = mock.patch.object(sender, "clock", clock)
+        self.sleep.start()
+        self.clock.start()
+
+    def tearDown(self):
+        self.clock.stop()
+        self.sleep.stop()
+        super().tearDown()
+
+    def test_completed_leads_are_group_committed(self):
+        """Commits happen per group of completed leads, not per lead."""
+        with mock.patch.object(sender, "send_email_smtp", return_value=True), \
+             mock.patch.object(sender, "_flush_completed", wraps=sender._flush_completed) as flush:
+            sender.process_outreach_batch(dry_run=False, limit=6, commit_every=4)
+        # One flush at the group boundary, one for the remainder
+        self.assertEqual(flush.call_count, 2)
+        self.assertEqual(self.statuses(), {"SENT": 6})
+
+    def test_crash_resumes_with_same_idempotency_key(self):
+        """Leads left in SENDING after a crash are resumed with their original key."""
+        keys = []
+
+        def crash_after_two(to_email, subject, body, idempotency_key=None, from_account=None, **kwargs):
+            keys.append((to_email, idempotency_key))
+            if len(keys) == 3:
+                raise KeyboardInterrupt  # simulated process crash mid-dispatch
+            return True
+
+        with mock.patch.object(sender, "send_email_smtp", side_effect=crash_after_two):
+            with self.assertRaises(KeyboardInterrupt):
+                sender.process_outreach_batch(dry_run=False, limit=6, commit_every=10)
+        # The two completed sends were checkpointed on the way out
+        self.assertEqual(self.statuses(), {"SENT": 2, "SENDING": 4})
+
+        # A crashed run's claims are only taken over once its lease has run out
+        with mock.patch.object(sender, "send_email_smtp") as send:
+            sender.process_outreach_batch(dry_run=False, limit=6)
+        self.assertNotIn(keys[2], [(c.args[0], c.kwargs["idempotency_key"]) for c in send.call_args_list])
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE leads SET send_claimed_at = datetime('now', '-1 hours') WHERE status = 'SENDING'")
+        conn.commit()
+        conn.close()
+
+        resent = []
+        with mock.patch.object(sender, "send_email_smtp", side_effect=lambda to, s, b, idempotency_key=None, from_account=None, **kwargs: resent.append((to, idempotency_key))):
+            sender.process_outreach_batch(dry_run=False, limit=6)
+        self.assertEqual(self.statuses(), {"SENT": 6})
+        self.assertEqual(resent, [keys[2]])
+
+    def test_overlapping_batches_send_each_lead_once(self):
+        """A live batch only sends the leads it claimed, not another batch's SENDING leads."""
+        sent = []
+        first_send, second_done = threading.Event(), threading.Event()
+
+        def send(to_email, *args, **kwargs):
+            sent.append(to_email)
+            if not first_send.is_set():
+                first_send.set()
+                second_done.wait(5)  # hold the first batch mid-dispatch
+            return True
+
+        with mock.patch.object(sender, "send_email_smtp", side_effect=send):
+            first = threading.Thread(target=sender.process_outreach_batch, kwargs={"dry_run": False, "limit": 4})
+            first.start()
+            self.assertTrue(first_send.wait(5))
+            sender.process_outreach_batch(dry_run=False, limit=6)
+            second_done.set()
+            first.join()
+        self.assertEqual(sorted(sent), sorted(f"lead{i}@company{i}.com" for i in range(6)))
+        self.assertEqual(self.statuses(), {"SENT": 6})
+
+
+    def test_failures_go_to_durable_retry_queue(self):
+        """A failed send is scheduled for a later attempt instead of blocking the batch."""
+        replies = [smtplib.SMTPResponseException(451, b"greylisted")]
+
+        def flaky(*args, **kwargs):
+            if replies:
+                raise replies.pop()
+            return True
+
+        with mock.patch.object(sender, "send_email_smtp", side_effect=flaky) as send:
+            sender.process_outreach_batch(dry_run=False, limit=6)
+        self.assertEqual(send.call_count, 6)
+        self.assertEqual(self.statuses(), {"SENT": 5, "RETRY": 1})
+
+        conn = sqlite3.connect(self.db_path)
+        attempts, state, delay = conn.execute(
+            "SELECT attempts, state, ROUND((julianday(next_attempt_at) - julianday('now')) * 86400) FROM send_retries"
+        ).fetchone()
+        conn.close()
+        self.assertEqual((attempts, state), (1, "SCHEDULED"))
+        self.assertAlmostEqual(delay, sender.retry_delay(1), delta=2)
+
+    def make_retries_due(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE send_retries SET next_attempt_at = datetime('now', '-1 seconds')")
+        conn.commit()
+        conn.close()
+
+    def test_due_retries_are_sent_then_dead_lettered(self):
+        """Due retries are picked up first; after MAX_ATTEMPTS the lead is dead-lettered."""
+        def always_fail(to_email, *args, **kwargs):
+            if to_email == "lead0@company0.com":
+                raise Exception("SMTP Connection Timeout")
+            return True
+
+        with mock.patch.object(sender, "send_email_smtp", side_effect=always_fail):
+            sender.process_outreach_batch(dry_run=False, limit=6)
+            # Not due yet: nothing to send
+            sender.process_outreach_batch(dry_run=False, limit=6)
+            self.assertEqual(self.statuses(), {"SENT": 5, "RETRY": 1})
+            self.assertEqual(server.get_pipeline_status()["RETRY_DUE"], 0)
+            for _ in range(sender.MAX_ATTEMPTS - 1):
+                self.make_retries_due()
+                self.assertEqual(server.get_pipeline_status()["RETRY_DUE"], 1)
+                sender.process_outreach_batch(dry_run=False, limit=6)
+        self.assertEqual(self.statuses(), {"SENT": 5, "FAILED": 1})
+
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute("SELECT attempts, state, last_error FROM send_retries").fetchone()
+        conn.close()
+        self.assertEqual(row, (sender.MAX_ATTEMPTS, "DEAD", "SMTP Connection Timeout"))
+
+        self.assertEqual(sender.requeue_dead_letters(), 1)
+        with mock.patch.object(sender, "send_email_smtp", return_value=True):
+            sender.process_outreach_batch(dry_run=False, limit=6)
+        self.assertEqual(self.statuses(), {"SENT": 6})
+
+
+class TestJobs(TempDBTestCase):
+
+    def setUp(self):
+        super().setUp()
+        database.add_leads(sample_leads(5))
+        self.manager = JobManager(max_workers=2)
+
+    def run_to_completion(self, tool, fn, **args):
+        job = self.manager.submit(tool, fn, **args)
+        self.manager.executor.shutdown(wait=True)
+        return job
+
+    def test_job_reports_progress_and_result(self):
+        job = self.run_to_completion("enrich_leads", server.JOB_TARGETS["enrich_leads"])
+        self.assertEqual(job.status, "done")
+        # The total is the leads actually eligible, not the batch limit
+        self.assertEqual((job.result, job.done, job.total), (5, 5, 5))
+        self.assertEqual(self.statuses(), {"ENRICHED": 5})
+
+    def test_cancel_after_the_last_lead_is_done(self):
+        """A cancel that arrives once the work is finished does not mark the job cancelled."""
+        def stage(progress, cancel):
+            def report(done, total):
+                progress(done, total)
+                if done == total:
+                    cancel.set()
+            return enrichment.process_enrichment_batch(limit=50, progress=report, cancel=cancel)
+
+        job = self.run_to_completion("enrich_leads", stage)
+        self.assertEqual((job.status, job.result), ("done", 5))
+
+    def test_generate_leads_reports_leads_added(self):
+        import lead_gen
+        with mock.patch.object(server, "jobs", self.manager), mock.patch.object(server, "JOB_POLL_SECONDS", 0.01), \
+             mock.patch.object(lead_gen, "generate_leads", return_value=sample_leads(7)):
+            message = asyncio.run(server.generate_leads(amount=7))
+        # Five of the seven already exist
+        self.assertIn("saved 2 new", message)
+
+    def test_cancel_commits_finished_leads(self):
+        """A cancelled stage stops after the current lead and keeps what it finished."""
+        def stage(progress, cancel):
+            def report(done, total):
+                progress(done, total)
+                if done == 2:
+                    cancel.set()
+            return enrichment.process_enrichment_batch(limit=50, progress=report, cancel=cancel)
+
+        job = self.run_to_completion("enrich_leads", stage)
+        self.assertEqual((job.status, job.result), ("cancelled", 2))
+        self.assertEqual(self.statuses(), {"ENRICHED": 2, "NEW": 3})
+
+    def test_failed_job_keeps_error(self):
+        def stage(progress, cancel):
+            raise RuntimeError("smtp down")
+
+        job = self.run_to_completion("send_outreach", stage)
+        self.assertEqual((job.status, job.error), ("failed", "smtp down"))
+        self.assertEqual(self.manager.list()[0]["status"], "failed")
+
+    def test_tool_call_forwards_progress_notifications(self):
+        ctx = mock.Mock(report_progress=mock.AsyncMock())
+        with mock.patch.object(server, "jobs", self.manager), mock.patch.object(server, "JOB_POLL_SECONDS", 0.01):
+            asyncio.run(server.enrich_leads(ctx=ctx))
+        ctx.report_progress.assert_awaited_with(5, 5, None)
+        self.assertEqual(self.statuses(), {"ENRICHED": 5})
+
+
+class TestAgentDecision(unittest.TestCase):
+    """The stage run_pipeline_step picks for given pipeline counts (MCP session faked)."""
+
+    def run_step(self, **counts):
+        stats = {status: 0 for status in server.PIPELINE_STATUSES + ["RETRY_DUE"]} | counts
+        started = []
+
+        class FakeSession:
+            def __init__(self, read, write):
+                pass
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def initialize(self):
+                pass
+
+            async def call_tool(self, name, arguments=None):
+                if name == "get_pipeline_status":
+                    text = str(stats)
+                else:
+                    started.append(arguments["tool"])
+                    text = json.dumps({"job_id": "j1", "tool": arguments["tool"], "status": "done"})
+                return mock.Mock(isError=False, content=[mock.Mock(text=text)])
+
+        @contextlib.asynccontextmanager
+        async def fake_client(params):
+            yield None, None
+
+        with mock.patch.object(agent, "stdio_client", fake_client), \
+             mock.patch.object(agent, "ClientSession", FakeSession), mock.patch("builtins.print"):
+            asyncio.run(agent.run_pipeline_step())
+        return started
+
+    def test_due_retries_are_sent(self):
+        """Only RETRY leads left: send once they are due, otherwise generate more leads."""
+        self.assertEqual(self.run_step(RETRY=3, RETRY_DUE=2, SENT=5), ["send_outreach"])
+        self.assertEqual(self.run_step(RETRY=3, SENT=5), ["generate_leads"])
+        self.assertEqual(self.run_step(NEW=1, RETRY_DUE=2), ["enrich_leads"])
+
+
+class TestAgentRuns(unittest.TestCase):
+    """run_agent_step against stand-in agent scripts (no MCP server needed)."""
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+
+    def fake_agent(self, body):
+        path = os.path.join(self.workdir.name, "agent.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(textwrap.dedent(body))
+        patcher = mock.patch.object(agent_runs, "AGENT_SCRIPT", path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_progress_lines_are_forwarded(self):
+        self.fake_agent("""
+            import json, sys
+            print("DECISION: Found NEW leads. Running enrichment...")
+            print("PROGRESS: " + json.dumps({"tool": "enrich_leads", "status": "running", "progress": 20, "total": 50, "message": None}))
+            print("args", sys.argv[1:])
+            print("server noise", file=sys.stderr)
+        """)
+        reports = []
+        result = agent_runs.run_agent_step(dry_run=False, campaign="q3", progress=lambda *a: reports.append(a))
+        self.assertEqual(reports, [(0, None, "Found NEW leads. Running enrichment..."), (20, 50, "enrich_leads: running")])
+        self.assertEqual(result["decision"], "Found NEW leads. Running enrichment...")
+        self.assertEqual(result["log"][-1], "args ['--live', '--campaign', 'q3']")
+
+    def test_runs_queue_and_cancel(self):
+        """Runs execute one at a time; cancelling sends SIGTERM to the running one and skips queued ones."""
+        self.fake_agent("""
+            import signal, sys, time
+            signal.signal(signal.SIGTERM, lambda *a: (print("stopped cleanly"), sys.exit(0)))
+            print("DECISION: waiting", flush=True)
+            time.sleep(30)
+        """)
+        runs = agent_runs.new_run_manager()
+        first = runs.submit("agent_step", agent_runs.run_agent_step)
+        second = runs.submit("agent_step", agent_runs.run_agent_step)
+        deadline = time.time() + 10
+        while first.message is None and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual((first.status, second.status), ("running", "queued"))
+        runs.cancel(second.id)
+        runs.cancel(first.id)
+        first.future.result(timeout=10)
+        second.future.result(timeout=10)
+        self.assertEqual((first.status, second.status), ("cancelled", "cancelled"))
+        self.assertEqual(first.result["log"][-1], "stopped cleanly")
+        self.assertIsNone(second.result)
+
+    def test_failed_step_reports_stderr(self):
+        self.fake_agent("""
+            import sys
+            sys.exit("server unreachable")
+        """)
+        with self.assertRaisesRegex(RuntimeError, "server unreachable"):
+            agent_runs.run_agent_step()
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_server_import_is_lazy(self):
+        """Stage modules, Faker and the analytics stack load on first tool use, not at startup."""
+        _, eager = import_time("server")
+        self.assertEqual(eager, [])
+
+
+class TestLoadTestReport(unittest.TestCase):
+
+    def test_summary_percentiles_errors_and_write_latency(self):
+        samples = [("get_pipeline_status", i / 1000, True) for i in range(1, 101)]
+        samples += [("enrich_leads", 0.5, False), ("enrich_leads", 0.1, True)]
+        report = loadtest.summarize(samples, elapsed=2.0)
+        status = report["tools"]["get_pipeline_status"]
+        self.assertEqual((status["p50_ms"], status["p95_ms"], status["p99_ms"]), (50, 95, 99))
+        self.assertEqual(report["tools"]["enrich_leads"]["error_rate"], 0.5)
+        self.assertEqual(report["overall"]["requests"], 102)
+        self.assertEqual(report["overall"]["throughput_rps"], 51)
+        # Writes (where lock waits land) are reported apart from reads
+        self.assertEqual((report["reads"]["requests"], report["reads"]["p99_ms"]), (100, 99))
+        self.assertEqual((report["writes"]["requests"], report["writes"]["p99_ms"]), (2, 500))
+
+    def test_mix_rejects_unsafe_tools(self):
+        self.assertEqual(loadtest.parse_mix("get_pipeline_status=3,enrich_leads"), {"get_pipeline_status": 3, "enrich_leads": 1})
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix("manage_campaign=1")
+
+
+class TestDispatchScheduler(TempDBTestCase):
+
+    def lead(self, i, domain):
+        return {"id": i, "email": f"lead{i}@{domain}"}
+
+    def plan(self, leads, limit=10, horizon=600, **kwargs):
+        conn = database.connect()
+        planner = SendPlanner(conn.cursor(), now=0.0, **kwargs)
+        plan = planner.plan(leads, limit, horizon)
+        planner.save()
+        conn.commit()
+        conn.close()
+        return [(lead["id"], account, at) for lead, account, at in plan]
+
+    def test_domains_are_interleaved(self):
+        """A domain waiting on its limit gives way to other domains."""
+        leads = [self.lead(i, "big.com") for i in range(4)] + [self.lead(10, "small.com")]
+        plan = self.plan(leads, account_rate=60, domain_rate=30)
+        self.assertEqual([lead_id for lead_id, _, _ in plan][:3], [0, 10, 1])
+
+    def test_domain_and_account_limits(self):
+        """Sends wait for the slower of the domain and account limits."""
+        plan = self.plan([self.lead(i, "one.com") for i in range(3)], accounts=("a", "b"), account_rate=10, domain_rate=6)
+        # Same domain: one send per 10 s despite two accounts with spare capacity
+        self.assertEqual([at for _, _, at in plan], [0.0, 10.0, 20.0])
+        self.assertEqual([account for _, account, _ in plan], ["a", "b", "a"])
+
+    def test_limits_persist_across_planners(self):
+        """A later plan books after the earlier one instead of starting with a full allowance."""
+        self.plan([self.lead(i, f"d{i}.com") for i in range(2)], account_rate=10)
+        plan = self.plan([self.lead(5, "d5.com")], account_rate=10)
+        self.assertEqual(plan, [(5, "default", 12.0)])
+        # Beyond the horizon nothing is booked
+        self.assertEqual(self.plan([self.lead(6, "d6.com")], horizon=10), [])
+
+    def test_deferral_slows_domain(self):
+        limit = RateLimit(6)
+        limit.slow_down(now=100.0)
+        self.assertEqual(limit.rate_per_min, 3)
+        self.assertEqual(limit.next_at, 120.0)
+        limit.recover()
+        self.assertEqual(limit.rate_per_min, 3.5)
+
+    def test_deferral_is_shared(self):
+        """A 4xx reply slows the recipient domain for every later plan."""
+        self.assertTrue(sender.is_deferral(smtplib.SMTPResponseException(451, b"try later")))
+        conn = database.connect()
+        record_deferral(conn, "slow.com", now=0.0)
+        self.assertEqual(load_limits(conn.cursor(), "domain", ["slow.com"], 6)["slow.com"].rate_per_min, 3)
+        conn.close()
+        self.assertEqual(self.plan([self.lead(1, "slow.com")]), [(1, "default", 20.0)])
+
+
+class TestSendRateLimits(TempDBTestCase):
+    """The shared limits hold across consecutive batches and concurrent jobs, on the real clock."""
+
+    ACCOUNT_RATE = 300  # one send per 0.2 s
+    DOMAIN_RATE = 150   # one send per 0.4 s per domain
+
+    def setUp(self):
+        super().setUp()
+        # Two domains, so both the account and the domain limits are exercised
+        leads = sample_leads(8)
+        for i, lead in enumerate(leads):
+            lead["email"] = f"lead{i}@domain{i % 2}.com"
+        database.add_leads(leads)
+        enrichment.process_enrichment_batch(limit=8)
+        message_gen.generate_messages_batch(limit=8)
+        self.sent = []
+        self.sent_lock = threading.Lock()
+        for p in (
+            mock.patch.object(sender, "SendPlanner", functools.partial(
+                SendPlanner, account_rate=self.ACCOUNT_RATE, domain_rate=self.DOMAIN_RATE)),
+            mock.patch.object(sender, "send_email_smtp", side_effect=self.send),
+        ):
+            p.start()
+            self.patches.append(p)
+
+    def send(self, to_email, *args, **kwargs):
+        with self.sent_lock:
+            self.sent.append((time.time(), to_email.split("@")[1]))
+        return True
+
+    def assert_spacing(self, times, interval):
+        times = sorted(times)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        # Allow for thread wake-up jitter only
+        self.assertGreaterEqual(min(gaps), interval - 0.05, gaps)
+
+    def test_limits_hold_across_batches_and_jobs(self):
+        sender.process_outreach_batch(dry_run=False, limit=2)
+        sender.process_outreach_batch(dry_run=False, limit=2)
+        manager = JobManager(max_workers=2)
+        jobs = [manager.submit("send_outreach", sender.process_outreach_batch, dry_run=False, limit=2) for _ in range(2)]
+        manager.executor.shutdown(wait=True)
+        self.assertEqual([job.status for job in jobs], ["done", "done"])
+
+        self.assertEqual(len(self.sent), 8)
+        self.assertEqual(self.statuses(), {"SENT": 8})
+        self.assert_spacing([at for at, _ in self.sent], 60 / self.ACCOUNT_RATE)
+        for domain in ("domain0.com", "domain1.com"):
+            self.assert_spacing([at for at, d in self.sent if d == domain], 60 / self.DOMAIN_RATE)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file